@@ -0,0 +1,389 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_algorithms.py                        #
+# Description: Other algorithms to generate the maze, besides the     #
+#              recursive backtracker (DFS) of MazeGenerator.step().   #
+#              mz.set_algorithm(Kruskal()) and then generate(),       #
+#              generate_headless(), the schedules and the renderers   #
+#              work the same. All of them only carve cells inside the #
+#              mask and only record EVENT_CARVE between 2 neighbors   #
+#              and the final EVENT_END, so there are no backtracking  #
+#              frames, N cells are N - 1 frames.                      #
+#                                                                     #
+#              Time and memory, N is the number of cells:             #
+#                Backtracker   (default) O(N), stack up to 8 bytes /  #
+#                              cell, long corridors.                  #
+#                Kruskal       O(N a(N)), 24 bytes / cell (edges and  #
+#                              union-find), a tree on each blob.      #
+#                Wilson        cover time of a random walk, about     #
+#                              O(N log(N)^2) on a grid, the slowest,  #
+#                              9 bytes / cell. Uniform spanning tree. #
+#                Prim          O(N), frontier up to 8 bytes / cell +  #
+#                              1 byte / cell, short dead ends.        #
+#                GrowingTree   O(N), active list up to 8 bytes / cell,#
+#                              newest is like the backtracker, oldest #
+#                              long straight corridors, random like   #
+#                              Prim.                                  #
+#              For very large grids Prim and GrowingTree("random")    #
+#              are the cheapest in memory, their lists stay much      #
+#              shorter than the stack of the backtracker.             #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+
+from array import array
+
+import numpy as np
+
+from masked_maze_generator_core import EVENT_CARVE, EVENT_END, WALL_RIGHT, WALL_BOTTOM
+
+
+# NumPy type of the array('l') of cell indexes.
+INDEX_DTYPE = np.dtype("i%d" % array('l').itemsize)
+
+
+class MazeAlgorithm:
+
+    # Starts again on the grid of the generator, all walls up.
+    def reset(self, gen_maze):
+        raise NotImplementedError("ERROR in MazeAlgorithm, reset() has to be implemented!")
+
+
+    # One step, carves one passage and updates the grid of the generator.
+    # Return's (kind, index_from, index_to), index_to is the new current cell.
+    def step(self, gen_maze):
+        raise NotImplementedError("ERROR in MazeAlgorithm, step() has to be implemented!")
+
+
+    # The parameters of the algorithm (not it's state), part of the key of
+    # the cache, see masked_maze_generator_cache.py .
+    def params(self):
+        return ()
+
+
+def carve(grid, index_from, index_to):
+    grid.visited[index_from] = 1
+    grid.visited[index_to]   = 1
+    grid.remove_walls(index_from, index_to)
+    return (EVENT_CARVE, index_from, index_to)
+
+
+# Random neighbor inside the mask with visited equal to want_visited, or -1.
+def random_neighbor(gen_maze, index, want_visited):
+    grid       = gen_maze.grid
+    bits       = grid.neighbor_bits[index]
+    visited    = grid.visited
+    candidates = gen_maze.candidates
+    num = 0
+    for bit, offset in grid.directions:
+        if bits & bit and visited[index + offset] == want_visited:
+            candidates[num] = index + offset
+            num += 1
+    if num > 0:
+        return candidates[gen_maze.rng.randrange(num)]
+    return -1
+
+
+# Indexes of the cells connected to the start cell, column by column.
+def reachable_index_lst(gen_maze):
+    from masked_maze_generator_components import label_mask_components
+    labels, _ = label_mask_components(gen_maze.grid.mask_2d())
+    flat = labels.reshape(-1)
+    label = flat[gen_maze.start_index]
+    return array('l', [index for index in gen_maze.grid.inside_mask_index_lst() if flat[index] == label])
+
+
+# Randomized Kruskal, the walls between the cells inside the mask in a
+# random order, each one is removed if the 2 cells aren't already
+# connected (union-find with path halving). Each blob of the mask gets
+# it's own tree.
+class Kruskal(MazeAlgorithm):
+
+    def reset(self, gen_maze):
+        grid = gen_maze.grid
+        bits = np.frombuffer(grid.neighbor_bits, dtype=np.uint8)
+        # Edge 2 * index to the right neighbor, 2 * index + 1 to the bottom one.
+        edges = np.concatenate((np.flatnonzero(bits & WALL_RIGHT) * 2, np.flatnonzero(bits & WALL_BOTTOM) * 2 + 1))
+        # The shuffle with NumPy seeded by the generator, the same maze for the same seed.
+        np_rng = np.random.Generator(np.random.PCG64(gen_maze.rng.getrandbits(64)))
+        self.edges = array('l')
+        self.edges.frombytes(np_rng.permutation(edges).astype(INDEX_DTYPE).tobytes())
+        self.next_edge = 0
+        self.parent = array('l', range(grid.cols * grid.rows))
+
+
+    def find(self, index):
+        parent = self.parent
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+
+    def step(self, gen_maze):
+        cols  = gen_maze.cols
+        edges = self.edges
+        while self.next_edge < len(edges):
+            edge = edges[self.next_edge]
+            self.next_edge += 1
+            index_a = edge >> 1
+            index_b = index_a + (cols if edge & 1 else 1)
+            root_a = self.find(index_a)
+            root_b = self.find(index_b)
+            if root_a != root_b:
+                self.parent[root_b] = root_a
+                return carve(gen_maze.grid, index_a, index_b)
+        return (EVENT_END, gen_maze.curr_index, gen_maze.curr_index)
+
+
+# Wilson, loop erased random walks. From each cell not yet in the tree a
+# random walk until it hits the tree, each cell remembers only the last
+# direction it left by (that erases the loops), then the walk is carved
+# one passage per step. All the spanning trees are equally likely. Only
+# the blob of the start cell, a walk can't reach the other ones.
+class Wilson(MazeAlgorithm):
+
+    def reset(self, gen_maze):
+        grid = gen_maze.grid
+        self.index_lst  = reachable_index_lst(gen_maze)
+        self.next_cell  = 0
+        self.direction  = bytearray(grid.cols * grid.rows)   # Offset number of the last exit of each cell.
+        self.walk_index = -1                                 # Cell of the walk being carved, or -1.
+        grid.visited[gen_maze.start_index] = 1
+
+
+    def random_walk(self, gen_maze, index):
+        grid       = gen_maze.grid
+        directions = grid.directions
+        visited    = grid.visited
+        direction  = self.direction
+        randrange  = gen_maze.rng.randrange
+        candidates = gen_maze.candidates
+        while not visited[index]:
+            bits = grid.neighbor_bits[index]
+            num = 0
+            for k, (bit, _) in enumerate(directions):
+                if bits & bit:
+                    candidates[num] = k
+                    num += 1
+            k = candidates[randrange(num)]
+            direction[index] = k
+            index += directions[k][1]
+
+
+    def step(self, gen_maze):
+        grid = gen_maze.grid
+        if self.walk_index < 0:
+            index_lst = self.index_lst
+            while self.next_cell < len(index_lst) and grid.visited[index_lst[self.next_cell]]:
+                self.next_cell += 1
+            if self.next_cell == len(index_lst):
+                return (EVENT_END, gen_maze.curr_index, gen_maze.curr_index)
+            self.walk_index = index_lst[self.next_cell]
+            self.random_walk(gen_maze, self.walk_index)
+
+        index_from = self.walk_index
+        index_to   = index_from + grid.directions[self.direction[index_from]][1]
+        self.walk_index = -1 if grid.visited[index_to] else index_to
+        return carve(grid, index_from, index_to)
+
+
+# Randomized Prim, a random cell of the frontier (unvisited neighbors of
+# the tree) is joined to a random neighbor already in the tree. Only the
+# blob of the start cell.
+class Prim(MazeAlgorithm):
+
+    def reset(self, gen_maze):
+        grid = gen_maze.grid
+        self.frontier    = array('l')
+        self.in_frontier = bytearray(grid.cols * grid.rows)
+        grid.visited[gen_maze.start_index] = 1
+        self.add_frontier(grid, gen_maze.start_index)
+
+
+    def add_frontier(self, grid, index):
+        bits = grid.neighbor_bits[index]
+        for bit, offset in grid.directions:
+            n = index + offset
+            if bits & bit and not grid.visited[n] and not self.in_frontier[n]:
+                self.in_frontier[n] = 1
+                self.frontier.append(n)
+
+
+    def step(self, gen_maze):
+        grid = gen_maze.grid
+        frontier = self.frontier
+        if len(frontier) == 0:
+            return (EVENT_END, gen_maze.curr_index, gen_maze.curr_index)
+        k = gen_maze.rng.randrange(len(frontier))
+        index = frontier[k]
+        frontier[k] = frontier[-1]
+        frontier.pop()
+        event = carve(grid, random_neighbor(gen_maze, index, 1), index)
+        self.add_frontier(grid, index)
+        return event
+
+
+# Picking policies of the GrowingTree.
+POLICY_NEWEST = "newest"
+POLICY_OLDEST = "oldest"
+POLICY_RANDOM = "random"
+POLICY_MIXED  = "mixed"     # newest with probability newest_weight, else random.
+
+
+# Growing tree, a list of active cells, on each step one is picked by the
+# policy and carved to a random unvisited neighbor (that joins the list),
+# the cells without unvisited neighbors leave the list. Only the blob of
+# the start cell.
+class GrowingTree(MazeAlgorithm):
+
+    def __init__(self, policy=POLICY_NEWEST, newest_weight=0.5):
+        if policy not in (POLICY_NEWEST, POLICY_OLDEST, POLICY_RANDOM, POLICY_MIXED):
+            raise ValueError("ERROR in GrowingTree, unknown policy %s!" % policy)
+        self.policy        = policy
+        self.newest_weight = newest_weight
+
+
+    def params(self):
+        return (self.policy, self.newest_weight)
+
+
+    def reset(self, gen_maze):
+        self.active = array('l', [gen_maze.start_index])
+        self.head   = 0                 # The cells before head already left the list.
+        gen_maze.grid.visited[gen_maze.start_index] = 1
+
+
+    def pick(self, rng):
+        policy = self.policy
+        if policy == POLICY_NEWEST or (policy == POLICY_MIXED and rng.random() < self.newest_weight):
+            return len(self.active) - 1
+        if policy == POLICY_OLDEST:
+            return self.head
+        return rng.randrange(self.head, len(self.active))
+
+
+    # Removes the cell at pos. The other cells stay in the order they
+    # joined the list, the last one is the newest. Only for the random
+    # policy, where the order doesn't matter, the last one takes it's place.
+    def remove(self, pos):
+        active = self.active
+        if pos == self.head:
+            self.head += 1
+            if self.head > 1024 and self.head * 2 > len(active):
+                del active[:self.head]
+                self.head = 0
+        elif self.policy == POLICY_RANDOM:
+            active[pos] = active[-1]
+            active.pop()
+        else:
+            del active[pos]
+
+
+    def step(self, gen_maze):
+        grid = gen_maze.grid
+        while self.head < len(self.active):
+            pos = self.pick(gen_maze.rng)
+            index = self.active[pos]
+            next_index = gen_maze.choose_neighbor(index)
+            if next_index >= 0:
+                self.active.append(next_index)
+                return carve(grid, index, next_index)
+            self.remove(pos)
+        return (EVENT_END, gen_maze.curr_index, gen_maze.curr_index)
+
+
+# By name, for the command line and the batch jobs.
+ALGORITHMS = {
+    "kruskal"     : Kruskal,
+    "wilson"      : Wilson,
+    "prim"        : Prim,
+    "growing_tree": GrowingTree,
+}
+
+
+###############
+# Unit test's #
+###############
+
+# True if the cells visited are a tree, connected and without loops.
+def is_perfect_maze(grid, start_index):
+    seen = {start_index}
+    stack = [start_index]
+    num_passages = 0
+    while stack:
+        index = stack.pop()
+        for bit, offset in grid.directions:
+            if grid.neighbor_bits[index] & bit and not grid.walls[index] & bit:
+                num_passages += 1
+                if index + offset not in seen:
+                    seen.add(index + offset)
+                    stack.append(index + offset)
+    return len(seen) == sum(grid.visited) and num_passages // 2 == len(seen) - 1
+
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst,
+                                                                         write_mask_test=False)
+    algorithm_lst = [ Kruskal(), Wilson(), Prim(), GrowingTree(POLICY_NEWEST), GrowingTree(POLICY_OLDEST),
+                      GrowingTree(POLICY_RANDOM), GrowingTree(POLICY_MIXED) ]
+    for algorithm in algorithm_lst:
+        logs = []
+        for _ in range(2):
+            mz = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
+                                cell_len=cell_len, mask=mask)
+            mz.set_seed(1)
+            mz.set_algorithm(algorithm)
+            logs.append(list(mz.generate_headless()))
+        # Same seed same maze, all the cells of the mask and a perfect maze.
+        if logs[0] != logs[1] or sum(mz.grid.visited) != sum(mz.grid.inside_mask):
+            ok = False
+        if not is_perfect_maze(mz.grid, mz.start_index) or len(logs[0]) != sum(mz.grid.visited):
+            ok = False
+
+    # The mixed policy keeps the active cells in the order they joined.
+    mz = MazeGenerator(i_init=0, j_init=0, x_max=20, y_max=20, cell_len=1)
+    mz.set_seed(2)
+    growing_tree = GrowingTree(POLICY_MIXED, 0.5)
+    mz.set_algorithm(growing_tree)
+    join_order = {mz.start_index: 0}
+    while mz.step() != EVENT_END:
+        join_order.setdefault(mz.curr_index, len(join_order))
+        order = [join_order[index] for index in growing_tree.active[growing_tree.head:]]
+        if order != sorted(order):
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the maze algorithms....\n\n")
+    runTests()
+    print("\n...Finished running tests to the maze algorithms....")
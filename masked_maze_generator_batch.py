@@ -0,0 +1,246 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_batch.py                             #
+# Description: Batch generation of many mazes (seeds and / or masks)  #
+#              over a pool of processes. Each job has it's own        #
+#              MazeGenerator with it's own random.Random, so the      #
+#              result of a job only depends on it's parameters and    #
+#              not on the other jobs or on the order they run. Each   #
+#              job writes to it's own output dir and the runner       #
+#              writes a JSON manifest with the result of every job.   #
+#######################################################################
+
+import os
+import sys
+import json
+import time
+import traceback
+import multiprocessing
+
+from masked_maze_generator_core import MazeGenerator, process_mask, EVENT_CARVE
+
+
+# Kinds of output of a job.
+OUTPUT_FINAL_SVG = "final_svg"    # Only the final maze, compact SVG.
+OUTPUT_SVG       = "svg"          # All the SVG frames, like generate().
+OUTPUT_ANIM      = "anim"         # Animated GIF streamed from the raster frames.
+
+
+class MazeJob:
+
+    def __init__(self, filepath_mask, cell_len, color_mask_lst, seed, output_dir,
+                 maze_name="maze", outputs=(OUTPUT_FINAL_SVG,), tolerance=0, schedule=None,
+                 coverage=None):
+        self.filepath_mask  = filepath_mask
+        self.cell_len       = cell_len
+        self.color_mask_lst = [tuple(color) for color in color_mask_lst]
+        self.seed           = seed
+        self.output_dir     = output_dir
+        self.maze_name      = maze_name
+        self.outputs        = tuple(outputs)
+        self.tolerance      = tolerance
+        self.schedule       = schedule
+        self.coverage       = coverage
+
+
+    def to_dict(self):
+        return {
+            "filepath_mask"  : self.filepath_mask,
+            "cell_len"       : self.cell_len,
+            "color_mask_lst" : [list(color) for color in self.color_mask_lst],
+            "seed"           : self.seed,
+            "output_dir"     : self.output_dir,
+            "maze_name"      : self.maze_name,
+            "outputs"        : list(self.outputs),
+            "tolerance"      : self.tolerance,
+            "coverage"       : self.coverage,
+        }
+
+
+# One job for each seed, each one in "<output_root>/<maze_name>_seed_<seed>/".
+def jobs_from_seeds(filepath_mask, cell_len, color_mask_lst, seeds, output_root, maze_name="maze",
+                    outputs=(OUTPUT_FINAL_SVG,)):
+    job_lst = []
+    for seed in seeds:
+        name = "%s_seed_%s" % (maze_name, seed)
+        job_lst.append(MazeJob(filepath_mask, cell_len, color_mask_lst, seed,
+                               os.path.join(output_root, name), name, outputs))
+    return job_lst
+
+
+# Runs one job, in a worker process. Never raises, the error goes to the result.
+def run_job(job_pair):
+    job_num, job = job_pair
+    time_start = time.time()
+    result = {"job": job_num, "maze_name": job.maze_name, "seed": job.seed, "files": [], "ok": False}
+    try:
+        os.makedirs(job.output_dir, exist_ok=True)
+        # No mask_test.png, the jobs can share the same mask file.
+        i_init, j_init, mask, x_max, y_max = process_mask(job.filepath_mask, job.cell_len, job.color_mask_lst,
+                                                          tolerance=job.tolerance, write_mask_test=False,
+                                                          coverage=job.coverage)
+        if i_init < 0:
+            raise ValueError("ERROR in run_job the mask %s doesn't have any cell with the colors %s"
+                             % (job.filepath_mask, job.color_mask_lst))
+        mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max,
+                           cell_len=job.cell_len, maze_name=job.maze_name, mask=mask)
+        mz.set_seed(job.seed)
+
+        event_log = mz.generate_headless()
+        if OUTPUT_SVG in job.outputs:
+            # The SVG frames replayed from the event log, like generate().
+            mz.set_output_dir(job.output_dir)
+            mz.compact_svg = True
+            if job.schedule != None:
+                selected = job.schedule.frame_mask(event_log)
+            else:
+                selected = bytearray(b"\x01") * len(event_log)
+            mz.reset()
+            mz.replay_scheduled(selected)
+            result["files"].extend(mz.subdir_svg + file_svg for file_svg in mz.file_svg_lst)
+
+        if OUTPUT_FINAL_SVG in job.outputs:
+            from masked_maze_generator_svg import write_compact_svg_frame
+            filepath = os.path.join(job.output_dir, job.maze_name + "_final.svg")
+            write_compact_svg_frame(filepath, mz.grid, mz.w, mz.x_max, mz.y_max)
+            result["files"].append(filepath)
+
+        if OUTPUT_ANIM in job.outputs:
+            from masked_maze_generator_raster import process_event_log_to_anim
+            filepath = os.path.join(job.output_dir, job.maze_name + "_anim.gif")
+            process_event_log_to_anim(mz, event_log, filepath, scale=2, schedule=job.schedule)
+            result["files"].append(filepath)
+
+        result["cols"]       = mz.cols
+        result["rows"]       = mz.rows
+        result["num_cells"]  = event_log.count(EVENT_CARVE) + 1
+        result["num_events"] = len(event_log)
+        result["ok"]         = True
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["seconds"] = time.time() - time_start
+    return result
+
+
+# Runs the jobs over workers processes (None is all the cores, 1 runs in
+# this process). Return's the list of results in the order of the jobs
+# and, with manifest_path, writes them to a JSON manifest.
+def run_batch(job_lst, workers=None, manifest_path=None, progress=True):
+    if workers == None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(job_lst)))
+    print("Start running %d maze jobs with %d workers ..." % (len(job_lst), workers))
+    time_start = time.time()
+
+    result_lst = [None] * len(job_lst)
+    job_pair_lst = list(enumerate(job_lst))
+    if workers == 1:
+        results = map(run_job, job_pair_lst)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes=workers)
+        results = pool.imap_unordered(run_job, job_pair_lst)
+    try:
+        for done, result in enumerate(results, 1):
+            result_lst[result["job"]] = result
+            if progress:
+                sys.stdout.write("\r  %d / %d jobs, %.1fs " % (done, len(job_lst), time.time() - time_start))
+                sys.stdout.flush()
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+    if progress:
+        sys.stdout.write("\n")
+
+    num_failed = sum(1 for result in result_lst if not result["ok"])
+    if manifest_path != None:
+        manifest = {
+            "num_jobs"   : len(job_lst),
+            "num_failed" : num_failed,
+            "seconds"    : time.time() - time_start,
+            "jobs"       : [dict(job.to_dict(), **result) for job, result in zip(job_lst, result_lst)],
+        }
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+    print("...ending running maze jobs, %d failed" % num_failed)
+    return result_lst
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    # The same seeds give the same mazes, in serial or in parallel, and
+    # different seeds give different mazes.
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        contents = []
+        for workers in [1, 3]:
+            output_root = os.path.join(tmp_dir, "batch_%d" % workers)
+            job_lst = jobs_from_seeds(filepath_mask, 6, [ (0, 0, 0) ], [1, 2, 3], output_root, "peace")
+            manifest_path = os.path.join(tmp_dir, "manifest_%d.json" % workers)
+            result_lst = run_batch(job_lst, workers=workers, manifest_path=manifest_path, progress=False)
+            if not all(result["ok"] for result in result_lst):
+                ok = False
+            with open(manifest_path) as f:
+                if json.load(f)["num_jobs"] != 3:
+                    ok = False
+            data_lst = []
+            for result in result_lst:
+                with open(result["files"][0]) as f:
+                    data_lst.append(f.read())
+            contents.append(data_lst)
+        if contents[0] != contents[1]:
+            ok = False
+        if contents[0][0] == contents[0][1] or contents[0][1] == contents[0][2]:
+            ok = False
+
+        # All the SVG frames, the same ones of generate().
+        job = MazeJob(filepath_mask, 6, [ (0, 0, 0) ], 1, os.path.join(tmp_dir, "svg"), "peace",
+                      outputs=(OUTPUT_SVG,))
+        result = run_job((0, job))
+        i_init, j_init, mask, x_max, y_max = process_mask(filepath_mask, 6, [ (0, 0, 0) ], write_mask_test=False)
+        mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max, cell_len=6,
+                           maze_name="peace", mask=mask)
+        mz.set_seed(1)
+        mz.set_output_dir(os.path.join(tmp_dir, "svg_ref"))
+        mz.compact_svg = True
+        mz.generate()
+        if not result["ok"] or len(result["files"]) != len(mz.file_svg_lst):
+            ok = False
+        for filepath, file_svg in zip(result["files"], mz.file_svg_lst):
+            with open(filepath) as f, open(mz.subdir_svg + file_svg) as f_ref:
+                if f.read() != f_ref.read():
+                    ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the batch runner....\n\n")
+    runTests()
+    print("\n...Finished running tests to the batch runner....")
@@ -0,0 +1,354 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_benchmark.py                         #
+# Description: Benchmarks of each stage of the pipeline, over         #
+#              synthetic masks (no downloads) from 1k to 1M cells.    #
+#              For each size and stage it measures the time (the best #
+#              of the repeats) and the peak of memory (tracemalloc,   #
+#              in a separate run so it doesn't slow the timing).      #
+#              The stages that make frames only make a few of them    #
+#              and also give the time per frame.                      #
+#                                                                     #
+#              The results go to a JSON file and are compared with a  #
+#              saved baseline, the stages slower or bigger than the   #
+#              baseline more than the tolerance are regressions.      #
+#                                                                     #
+#              python masked_maze_generator_benchmark.py run          #
+#                  [results.json] [baseline.json]                     #
+#              Without arguments it runs the unit tests.              #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+#   -pillow
+
+import os
+import io
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+
+import numpy as np
+
+# Pillow lib
+from PIL import Image
+
+from masked_maze_generator_core import MazeGenerator, process_mask
+
+
+DEFAULT_SIZES  = [1000, 10000, 100000, 1000000]
+DEFAULT_STAGES = ["process_mask", "generate_headless", "draw_step", "svg_write", "svg_write_compact",
+                  "svg2png", "raster_frames", "gif", "gif_delta"]
+# The stages with one <g> for each cell (draw_step, svg_write) and the
+# SVG -> PNG of renderPM take minutes for each frame of a big mask, above
+# these numbers of cells they are skipped.
+STAGE_MAX_CELLS = {
+    "draw_step" : 100000,
+    "svg_write" : 100000,
+    "svg2png"   : 100000,
+}
+
+
+# Black shape on a white image with about num_cells cells of cell_len
+# pixels inside the shape. The same image for the same parameters.
+def synthetic_mask_image(num_cells, cell_len=4, shape="disc"):
+    if shape == "disc":
+        side = int(math.ceil(math.sqrt(num_cells / (math.pi / 4)))) + 2
+    elif shape == "rings":
+        side = int(math.ceil(math.sqrt(num_cells / 0.5))) + 2
+    else:
+        side = int(math.ceil(math.sqrt(num_cells))) + 2
+    size = side * cell_len
+    yy, xx = np.mgrid[0:size, 0:size]
+    c = (size - 1) / 2
+    r = np.hypot(xx - c, yy - c) / (size / 2)
+    if shape == "disc":
+        inside = r < 1.0
+    elif shape == "rings":
+        # Rings joined by a bar, a single blob.
+        inside = ((r * 8).astype(np.int64) % 2 == 0) & (r < 1.0) | ((np.abs(xx - c) < size / 16) & (r < 1.0))
+    else:
+        inside = np.ones((size, size), dtype=bool)
+    img = np.full((size, size, 3), 255, dtype=np.uint8)
+    img[inside] = 0
+    return Image.fromarray(img, "RGB")
+
+
+def write_synthetic_mask(filepath, num_cells, cell_len=4, shape="disc"):
+    synthetic_mask_image(num_cells, cell_len, shape).save(filepath, "PNG")
+
+
+# Runs run(setup()) repeats times and once more with tracemalloc.
+# Return's (best seconds, peak bytes, result of the last run).
+def measure(setup, run, repeats=1, measure_memory=True):
+    best = None
+    for _ in range(repeats):
+        state = setup()
+        time_start = time.perf_counter()
+        result = run(state)
+        seconds = time.perf_counter() - time_start
+        best = seconds if best == None else min(best, seconds)
+    peak = None
+    if measure_memory:
+        state = setup()
+        tracemalloc.start()
+        try:
+            run(state)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return (best, peak, result)
+
+
+# Benchmarks the stages for one size of mask, inside work_dir. Return's a
+# list of results, one dict for each stage.
+def benchmark_size(num_cells, work_dir, stages=DEFAULT_STAGES, cell_len=4, shape="disc", seed=1,
+                   num_frames=5, repeats=1, measure_memory=True):
+    filepath_mask = os.path.join(work_dir, "mask_%d.png" % num_cells)
+    write_synthetic_mask(filepath_mask, num_cells, cell_len, shape)
+    color_mask_lst = [ (0, 0, 0) ]
+    i_init, j_init, mask, x_max, y_max = process_mask(filepath_mask, cell_len, color_mask_lst, write_mask_test=False)
+    num_inside = int(mask.sum())
+
+    def new_maze(subdir):
+        mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max, cell_len=cell_len,
+                           maze_name="bench", mask=mask)
+        mz.set_seed(seed)
+        mz.set_output_dir(os.path.join(work_dir, subdir))
+        return mz
+
+    def generated_maze(subdir):
+        mz = new_maze(subdir)
+        mz.generate_headless()
+        return mz
+
+    def draw_steps(mz):
+        for _ in range(num_frames):
+            mz.draw_step()
+
+    def write_final(compact):
+        def run(mz):
+            mz.compact_svg = compact
+            mz.draw_frame()
+            return os.path.getsize(mz.subdir_svg + mz.file_svg_lst[-1])
+        return run
+
+    def svg2png_setup():
+        mz = generated_maze("svg2png")
+        mz.compact_svg = True
+        for _ in range(num_frames):
+            mz.draw_frame()
+        return [(mz.subdir_svg + name, mz.subdir_png + name[:-4] + ".png") for name in mz.file_svg_lst]
+
+    def svg2png_run(pairs):
+        from masked_maze_generator_svg2png import rasterize_svg_lst
+        rasterize_svg_lst(pairs, workers=1, progress=None)
+
+    def raster_run(mz):
+        from masked_maze_generator_raster import RasterFrameRenderer
+        renderer = RasterFrameRenderer(mz, scale=1)
+        frames = 0
+        for frame in renderer.iter_frames(mz.event_log):
+            frames += 1
+            if frames == num_frames:
+                break
+
+    def gif_setup():
+        from masked_maze_generator_raster import process_event_log_to_png
+        from masked_maze_generator_schedule import FrameBudget
+        mz = generated_maze("gif")
+        png_lst = process_event_log_to_png(mz, mz.event_log, scale=1, schedule=FrameBudget(max(2, num_frames)))
+        return (mz, [mz.subdir_png + file_png for file_png in png_lst])
+
+    def gif_run(state):
+        from masked_maze_generator_encode import encode_frames, iter_png_frames
+        mz, png_lst = state
+        encode_frames(iter_png_frames(png_lst), os.path.join(mz.subdir_anim_gif, "bench.gif"))
+
+    def gif_delta_run(state):
+        from masked_maze_generator_encode import encode_frames, iter_png_frames
+        from masked_maze_generator_raster import RASTER_COLORS
+        mz, png_lst = state
+        encode_frames(iter_png_frames(png_lst), os.path.join(mz.subdir_anim_gif, "bench_delta.gif"),
+                      palette_colors=list(RASTER_COLORS.values()), delta=True)
+
+    stage_dic = {
+        "process_mask"      : (lambda: None,
+                               lambda _: process_mask(filepath_mask, cell_len, color_mask_lst, write_mask_test=False), 1),
+        "generate_headless" : (lambda: new_maze("headless"), lambda mz: mz.generate_headless(), 1),
+        "draw_step"         : (lambda: new_maze("draw_step"), draw_steps, num_frames),
+        "svg_write"         : (lambda: generated_maze("svg_write"), write_final(False), 1),
+        "svg_write_compact" : (lambda: generated_maze("svg_write_compact"), write_final(True), 1),
+        "svg2png"           : (svg2png_setup, svg2png_run, num_frames),
+        "raster_frames"     : (lambda: generated_maze("raster"), raster_run, num_frames),
+        "gif"               : (gif_setup, gif_run, max(2, num_frames)),
+        "gif_delta"         : (gif_setup, gif_delta_run, max(2, num_frames)),
+    }
+
+    result_lst = []
+    for stage in stages:
+        if num_inside > STAGE_MAX_CELLS.get(stage, num_inside):
+            continue
+        setup, run, frames = stage_dic[stage]
+        seconds, peak, output = measure(setup, run, repeats, measure_memory)
+        result = {
+            "num_cells"  : num_cells,
+            "num_inside" : num_inside,
+            "stage"      : stage,
+            "seconds"    : seconds,
+            "peak_bytes" : peak,
+        }
+        if frames > 1:
+            result["frames"]            = frames
+            result["seconds_per_frame"] = seconds / frames
+        if stage.startswith("svg_write"):
+            result["file_bytes"] = output
+        result_lst.append(result)
+    return result_lst
+
+
+def key_of(result):
+    return "%s/%d" % (result["stage"], result["num_cells"])
+
+
+# Runs all the sizes, quiet (the prints of the stages go to nowhere), and
+# writes the JSON of the results to filepath_results.
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=DEFAULT_STAGES, filepath_results=None, work_dir=None,
+                   repeats=1, measure_memory=True, num_frames=5, quiet=True):
+    own_work_dir = work_dir == None
+    if own_work_dir:
+        work_dir = tempfile.mkdtemp(prefix="maze_bench_")
+    result_lst = []
+    try:
+        for num_cells in sizes:
+            print("Start benchmark of %d cells ..." % num_cells)
+            size_dir = os.path.join(work_dir, "size_%d" % num_cells)
+            os.makedirs(size_dir, exist_ok=True)
+            with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+                size_result_lst = benchmark_size(num_cells, size_dir, stages, repeats=repeats,
+                                                 measure_memory=measure_memory, num_frames=num_frames)
+            for result in size_result_lst:
+                print("  %-18s %8.3fs %10s" % (result["stage"], result["seconds"],
+                      "" if result["peak_bytes"] == None else "%.1fMB" % (result["peak_bytes"] / 1e6)))
+            result_lst.extend(size_result_lst)
+    finally:
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta" : {
+            "date"      : time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python"    : platform.python_version(),
+            "numpy"     : np.__version__,
+            "platform"  : platform.platform(),
+            "cpu_count" : os.cpu_count(),
+            "repeats"   : repeats,
+        },
+        "results" : result_lst,
+    }
+    if filepath_results != None:
+        with open(filepath_results, "w") as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+# Compares 2 reports of run_benchmarks(). A stage is a regression when it
+# is slower than the baseline more than tolerance (0.25 is 25%) and more
+# than min_seconds, or it's peak of memory grows more than tolerance.
+# Return's the list of regressions, dicts.
+def compare_to_baseline(report, baseline, tolerance=0.25, min_seconds=0.01):
+    baseline_dic = {key_of(result): result for result in baseline["results"]}
+    regression_lst = []
+    for result in report["results"]:
+        base = baseline_dic.get(key_of(result))
+        if base == None:
+            continue
+        if result["seconds"] > base["seconds"] * (1 + tolerance) and result["seconds"] - base["seconds"] > min_seconds:
+            regression_lst.append({"key": key_of(result), "metric": "seconds",
+                                   "baseline": base["seconds"], "value": result["seconds"]})
+        if result["peak_bytes"] != None and base["peak_bytes"] != None \
+           and result["peak_bytes"] > base["peak_bytes"] * (1 + tolerance):
+            regression_lst.append({"key": key_of(result), "metric": "peak_bytes",
+                                   "baseline": base["peak_bytes"], "value": result["peak_bytes"]})
+    return regression_lst
+
+
+def print_comparison(regression_lst):
+    if len(regression_lst) == 0:
+        print("No regressions against the baseline.")
+    for regression in regression_lst:
+        print("REGRESSION %-28s %-10s %.4g -> %.4g (%+.0f%%)" % (regression["key"], regression["metric"],
+              regression["baseline"], regression["value"], 100 * (regression["value"] / regression["baseline"] - 1)))
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    # The synthetic masks have about the number of cells asked for.
+    for shape in ["disc", "rings", "square"]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "mask.png")
+            write_synthetic_mask(filepath, 5000, 4, shape)
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, _, mask, _, _ = process_mask(filepath, 4, [ (0, 0, 0) ], write_mask_test=False)
+            if abs(mask.sum() - 5000) > 1000:
+                ok = False
+
+    # All the stages run and the report compares with itself without
+    # regressions, and against a faster baseline with regressions.
+    report = run_benchmarks(sizes=[300, 1500], num_frames=3)
+    stages = set(result["stage"] for result in report["results"])
+    if stages != set(DEFAULT_STAGES):
+        ok = False
+    report = json.loads(json.dumps(report))
+    if compare_to_baseline(report, report) != []:
+        ok = False
+    faster = json.loads(json.dumps(report))
+    for result in faster["results"]:
+        result["seconds"] /= 10
+    if len(compare_to_baseline(report, faster, min_seconds=0.0)) != len(report["results"]):
+        ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        filepath_results  = sys.argv[2] if len(sys.argv) > 2 else "benchmark_results.json"
+        filepath_baseline = sys.argv[3] if len(sys.argv) > 3 else None
+        report = run_benchmarks(filepath_results=filepath_results)
+        if filepath_baseline != None:
+            with open(filepath_baseline) as f:
+                print_comparison(compare_to_baseline(report, json.load(f)))
+    else:
+        print("Start running tests to the benchmarks....\n\n")
+        runTests()
+        print("\n...Finished running tests to the benchmarks....")
@@ -0,0 +1,368 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_cache.py                             #
+# Description: On disk cache of the processed masks and of the        #
+#              generated mazes, content addressed. The key is the     #
+#              SHA-256 of the bytes of the mask (PNG or grid) plus    #
+#              the parameters, cell_len, colours and tolerance for a  #
+#              mask, seed and algorithm for a maze, so a run with the #
+#              same mask and seed skips process_mask() and carving,   #
+#              and a re-render with other CSS_STYLES only draws.      #
+#                                                                     #
+#              Each entry is a compressed .npz, the mask and the      #
+#              visited cells as packed bits, the walls 2 cells for    #
+#              each byte and the event log of the frames (cell_to     #
+#              only when it isn't chained, the backtracker's log      #
+#              starts each event where the previous one ended, the    #
+#              other algorithms jump). Other files                    #
+#              (frames, the anim GIF) can be stored with put_file().  #
+#              When the cache is larger than max_bytes the least      #
+#              recently used entries are deleted.                     #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+
+import os
+import hashlib
+import shutil
+
+import numpy as np
+
+from masked_maze_generator_core import MazeEventLog, process_mask_stage
+from masked_maze_generator_mazefile import pack_walls, unpack_walls
+
+
+CACHE_VERSION = 3
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def hash_key(*parts):
+    h = hashlib.sha256()
+    h.update(b"masked_maze_generator_cache %d" % CACHE_VERSION)
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray, memoryview)):
+            part = repr(part).encode("utf-8")
+        h.update(b"%d:" % len(part))
+        h.update(part)
+    return h.hexdigest()
+
+
+class MazeCache:
+
+    def __init__(self, cache_dir="./maze_cache/", max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits      = 0
+        self.misses    = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def filepath(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+
+    # The file of the entry if it exists, touched as the most recently used.
+    def lookup(self, key, suffix):
+        filepath = self.filepath(key, suffix)
+        if not os.path.exists(filepath):
+            self.misses += 1
+            return None
+        os.utime(filepath)
+        self.hits += 1
+        return filepath
+
+
+    # Written to a temporary file and renamed, then the LRU eviction.
+    def store(self, key, suffix, arrays):
+        filepath = self.filepath(key, suffix)
+        filepath_tmp = filepath + ".tmp"
+        with open(filepath_tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(filepath_tmp, filepath)
+        self.evict()
+
+
+    # Deletes the least recently used files until the cache has at most
+    # max_bytes.
+    def evict(self):
+        entry_lst = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                entry_lst.append((st.st_mtime, entry.path, st.st_size))
+                total += st.st_size
+        entry_lst.sort()
+        for _, filepath, size in entry_lst:
+            if total <= self.max_bytes:
+                break
+            os.remove(filepath)
+            total -= size
+
+
+    def size_bytes(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                os.remove(entry.path)
+
+
+    #########
+    # Masks #
+    #########
+
+    def mask_key(self, filepath_mask, cell_len, color_mask_lst, tolerance=0, coverage=None):
+        with open(filepath_mask, "rb") as f:
+            data = f.read()
+        return hash_key("mask", data, cell_len, [tuple(color) for color in color_mask_lst], tolerance, coverage)
+
+
+    # Return's (i_init, j_init, mask, x_max, y_max) or None.
+    def get_mask(self, key):
+        filepath = self.lookup(key, ".mask.npz")
+        if filepath == None:
+            return None
+        with np.load(filepath) as data:
+            rows, cols, i_init, j_init, x_max, y_max = data["header"].tolist()
+            mask = np.unpackbits(data["mask"], count=rows * cols).reshape(rows, cols).astype(bool)
+        return (i_init, j_init, mask, x_max, y_max)
+
+
+    def put_mask(self, key, result):
+        i_init, j_init, mask, x_max, y_max = result
+        rows, cols = mask.shape
+        self.store(key, ".mask.npz", {
+            "header" : np.array([rows, cols, i_init, j_init, x_max, y_max], dtype=np.int64),
+            "mask"   : np.packbits(mask.reshape(-1)),
+        })
+
+
+    # process_mask() through the cache, on a hit the PNG isn't decoded
+    # and the mask_test.png isn't written again.
+    def process_mask(self, filepath_mask, cell_len, color_mask_lst, tolerance=0, write_mask_test=True, coverage=None):
+        key = self.mask_key(filepath_mask, cell_len, color_mask_lst, tolerance, coverage)
+        result = self.get_mask(key)
+        if result == None:
+            result = process_mask_stage(filepath_mask, cell_len, color_mask_lst, tolerance, write_mask_test, coverage)
+            self.put_mask(key, result)
+        return result
+
+
+    #########
+    # Mazes #
+    #########
+
+    # The maze of gen_maze is defined by it's grid, the start cell, the
+    # seed and the algorithm, not by the output options.
+    def maze_key(self, gen_maze):
+        algorithm = gen_maze.algorithm
+        algorithm_key = (type(algorithm).__name__, algorithm.params()) if algorithm != None else None
+        return hash_key("maze", gen_maze.cols, gen_maze.rows, gen_maze.start_index, gen_maze.seed,
+                        algorithm_key, bytes(gen_maze.grid.inside_mask))
+
+
+    # Restores the final maze and it's event log to gen_maze, as after
+    # generate_headless(). Return's the event log or None.
+    def get_maze(self, key, gen_maze):
+        filepath = self.lookup(key, ".maze.npz")
+        if filepath == None:
+            return None
+        grid = gen_maze.grid
+        num_cells = grid.cols * grid.rows
+        with np.load(filepath) as data:
+            grid.walls[:]   = unpack_walls(data["walls"], num_cells).tobytes()
+            grid.visited[:] = np.unpackbits(data["visited"], count=num_cells).tobytes()
+            cell_from       = data["cell_from"]
+            chained         = "cell_to" not in data.files
+            cell_to         = None if chained else data["cell_to"]
+            kind            = data["kind"]
+            last_cell_to    = int(data["last_cell_to"])
+            rng_state       = (int(data["rng_version"]), tuple(data["rng_key"].tolist()),
+                               None if np.isnan(data["rng_gauss"]) else float(data["rng_gauss"]))
+        event_log = MazeEventLog(grid.cols, grid.rows, gen_maze.start_index)
+        if len(kind) > 0:
+            event_log.kind.frombytes(kind.tobytes())
+            event_log.cell_from.extend(cell_from.tolist())
+            if chained:
+                # Each event starts on the cell where the previous one ended.
+                event_log.cell_to.extend(cell_from[1:].tolist())
+                event_log.cell_to.append(last_cell_to)
+            else:
+                event_log.cell_to.extend(cell_to.tolist())
+            gen_maze.curr_index = last_cell_to
+        gen_maze.stack      = gen_maze.stack[:0]
+        gen_maze.event_log  = event_log
+        gen_maze.rng.setstate(rng_state)
+        return event_log
+
+
+    def put_maze(self, key, gen_maze):
+        grid = gen_maze.grid
+        event_log = gen_maze.event_log
+        version, rng_key, rng_gauss = gen_maze.rng.getstate()
+        dtype = np.int32 if grid.cols * grid.rows < 2**31 else np.int64
+        cell_from = np.frombuffer(event_log.cell_from, dtype=np.dtype("i%d" % event_log.cell_from.itemsize))
+        cell_to   = np.frombuffer(event_log.cell_to, dtype=np.dtype("i%d" % event_log.cell_to.itemsize))
+        arrays = {
+            "walls"        : pack_walls(grid.walls),
+            "visited"      : np.packbits(np.frombuffer(grid.visited, dtype=np.uint8)),
+            "kind"         : np.frombuffer(event_log.kind, dtype=np.uint8),
+            "cell_from"    : cell_from.astype(dtype),
+            "last_cell_to" : np.int64(event_log.cell_to[-1] if len(event_log) > 0 else gen_maze.curr_index),
+            "rng_version"  : np.int64(version),
+            "rng_key"      : np.array(rng_key, dtype=np.uint32),
+            "rng_gauss"    : np.float64(np.nan if rng_gauss == None else rng_gauss),
+        }
+        # Kruskal, Prim, Wilson, ... jump, their cell_to isn't the next cell_from.
+        if not np.array_equal(cell_to[:-1], cell_from[1:]):
+            arrays["cell_to"] = cell_to.astype(dtype)
+        self.store(key, ".maze.npz", arrays)
+
+
+    #########
+    # Files #
+    #########
+
+    # Any other file of a maze, the rendered frames or the anim GIF, under
+    # key (for example hash_key(maze_key, CSS_STYLES)) and name.
+    def put_file(self, key, name, filepath_from):
+        filepath = self.filepath(key, "." + name)
+        shutil.copyfile(filepath_from, filepath + ".tmp")
+        os.replace(filepath + ".tmp", filepath)
+        self.evict()
+
+
+    # Copies the file to filepath_to, return's False if it isn't cached.
+    def get_file(self, key, name, filepath_to):
+        filepath = self.lookup(key, "." + name)
+        if filepath == None:
+            return False
+        shutil.copyfile(filepath, filepath_to)
+        return True
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+    from masked_maze_generator_algorithms import GrowingTree, Kruskal, Prim
+
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = MazeCache(os.path.join(tmp_dir, "cache"))
+
+        # The mask, from the PNG and then from the cache.
+        result     = process_mask(filepath_mask, cell_len, color_mask_lst, write_mask_test=False, cache=cache)
+        result_hit = process_mask(filepath_mask, cell_len, color_mask_lst, write_mask_test=False, cache=cache)
+        if cache.hits != 1 or cache.misses != 1:
+            ok = False
+        if result[:2] != result_hit[:2] or result[3:] != result_hit[3:] or not np.array_equal(result[2], result_hit[2]):
+            ok = False
+        i_init, j_init, mask, x_max, y_max = result
+
+        def new_generator(output_dir, algorithm=None):
+            mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max, cell_len=cell_len,
+                               maze_name="maze", mask=mask)
+            mz.compact_svg = True
+            mz.set_output_dir(output_dir)
+            # The seed first, Kruskal shuffles the walls in reset().
+            mz.set_seed(3)
+            mz.set_algorithm(algorithm)
+            return mz
+
+        # The maze, carved and then from the cache.
+        mz_ref = new_generator(os.path.join(tmp_dir, "ref"))
+        event_log_ref = mz_ref.generate_headless()
+        cache.put_maze(cache.maze_key(mz_ref), mz_ref)
+        mz = new_generator(os.path.join(tmp_dir, "run"))
+        event_log = cache.get_maze(cache.maze_key(mz), mz)
+        if event_log == None or list(event_log) != list(event_log_ref):
+            ok = False
+        if bytes(mz.grid.walls) != bytes(mz_ref.grid.walls) or bytes(mz.grid.visited) != bytes(mz_ref.grid.visited):
+            ok = False
+        if mz.rng.getstate() != mz_ref.rng.getstate() or mz.curr_index != mz_ref.curr_index:
+            ok = False
+
+        # The algorithms with jumps, their event log isn't chained.
+        for algorithm_class in [Kruskal, Prim]:
+            mz_ref = new_generator(os.path.join(tmp_dir, "ref"), algorithm_class())
+            event_log_ref = mz_ref.generate_headless()
+            cache.put_maze(cache.maze_key(mz_ref), mz_ref)
+            mz = new_generator(os.path.join(tmp_dir, "run"), algorithm_class())
+            event_log = cache.get_maze(cache.maze_key(mz), mz)
+            if event_log == None or list(event_log) != list(event_log_ref) or mz.curr_index != mz_ref.curr_index:
+                ok = False
+            # Drawn again from the cached log, the same final walls.
+            mz_fresh = new_generator(os.path.join(tmp_dir, "fresh"), algorithm_class())
+            mz_fresh.generate_headless()
+            mz.reset()
+            mz.replay_scheduled(bytearray(b"\x00") * len(event_log))
+            if bytes(mz.grid.walls) != bytes(mz_fresh.grid.walls):
+                ok = False
+
+        # Other seed or algorithm, other key.
+        key_lst = [cache.maze_key(new_generator(tmp_dir, algorithm)) for algorithm in
+                   [None, GrowingTree("oldest"), GrowingTree("mixed", 0.5), GrowingTree("mixed", 0.7)]]
+        if len(set(key_lst)) != 4:
+            ok = False
+
+        # generate() with the cache draws the same frames.
+        mz_ref = new_generator(os.path.join(tmp_dir, "ref"))
+        mz_ref.generate()
+        for k in range(2):
+            mz = new_generator(os.path.join(tmp_dir, "run_%d" % k))
+            mz.set_cache(cache)
+            mz.generate()
+            if mz.file_svg_lst != mz_ref.file_svg_lst:
+                ok = False
+            for file_svg in mz_ref.file_svg_lst:
+                with open(mz.subdir_svg + file_svg, "rb") as f_a, open(mz_ref.subdir_svg + file_svg, "rb") as f_b:
+                    if f_a.read() != f_b.read():
+                        ok = False
+
+        # LRU, the entry used last stays.
+        cache.max_bytes = os.path.getsize(cache.filepath(key_lst[0], ".maze.npz"))
+        cache.get_maze(key_lst[0], mz)
+        cache.evict()
+        if [entry.name for entry in os.scandir(cache.cache_dir)] != [key_lst[0] + ".maze.npz"]:
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the maze cache....\n\n")
+    runTests()
+    print("\n...Finished running tests to the maze cache....")
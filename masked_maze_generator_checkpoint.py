@@ -0,0 +1,318 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_checkpoint.py                        #
+# Description: Checkpoint and resume of long runs. Every n frames the #
+#              state of the MazeGenerator is saved to one file, the   #
+#              walls and visited of the grid, the backtracking stack, #
+#              the current cell, the counter, the state of the random #
+#              numbers, the algorithm and the list of the frames      #
+#              already written. resume() continues the generation     #
+#              from the last checkpoint, the frames after it are      #
+#              drawn again (the same random numbers, the same SVG's), #
+#              and the rasterization skips the PNG's that already     #
+#              exist and are valid.                                   #
+#                                                                     #
+#              The file is written to a temporary file and renamed,   #
+#              a crash while saving keeps the previous checkpoint.    #
+#              It's a pickle, only load checkpoints of your own runs. #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+
+import os
+import time
+import pickle
+from array import array
+
+import numpy as np
+
+from masked_maze_generator_core import MazeGenerator, MazeEventLog, calc_num_squares
+
+
+CHECKPOINT_VERSION = 1
+
+# Phases of a run.
+PHASE_GENERATE = "generate"       # draw_step() loop of generate().
+PHASE_REPLAY   = "replay"         # Replay of the event log of a schedule.
+PHASE_DONE     = "done"           # All the SVG's are written.
+
+
+# Everything needed to continue gen_maze, a dict of bytes, ints and lists.
+# position and selected are the replay position and the frame mask of a
+# schedule.
+def checkpoint_state(gen_maze, phase, position=0, selected=None):
+    event_log = gen_maze.event_log
+    if event_log != None:
+        event_log = (event_log.start_index, event_log.kind.tobytes(),
+                     event_log.cell_from.tobytes(), event_log.cell_to.tobytes())
+    return {
+        "version"      : CHECKPOINT_VERSION,
+        "phase"        : phase,
+        "time"         : time.time(),
+        "config"       : {
+            "i_init"          : gen_maze.i_init,
+            "j_init"          : gen_maze.j_init,
+            "x_max"           : gen_maze.x_max,
+            "y_max"           : gen_maze.y_max,
+            "cell_len"        : gen_maze.w,
+            "maze_name"       : gen_maze.maze_name,
+            "subdir_svg"      : gen_maze.subdir_svg,
+            "subdir_png"      : gen_maze.subdir_png,
+            "subdir_anim_gif" : gen_maze.subdir_anim_gif,
+            "compact_svg"     : gen_maze.compact_svg,
+        },
+        "inside_mask"  : bytes(gen_maze.grid.inside_mask),
+        "walls"        : bytes(gen_maze.grid.walls),
+        "visited"      : bytes(gen_maze.grid.visited),
+        "stack"        : gen_maze.stack.tobytes(),
+        "curr_index"   : gen_maze.curr_index,
+        "counter"      : gen_maze.counter,
+        "file_svg_lst" : list(gen_maze.file_svg_lst),
+        "rng_state"    : gen_maze.rng.getstate(),
+        "algorithm"    : gen_maze.algorithm,
+        "event_log"    : event_log,
+        "position"     : position,
+        "selected"     : bytes(selected) if selected != None else None,
+    }
+
+
+# Atomic, the previous checkpoint stays until the new one is complete.
+def save_checkpoint(filepath, state):
+    filepath_tmp = filepath + ".tmp"
+    with open(filepath_tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filepath_tmp, filepath)
+
+
+def load_checkpoint(filepath):
+    with open(filepath, "rb") as f:
+        state = pickle.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("ERROR in load_checkpoint, %s has version %s and not %d!"
+                         % (filepath, state.get("version"), CHECKPOINT_VERSION))
+    return state
+
+
+# A new MazeGenerator in the state of the checkpoint.
+def restore_generator(state):
+    config = state["config"]
+    cols = calc_num_squares(config["x_max"], config["cell_len"])
+    mask = np.frombuffer(state["inside_mask"], dtype=np.uint8).reshape(-1, cols).astype(bool)
+    gen_maze = MazeGenerator(i_init=config["i_init"], j_init=config["j_init"], x_max=config["x_max"],
+                             y_max=config["y_max"], cell_len=config["cell_len"], maze_name=config["maze_name"],
+                             mask=mask)
+    gen_maze.subdir_svg      = config["subdir_svg"]
+    gen_maze.subdir_png      = config["subdir_png"]
+    gen_maze.subdir_anim_gif = config["subdir_anim_gif"]
+    gen_maze.compact_svg     = config["compact_svg"]
+
+    gen_maze.grid.walls[:]   = state["walls"]
+    gen_maze.grid.visited[:] = state["visited"]
+    gen_maze.stack           = array('l')
+    gen_maze.stack.frombytes(state["stack"])
+    gen_maze.curr_index      = state["curr_index"]
+    gen_maze.counter         = state["counter"]
+    gen_maze.file_svg_lst    = list(state["file_svg_lst"])
+    gen_maze.rng.setstate(state["rng_state"])
+    gen_maze.algorithm       = state["algorithm"]
+    if state["event_log"] != None:
+        start_index, kind, cell_from, cell_to = state["event_log"]
+        event_log = MazeEventLog(gen_maze.cols, gen_maze.rows, start_index)
+        event_log.kind.frombytes(kind)
+        event_log.cell_from.frombytes(cell_from)
+        event_log.cell_to.frombytes(cell_to)
+        gen_maze.event_log = event_log
+    return gen_maze
+
+
+# Saves a checkpoint every every_frames frames, or every every_seconds
+# if it's not None, and always at the end of the generation. See
+# MazeGenerator.set_checkpoint().
+class Checkpointer:
+
+    def __init__(self, filepath, every_frames=1000, every_seconds=None):
+        self.filepath      = filepath
+        self.every_frames  = every_frames
+        self.every_seconds = every_seconds
+        self.last_counter  = None
+        self.last_time     = time.time()
+        self.num_saved     = 0
+
+
+    # Called after each frame, selected is the frame mask of the replay
+    # of a schedule and position the next event.
+    def tick(self, gen_maze, position=0, selected=None):
+        if self.last_counter == None:
+            self.last_counter = gen_maze.counter - 1
+        due = gen_maze.counter - self.last_counter >= self.every_frames
+        if self.every_seconds != None and time.time() - self.last_time >= self.every_seconds:
+            due = True
+        if due:
+            self.save(gen_maze, PHASE_GENERATE if selected == None else PHASE_REPLAY, position, selected)
+
+
+    # Called at the end of the generation.
+    def done(self, gen_maze):
+        self.save(gen_maze, PHASE_DONE)
+
+
+    def save(self, gen_maze, phase, position=0, selected=None):
+        save_checkpoint(self.filepath, checkpoint_state(gen_maze, phase, position, selected))
+        self.last_counter = gen_maze.counter
+        self.last_time    = time.time()
+        self.num_saved   += 1
+
+
+# Continues the run of the checkpoint: the generation from the last
+# checkpoint and then (with rasterize) the PNG's that are missing or not
+# valid and the animated GIF. Return's the MazeGenerator.
+def resume(filepath, rasterize=True, workers=None, every_frames=1000, every_seconds=None):
+    state = load_checkpoint(filepath)
+    gen_maze = restore_generator(state)
+    phase = state["phase"]
+    print("Start resuming %s from frame %d (%s) ..." % (filepath, gen_maze.counter, phase))
+    if phase != PHASE_DONE:
+        gen_maze.checkpointer = Checkpointer(filepath, every_frames, every_seconds)
+        if phase == PHASE_REPLAY:
+            gen_maze.replay_scheduled(state["selected"], state["position"])
+        else:
+            gen_maze.generate()
+    if rasterize:
+        gen_maze.process_svg_to_png_to_anin_gif(workers=workers, resume=True)
+    print("...ending resuming %s" % filepath)
+    return gen_maze
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    from masked_maze_generator_schedule import EveryKthStep
+
+    mask = np.zeros((10, 12), dtype=bool)
+    mask[1:9, 1:11] = True
+
+    def new_generator(output_dir):
+        mz = MazeGenerator(i_init=1, j_init=1, x_max=120, y_max=100, cell_len=10, maze_name="maze", mask=mask)
+        mz.compact_svg = True
+        mz.set_output_dir(output_dir)
+        mz.set_seed(7)
+        return mz
+
+    # Interrupted after n frames by a failing draw_frame().
+    def crash_after(mz, n):
+        draw_frame = mz.draw_frame
+        def draw_frame_crash():
+            if mz.counter == n:
+                raise OSError("No space left on device")
+            draw_frame()
+        mz.draw_frame = draw_frame_crash
+
+    def read_files(subdir, file_lst):
+        content_lst = []
+        for filename in file_lst:
+            with open(os.path.join(subdir, filename), "rb") as f:
+                content_lst.append(f.read())
+        return content_lst
+
+    for schedule in [None, EveryKthStep(3)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mz_ref = new_generator(os.path.join(tmp_dir, "ref"))
+            mz_ref.generate(schedule)
+
+            filepath = os.path.join(tmp_dir, "maze.ckpt")
+            mz = new_generator(os.path.join(tmp_dir, "run"))
+            mz.set_checkpoint(filepath, every_frames=20)
+            crash_after(mz, 50)
+            try:
+                mz.generate(schedule)
+                ok = False
+            except OSError:
+                pass
+            if load_checkpoint(filepath)["counter"] != 40:
+                ok = False
+
+            mz_res = resume(filepath, rasterize=False)
+            if mz_res.file_svg_lst != mz_ref.file_svg_lst or bytes(mz_res.grid.walls) != bytes(mz_ref.grid.walls):
+                ok = False
+            if read_files(mz_res.subdir_svg, mz_res.file_svg_lst) != read_files(mz_ref.subdir_svg, mz_ref.file_svg_lst):
+                ok = False
+            if load_checkpoint(filepath)["phase"] != PHASE_DONE:
+                ok = False
+
+            # The rasterization: only the missing or broken PNG's again.
+            if schedule != None:
+                mz_res.process_svg_to_png_to_anin_gif(workers=1)
+                file_png_lst = [file_svg[:-4] + ".png" for file_svg in mz_res.file_svg_lst]
+                filepath_broken  = mz_res.subdir_png + file_png_lst[3]
+                filepath_missing = mz_res.subdir_png + file_png_lst[5]
+                filepath_good    = mz_res.subdir_png + file_png_lst[7]
+                with open(filepath_broken, "r+b") as f:
+                    f.truncate(os.path.getsize(filepath_broken) // 2)
+                os.remove(filepath_missing)
+                time_good = os.path.getmtime(mz_res.subdir_svg + mz_res.file_svg_lst[7]) + 100
+                os.utime(filepath_good, (time_good, time_good))
+                resume(filepath, workers=1)
+                from masked_maze_generator_svg2png import is_valid_png
+                if not (is_valid_png(filepath_broken) and is_valid_png(filepath_missing)):
+                    ok = False
+                if os.path.getmtime(filepath_good) != time_good:
+                    ok = False
+                if not os.path.exists(mz_res.subdir_anim_gif + "maze_anim.gif"):
+                    ok = False
+
+    # A width and height that aren't a multiple of cell_len.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mz_ref = MazeGenerator(i_init=1, j_init=1, x_max=127, y_max=104, cell_len=10, maze_name="maze", mask=mask)
+        mz_ref.set_seed(7)
+        mz_ref.generate_headless()
+
+        filepath = os.path.join(tmp_dir, "maze.ckpt")
+        mz = MazeGenerator(i_init=1, j_init=1, x_max=127, y_max=104, cell_len=10, maze_name="maze", mask=mask)
+        mz.compact_svg = True
+        mz.set_output_dir(tmp_dir)
+        mz.set_seed(7)
+        mz.set_checkpoint(filepath, every_frames=20)
+        crash_after(mz, 50)
+        try:
+            mz.generate()
+            ok = False
+        except OSError:
+            pass
+        mz_res = resume(filepath, rasterize=False)
+        if bytes(mz_res.grid.inside_mask) != bytes(mask.astype(np.uint8)) or bytes(mz_res.grid.walls) != bytes(mz_ref.grid.walls):
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the checkpoint and resume....\n\n")
+    runTests()
+    print("\n...Finished running tests to the checkpoint and resume....")
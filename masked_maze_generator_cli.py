@@ -0,0 +1,532 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_cli.py                               #
+# Description: Command line of the masked Maze Generator, instead of  #
+#              editing the variables of test_01():                    #
+#                                                                     #
+#   generate  mask PNG -> maze, SVG frames, PNG frames (raster), the  #
+#             final SVG and / or the animation streamed to GIF / MP4. #
+#   render    the SVG's of an output dir -> PNG's, in parallel.       #
+#   encode    the PNG's of an output dir -> animated GIF / MP4.       #
+#   solve     mask PNG or .maze -> maze, it's stats and the solution. #
+#   mask      mask PNG -> cells and components for many cell sizes   #
+#             and coverages, from one pass over the PNG.              #
+#   export    .maze -> the final maze to SVG, PDF or PNG.             #
+#   resume    continues a run from it's checkpoint.                   #
+#   serve     local maze service, HTTP on localhost or a Unix socket, #
+#             see masked_maze_generator_service.py.                   #
+#                                                                     #
+#              Only argparse is imported at the start, each command   #
+#              imports what it uses, a "generate --frames none" never #
+#              loads svgwrite, svglib, reportlab or the encoders, for #
+#              thousands of short jobs.                               #
+#######################################################################
+
+# Example, the peace symbol of test_01() of masked_maze_generator_core.py:
+#
+#   python masked_maze_generator_cli.py generate ./png_masks/png_mask_peace_symbol_small.png \
+#          --cell-len 6 --color 0,0,0 --seed 1 --compact --schedule budget:500
+#   python masked_maze_generator_cli.py render ./ --workers 8
+#   python masked_maze_generator_cli.py encode ./ --name maze
+
+import os
+import sys
+import json
+import argparse
+
+
+ALGORITHM_NAMES = ["backtracker", "kruskal", "wilson", "prim", "growing_tree"]
+FRAMES_SVG      = "svg"           # SVG frames, like generate().
+FRAMES_PNG      = "png"           # PNG frames from the raster renderer, without SVG's.
+FRAMES_NONE     = "none"          # Only the maze.
+
+
+# "R,G,B" or "#RRGGBB".
+def parse_color(text):
+    try:
+        if text.startswith("#") and len(text) == 7:
+            return tuple(int(text[k:k + 2], 16) for k in (1, 3, 5))
+        color = tuple(int(value) for value in text.split(","))
+        if len(color) == 3 and all(0 <= value <= 255 for value in color):
+            return color
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError("the color %s isn't R,G,B or #RRGGBB" % text)
+
+
+# "4,6,10" -> [4, 6, 10], or floats with parse=float.
+def parse_list(text, parse=int):
+    try:
+        return [parse(value) for value in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s isn't a list of numbers separated by commas" % text)
+
+
+# "every:K", "budget:N", "compress:KEEP" or "paced:FPS:SECONDS".
+def parse_schedule(text):
+    from masked_maze_generator_schedule import EveryKthStep, FrameBudget, CompressBacktrack, TimePaced
+    name, _, args = text.partition(":")
+    try:
+        values = [float(value) for value in args.split(":")] if args else []
+        if name == "every" and len(values) == 1:
+            return EveryKthStep(int(values[0]))
+        if name == "budget" and len(values) == 1:
+            return FrameBudget(int(values[0]))
+        if name == "compress" and len(values) <= 1:
+            return CompressBacktrack(*[int(value) for value in values])
+        if name == "paced" and len(values) == 2:
+            return TimePaced(values[0], values[1])
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError("unknown schedule %s" % text)
+
+
+# "I,J" of a cell.
+def parse_cell(text):
+    try:
+        i, j = (int(value) for value in text.split(","))
+        return (i, j)
+    except ValueError:
+        raise argparse.ArgumentTypeError("the cell %s isn't I,J" % text)
+
+
+def add_maze_arguments(parser):
+    parser.add_argument("mask", help="PNG of the mask")
+    parser.add_argument("--cell-len", type=int, default=6, help="side of a cell in pixels of the mask (6)")
+    parser.add_argument("--color", type=parse_color, action="append", dest="color_mask_lst",
+                        help="R,G,B or #RRGGBB of the mask, repeat it for more colors (0,0,0)")
+    parser.add_argument("--tolerance", type=int, default=0, help="tolerance of the colors (0)")
+    parser.add_argument("--coverage", type=float, default=None,
+                        help="fraction of a cell with the colors to be inside the mask, the center pixel by default")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random numbers, the same seed the same maze")
+    parser.add_argument("--algorithm", choices=ALGORITHM_NAMES, default="backtracker")
+    parser.add_argument("--policy", default="newest", help="policy of growing_tree (newest, oldest, random, mixed)")
+    parser.add_argument("--components", action="store_true", help="carve each connected component of the mask")
+    parser.add_argument("--bridges", action="store_true", help="with --components, join them with bridges")
+    parser.add_argument("--workers", type=int, default=None, help="processes, all the cores by default")
+    parser.add_argument("--cache", default=None, metavar="DIR", help="cache of the masks and mazes")
+    parser.add_argument("--name", default="maze", help="name of the output files (maze)")
+    parser.add_argument("--output-dir", default="./", help="output dir, with the a_, b_ and c_ subdirs (./)")
+    parser.add_argument("--mask-test", action="store_true", help="write the mask_test.png next to the mask")
+    parser.add_argument("--trace", default=None, metavar="JSON", help="stage timings to a JSON file")
+
+
+# Mask -> MazeGenerator, ready to generate.
+def new_generator(args):
+    from masked_maze_generator_core import MazeGenerator, process_mask
+
+    cache = None
+    if args.cache != None:
+        from masked_maze_generator_cache import MazeCache
+        cache = MazeCache(args.cache)
+    color_mask_lst = args.color_mask_lst or [(0, 0, 0)]
+    i_init, j_init, mask, x_max, y_max = process_mask(args.mask, args.cell_len, color_mask_lst, args.tolerance,
+                                                      write_mask_test=args.mask_test, cache=cache,
+                                                      coverage=args.coverage)
+    if i_init < 0:
+        raise ValueError("ERROR in the mask %s there isn't any cell with the colors %s" % (args.mask, color_mask_lst))
+    mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max, cell_len=args.cell_len,
+                       maze_name=args.name, mask=mask)
+    mz.set_output_dir(args.output_dir)
+    if args.seed != None:
+        mz.set_seed(args.seed)
+    if args.algorithm != "backtracker":
+        from masked_maze_generator_algorithms import ALGORITHMS
+        algorithm_class = ALGORITHMS[args.algorithm]
+        mz.set_algorithm(algorithm_class(args.policy) if args.algorithm == "growing_tree" else algorithm_class())
+    mz.set_cache(cache)
+    return mz
+
+
+# The maze of the arguments, without frames. Return's the event log.
+def generate_maze(mz, args):
+    if args.components:
+        return mz.generate_components(workers=args.workers or 1, bridges=args.bridges)
+    return mz.generate_headless()
+
+
+def cmd_generate(args):
+    mz = new_generator(args)
+    mz.compact_svg = args.compact
+
+    if args.checkpoint != None:
+        mz.set_checkpoint(args.checkpoint, every_frames=args.checkpoint_every)
+    if args.pipeline != None:
+        if args.frames != FRAMES_SVG or args.components or args.anim != None:
+            raise ValueError("ERROR in generate, --pipeline is only for the SVG frames of one component without --anim")
+        # SVG to PNG and the animation while the SVG's are written.
+        from masked_maze_generator_pipeline import FramePipeline
+        FramePipeline(mz, workers=args.workers, fps=args.fps, filepath_anim=args.pipeline,
+                      keep_frames=not args.no_keep_frames).run(args.schedule)
+    elif args.frames == FRAMES_SVG and not args.components and args.anim == None:
+        mz.generate(args.schedule)
+    else:
+        event_log = generate_maze(mz, args)
+        if args.frames == FRAMES_SVG:
+            mz.reset()
+            selected = args.schedule.frame_mask(event_log) if args.schedule != None else bytearray(b"\x01") * len(event_log)
+            mz.replay_scheduled(selected)
+        elif args.frames == FRAMES_PNG:
+            from masked_maze_generator_raster import process_event_log_to_png
+            process_event_log_to_png(mz, event_log, scale=args.scale, schedule=args.schedule)
+
+    if args.anim != None:
+        from masked_maze_generator_raster import process_event_log_to_anim
+        process_event_log_to_anim(mz, event_log, args.anim, scale=args.scale, fps=args.fps, schedule=args.schedule,
+                                  delta=args.delta)
+
+    if args.final != None:
+        from masked_maze_generator_svg import write_compact_svg_frame
+        write_compact_svg_frame(args.final, mz.grid, mz.w, mz.x_max, mz.y_max)
+    if args.save != None:
+        from masked_maze_generator_mazefile import save_maze
+        save_maze(args.save, mz)
+    return 0
+
+
+def cmd_render(args):
+    from masked_maze_generator_svg2png import rasterize_svg_dir
+    subdir_svg = os.path.join(args.output_dir, "a_output_svg")
+    subdir_png = os.path.join(args.output_dir, "b_output_png")
+    os.makedirs(subdir_png, exist_ok=True)
+    rasterize_svg_dir(subdir_svg, subdir_png, workers=args.workers, skip_existing=args.resume)
+    return 0
+
+
+def cmd_encode(args):
+    from masked_maze_generator_core import manual_n_png_to_anim_gif
+    subdir_png      = os.path.join(args.output_dir, "b_output_png", "")
+    subdir_anim_gif = os.path.join(args.output_dir, "c_output_anim_gif", "")
+    os.makedirs(subdir_anim_gif, exist_ok=True)
+    manual_n_png_to_anim_gif(subdir_png, subdir_anim_gif, args.name, ext=args.ext, fps=args.fps, delta=args.delta)
+    return 0
+
+
+def cmd_solve(args):
+    from masked_maze_generator_solver import solve, longest_path, maze_stats, passage_bits
+
+    if args.mask.endswith(".maze"):
+        from masked_maze_generator_mazefile import load_maze
+        mz = load_maze(args.mask).to_generator()
+    else:
+        mz = new_generator(args)
+        generate_maze(mz, args)
+    passages = passage_bits(mz.grid)
+    if args.cell_from != None and args.cell_to != None:
+        index_from = args.cell_from[1] * mz.cols + args.cell_from[0]
+        index_to   = args.cell_to[1] * mz.cols + args.cell_to[0]
+        path = solve(mz.grid, index_from, index_to, passages)
+    else:
+        path = longest_path(mz.grid, mz.start_index, passages)
+    stats = maze_stats(mz.grid, passages)
+    stats["solution_length"] = max(0, len(path) - 1)
+    stats["solution_ends"]   = [[index % mz.cols, index // mz.cols] for index in (path[0], path[-1])] if len(path) > 0 else None
+
+    if args.svg != None:
+        from masked_maze_generator_solver import write_solution_svg
+        write_solution_svg(args.svg, mz, path)
+    if args.png != None:
+        from masked_maze_generator_raster import RasterFrameRenderer
+        from masked_maze_generator_solver import draw_solution
+        renderer = RasterFrameRenderer(mz, scale=args.scale)
+        renderer.walls[:]   = mz.grid.walls
+        renderer.visited[:] = mz.grid.visited
+        renderer.redraw_all()
+        draw_solution(renderer, path)
+        renderer.to_image().save(args.png, "PNG")
+    if args.json != None:
+        with open(args.json, "w") as f:
+            json.dump(stats, f, indent=2)
+    else:
+        print(json.dumps(stats, indent=2))
+    return 0 if len(path) > 0 else 1
+
+
+# The cells inside the mask and it's connected components (1 is a single
+# maze) for each cell_len and coverage, to choose them before generating.
+def cmd_mask(args):
+    from masked_maze_generator_core import load_mask_coverage
+    from masked_maze_generator_components import label_mask_components
+
+    color_mask_lst = args.color_mask_lst or [(0, 0, 0)]
+    coverage = load_mask_coverage(args.mask, color_mask_lst, args.tolerance)
+    result_lst = []
+    for cell_len in args.cell_lens:
+        for threshold in args.coverages:
+            mask = coverage.mask(cell_len, threshold)
+            result_lst.append({
+                "cell_len"   : cell_len,
+                "coverage"   : threshold,
+                "rows"       : mask.shape[0],
+                "cols"       : mask.shape[1],
+                "cells"      : int(mask.sum()),
+                "components" : label_mask_components(mask)[1],
+            })
+    print(json.dumps(result_lst, indent=2))
+    return 0
+
+
+def cmd_export(args):
+    from masked_maze_generator_mazefile import load_maze, export_maze
+    export_maze(load_maze(args.maze), args.output, cell_px=args.cell_px)
+    return 0
+
+
+def cmd_resume(args):
+    from masked_maze_generator_checkpoint import resume
+    resume(args.checkpoint, rasterize=not args.no_rasterize, workers=args.workers, every_frames=args.checkpoint_every)
+    return 0
+
+
+def cmd_serve(args):
+    from masked_maze_generator_service import serve
+    serve(args.host, args.port, args.socket, workers=args.workers, max_masks=args.max_masks, verbose=not args.quiet)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="masked_maze_generator_cli.py", description="Masked Maze Generator")
+    subparsers = parser.add_subparsers(dest="command")
+
+    p = subparsers.add_parser("generate", help="mask -> maze, SVG or PNG frames, final SVG, animation")
+    add_maze_arguments(p)
+    p.add_argument("--frames", choices=[FRAMES_SVG, FRAMES_PNG, FRAMES_NONE], default=FRAMES_SVG,
+                   help="frames to write, svg (default), png (raster, without SVG's) or none")
+    p.add_argument("--schedule", type=parse_schedule, default=None,
+                   help="frames to draw, every:K, budget:N, compress:KEEP or paced:FPS:SECONDS (all steps)")
+    p.add_argument("--compact", action="store_true", help="compact SVG's, one path for the walls")
+    p.add_argument("--scale", type=int, default=4, help="pixels of a cell of the mask of the PNG frames (4)")
+    p.add_argument("--anim", default=None, metavar="FILE", help="stream the raster frames to a .gif, .mp4 or .webm")
+    p.add_argument("--pipeline", default=None, metavar="FILE",
+                   help="rasterize and encode the SVG frames to a .gif or .mp4 while generating")
+    p.add_argument("--no-keep-frames", action="store_true", help="with --pipeline, remove each SVG and PNG once encoded")
+    p.add_argument("--delta", action="store_true", help="with --anim, GIF of only the changes of each frame")
+    p.add_argument("--fps", type=int, default=10)
+    p.add_argument("--final", default=None, metavar="SVG", help="write the final maze to a compact SVG")
+    p.add_argument("--save", default=None, metavar="MAZE", help="write the final maze to a .maze file")
+    p.add_argument("--checkpoint", default=None, metavar="FILE", help="save checkpoints of the SVG frames")
+    p.add_argument("--checkpoint-every", type=int, default=1000, help="frames between checkpoints (1000)")
+    p.set_defaults(func=cmd_generate)
+
+    p = subparsers.add_parser("render", help="SVG's of an output dir -> PNG's")
+    p.add_argument("output_dir", nargs="?", default="./")
+    p.add_argument("--workers", type=int, default=None, help="processes, all the cores by default")
+    p.add_argument("--resume", action="store_true", help="skip the PNG's that exist and are valid")
+    p.set_defaults(func=cmd_render)
+
+    p = subparsers.add_parser("encode", help="PNG's of an output dir -> animated GIF or MP4")
+    p.add_argument("output_dir", nargs="?", default="./")
+    p.add_argument("--name", default="maze", help="name of the animation (maze)")
+    p.add_argument("--ext", default=".gif", choices=[".gif", ".mp4", ".webm", ".mkv", ".mov"])
+    p.add_argument("--fps", type=int, default=10)
+    p.add_argument("--delta", action="store_true", help="GIF of only the changes of each frame, fixed palette")
+    p.set_defaults(func=cmd_encode)
+
+    p = subparsers.add_parser("solve", help="mask or .maze -> maze, stats and solution")
+    add_maze_arguments(p)
+    p.add_argument("--from", type=parse_cell, default=None, dest="cell_from", metavar="I,J",
+                   help="first cell of the solution, the longest path by default")
+    p.add_argument("--to", type=parse_cell, default=None, dest="cell_to", metavar="I,J")
+    p.add_argument("--svg", default=None, help="final maze with the solution, SVG")
+    p.add_argument("--png", default=None, help="final maze with the solution, PNG")
+    p.add_argument("--scale", type=int, default=4, help="pixels of a cell of the mask of the PNG (4)")
+    p.add_argument("--json", default=None, help="stats to a JSON file instead of the terminal")
+    p.set_defaults(func=cmd_solve)
+
+    p = subparsers.add_parser("mask", help="mask -> cells and components for many cell sizes and coverages")
+    p.add_argument("mask", help="PNG of the mask")
+    p.add_argument("--color", type=parse_color, action="append", dest="color_mask_lst",
+                   help="R,G,B or #RRGGBB of the mask, repeat it for more colors (0,0,0)")
+    p.add_argument("--tolerance", type=int, default=0, help="tolerance of the colors (0)")
+    p.add_argument("--cell-lens", type=parse_list, default=[4, 6, 8, 10, 15, 20], help="4,6,8,10,15,20")
+    p.add_argument("--coverages", type=lambda text: parse_list(text, float), default=[0.1, 0.25, 0.5, 0.75],
+                   help="0.1,0.25,0.5,0.75")
+    p.set_defaults(func=cmd_mask)
+
+    p = subparsers.add_parser("export", help=".maze -> final maze to SVG, PDF or PNG")
+    p.add_argument("maze", help=".maze file of generate --save")
+    p.add_argument("output", help=".svg, .pdf or .png")
+    p.add_argument("--cell-px", type=int, default=4, help="pixels of each cell of the PNG (4)")
+    p.set_defaults(func=cmd_export)
+
+    p = subparsers.add_parser("resume", help="continue a run from it's checkpoint")
+    p.add_argument("checkpoint")
+    p.add_argument("--no-rasterize", action="store_true", help="only the SVG's")
+    p.add_argument("--workers", type=int, default=None, help="processes, all the cores by default")
+    p.add_argument("--checkpoint-every", type=int, default=1000, help="frames between checkpoints (1000)")
+    p.set_defaults(func=cmd_resume)
+
+    p = subparsers.add_parser("serve", help="local maze service, HTTP on localhost or on a Unix socket")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--socket", default=None, metavar="PATH", help="Unix socket instead of host:port")
+    p.add_argument("--workers", type=int, default=None, help="processes, all the cores by default")
+    p.add_argument("--max-masks", type=int, default=64, help="processed masks kept in memory (64)")
+    p.add_argument("--quiet", action="store_true", help="don't log the requests")
+    p.set_defaults(func=cmd_serve)
+
+    p = subparsers.add_parser("test", help="run the unit test's of the CLI")
+    p.set_defaults(func=lambda args: runTests())
+    return parser
+
+
+# Return's the exit code.
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == None:
+        parser.print_help()
+        return 2
+    trace_path = getattr(args, "trace", None)
+    try:
+        if trace_path == None:
+            return args.func(args)
+        from masked_maze_generator_trace import Tracer, tracing
+        tracer = Tracer()
+        with tracing(tracer):
+            code = args.func(args)
+        tracer.write_json(trace_path)
+        return code
+    except (ValueError, AssertionError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    filepath_mask = "./png_masks/png_mask_peace_symbol_small.png"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        maze_args = [filepath_mask, "--cell-len", "10", "--color", "#000000", "--seed", "5", "--output-dir", tmp_dir]
+
+        # SVG frames, PNG's and the GIF.
+        if main(["generate"] + maze_args + ["--compact", "--schedule", "budget:20",
+                                            "--final", os.path.join(tmp_dir, "final.svg")]) != 0:
+            ok = False
+        if main(["render", tmp_dir, "--workers", "1"]) != 0 or main(["encode", tmp_dir]) != 0:
+            ok = False
+        if main(["encode", tmp_dir, "--name", "delta", "--delta"]) != 0:
+            ok = False
+        num_svg = len(os.listdir(os.path.join(tmp_dir, "a_output_svg")))
+        num_png = len(os.listdir(os.path.join(tmp_dir, "b_output_png")))
+        if num_svg != 20 or num_png != 20:
+            ok = False
+        for filepath in ["final.svg", "c_output_anim_gif/maze_anim.gif"]:
+            if not os.path.exists(os.path.join(tmp_dir, filepath)):
+                ok = False
+
+        # The same with the pipeline, without the frames on disk.
+        filepath_anim = os.path.join(tmp_dir, "pipeline.gif")
+        pipeline_args = ["--name", "pipeline", "--compact", "--schedule", "budget:10", "--workers", "1"]
+        if main(["generate"] + maze_args + pipeline_args + ["--pipeline", filepath_anim, "--no-keep-frames"]) != 0:
+            ok = False
+        if not os.path.exists(filepath_anim) or len(os.listdir(os.path.join(tmp_dir, "a_output_svg"))) != num_svg:
+            ok = False
+
+        # The .maze of the same maze, it's solution and the exports.
+        filepath_maze = os.path.join(tmp_dir, "maze.maze")
+        if main(["generate"] + maze_args + ["--frames", "none", "--save", filepath_maze]) != 0:
+            ok = False
+        filepath_json_maze = os.path.join(tmp_dir, "stats_maze.json")
+        if main(["solve", filepath_maze, "--json", filepath_json_maze]) != 0:
+            ok = False
+        for ext in [".svg", ".pdf", ".png"]:
+            if main(["export", filepath_maze, os.path.join(tmp_dir, "export" + ext)]) != 0:
+                ok = False
+
+        # Raster frames and the animation, without SVG's.
+        filepath_anim = os.path.join(tmp_dir, "raster.gif")
+        if main(["generate"] + maze_args + ["--name", "raster", "--frames", "png", "--schedule", "every:50",
+                                            "--algorithm", "prim", "--anim", filepath_anim, "--scale", "1",
+                                            "--delta"]) != 0:
+            ok = False
+        if not os.path.exists(filepath_anim) or num_svg != len(os.listdir(os.path.join(tmp_dir, "a_output_svg"))):
+            ok = False
+
+        # The solution of the same maze as generate.
+        filepath_json = os.path.join(tmp_dir, "stats.json")
+        if main(["solve"] + maze_args + ["--svg", os.path.join(tmp_dir, "solution.svg"), "--json", filepath_json]) != 0:
+            ok = False
+        with open(filepath_json) as f:
+            stats = json.load(f)
+        if stats["solution_length"] != stats["longest_path"] or stats["num_passages"] != stats["num_cells"] - 1:
+            ok = False
+        with open(filepath_json_maze) as f:
+            if json.load(f) != stats:
+                ok = False
+
+        # The mask by the coverage of the cells.
+        if main(["mask", filepath_mask, "--cell-lens", "6,10", "--coverages", "0.25,0.5"]) != 0:
+            ok = False
+        if main(["generate"] + maze_args + ["--frames", "none", "--coverage", "0.5"]) != 0:
+            ok = False
+
+        # Bad arguments.
+        if main(["generate", os.path.join(tmp_dir, "missing.png")]) != 1:
+            ok = False
+        try:
+            main(["generate", filepath_mask, "--color", "300,0,0"])
+            ok = False
+        except SystemExit:
+            pass
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def test_02(res_lst):
+    # Test 02
+    print("\nRunning test 02....\n")
+    ok = True
+
+    import tempfile
+    import subprocess
+
+    # A generate without frames doesn't import the rendering backends.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        code = ("import sys, masked_maze_generator_cli as cli\n"
+                "cli.main(['generate', './png_masks/png_mask_peace_symbol_small.png', '--frames', 'none',"
+                " '--seed', '1', '--output-dir', %r])\n"
+                "print([name for name in ('svgwrite', 'svglib', 'reportlab', 'imageio', 'masked_maze_generator_encode')"
+                " if name in sys.modules])\n" % tmp_dir)
+        output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        if output.strip().splitlines()[-1] != "[]":
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 02 PASSED.")
+    else:
+        print("...Test 02 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+    test_02(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
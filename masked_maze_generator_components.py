@@ -0,0 +1,403 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_components.py                        #
+# Description: Masks with several blobs or letters, without having to #
+#              connect them by hand in the mask. The cells inside the #
+#              mask are labeled in connected components (4 neighbors),#
+#              each component is carved independently (in parallel    #
+#              over a pool of processes for large masks) and, if      #
+#              asked, the components are joined with the minimal      #
+#              bridges of cells outside the mask, so the result is    #
+#              still a perfect maze (one path between any 2 cells).   #
+#                                                                     #
+#              Each component has it's own seed, taken in order from  #
+#              the random numbers of the generator, so the maze is    #
+#              the same with any number of workers.                   #
+#              The components are carved with the algorithm of the    #
+#              generator, the recursive backtracker by default.       #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+
+import multiprocessing
+from array import array
+from collections import deque
+
+import numpy as np
+
+from masked_maze_generator_core import MazeGenerator, MazeEventLog
+from masked_maze_generator_core import EVENT_CARVE, EVENT_END, EVENT_JUMP
+
+
+# NumPy type of the cell indexes of a MazeEventLog, array('l').
+INDEX_DTYPE = np.dtype("i%d" % array('l').itemsize)
+
+
+# Union-find with path compression (path halving) and union by size.
+class UnionFind:
+
+    def __init__(self, num):
+        self.parent = list(range(num))
+        self.size   = [1] * num
+
+
+    def find(self, a):
+        parent = self.parent
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return False
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return True
+
+
+# Labels the connected components (4 neighbors) of a boolean mask (rows,
+# cols). The horizontal runs of each row are joined with the overlapping
+# runs of the row above, so the Python work is by run and not by cell.
+# Return's (labels, num_components), labels is -1 outside the mask and the
+# components are numbered in the order of their first cell, column by
+# column like process_mask().
+def label_mask_components(mask):
+    mask = np.asarray(mask, dtype=bool)
+    rows, cols = mask.shape
+    padded = np.zeros((rows, cols + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    diff = np.diff(padded, axis=1)
+    run_row, run_start = np.nonzero(diff == 1)
+    _, run_end = np.nonzero(diff == -1)
+    num_runs = len(run_row)
+
+    uf = UnionFind(num_runs)
+    row_first = np.searchsorted(run_row, np.arange(rows + 1))
+    run_start_lst = run_start.tolist()
+    run_end_lst   = run_end.tolist()
+    for r in range(1, rows):
+        a, a_end = row_first[r - 1], row_first[r]
+        b, b_end = row_first[r], row_first[r + 1]
+        # Two pointers over the runs of the rows r-1 and r.
+        while a < a_end and b < b_end:
+            if run_start_lst[a] < run_end_lst[b] and run_start_lst[b] < run_end_lst[a]:
+                uf.union(a, b)
+            if run_end_lst[a] < run_end_lst[b]:
+                a += 1
+            else:
+                b += 1
+
+    root = np.array([uf.find(k) for k in range(num_runs)], dtype=np.int64)
+    labels = np.full((rows, cols), -1, dtype=np.int64)
+    if num_runs == 0:
+        return (labels, 0)
+    run_len = run_end - run_start
+    cell_rows = np.repeat(run_row, run_len)
+    cell_cols = np.repeat(run_start, run_len) + (np.arange(run_len.sum()) - np.repeat(np.cumsum(run_len) - run_len, run_len))
+    labels[cell_rows, cell_cols] = np.repeat(root, run_len)
+
+    # Renumbers 0..n-1 in the order of the first cell, column by column.
+    flat = labels.T.reshape(-1)
+    flat = flat[flat >= 0]
+    roots, first = np.unique(flat, return_index=True)
+    order = roots[np.argsort(first)]
+    remap = np.full(num_runs, -1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    labels[labels >= 0] = remap[labels[labels >= 0]]
+    return (labels, len(order))
+
+
+# The bounding box and the first cell (column by column) of each component
+# of the labels of label_mask_components(), in one pass over the cells.
+# Return's a list of (r0, c0, r1, c1, i_first, j_first), r1 and c1 not
+# included.
+def component_boxes(labels, num_components):
+    if num_components == 0:
+        return []
+    rows = labels.shape[0]
+    # Column by column, like the order of the first cell.
+    flat = labels.T.reshape(-1)
+    index = np.flatnonzero(flat >= 0)
+    label = flat[index]
+    order = np.argsort(label, kind="stable")
+    counts = np.bincount(label, minlength=num_components)
+    starts = np.cumsum(counts) - counts
+    j_arr = (index % rows)[order]
+    i_arr = (index // rows)[order]
+    r0 = np.minimum.reduceat(j_arr, starts)
+    r1 = np.maximum.reduceat(j_arr, starts) + 1
+    c0 = i_arr[starts]
+    c1 = i_arr[np.cumsum(counts) - 1] + 1
+    return list(zip(r0.tolist(), c0.tolist(), r1.tolist(), c1.tolist(), i_arr[starts].tolist(), j_arr[starts].tolist()))
+
+
+# Carves one component alone, in a worker process. The component comes
+# cropped to it's bounding box. algorithm is (class, params()) of the
+# algorithm of the generator, None is the recursive backtracker.
+# Return's the walls of the crop and the events with indexes of the crop.
+def carve_component(args):
+    sub_mask, i_start, j_start, seed, algorithm = args
+    rows, cols = sub_mask.shape
+    mz = MazeGenerator(i_init=i_start, j_init=j_start, x_max=cols, y_max=rows, cell_len=1, mask=sub_mask)
+    mz.set_seed(seed)
+    if algorithm != None:
+        algorithm_class, params = algorithm
+        mz.set_algorithm(algorithm_class(*params))
+    event_log = mz.event_log = MazeEventLog(cols, rows, mz.curr_index)
+    while mz.step() != EVENT_END:
+        pass
+    return (bytes(mz.grid.walls), event_log.kind.tobytes(), event_log.cell_from.tobytes(), event_log.cell_to.tobytes())
+
+
+# Indexes of the crop (sub_cols wide, at row r0 and column c0) to indexes
+# of the grid.
+def local_to_global(local, sub_cols, r0, c0, cols):
+    return (local // sub_cols + r0) * cols + (local % sub_cols + c0)
+
+
+# Multi source BFS from all the components over the cells outside the
+# mask, then for each pair of components the shortest bridge, then the
+# minimum spanning tree (Kruskal) of those bridges. Return's the list of
+# paths, each one from a cell of a component to a cell of another one.
+def find_bridges(labels, num_components):
+    rows, cols = labels.shape
+    num_cells = rows * cols
+    owner  = labels.reshape(-1).copy()
+    dist   = np.where(owner >= 0, 0, -1).astype(np.int64)
+    parent = np.full(num_cells, -1, dtype=np.int64)
+
+    owner_lst  = owner.tolist()
+    dist_lst   = dist.tolist()
+    parent_lst = parent.tolist()
+    queue = deque(np.flatnonzero(owner >= 0).tolist())
+    while queue:
+        index = queue.popleft()
+        i = index % cols
+        for offset, valid in ((-cols, index >= cols), (1, i < cols - 1), (cols, index < num_cells - cols), (-1, i > 0)):
+            if valid:
+                n = index + offset
+                if owner_lst[n] < 0:
+                    owner_lst[n]  = owner_lst[index]
+                    dist_lst[n]   = dist_lst[index] + 1
+                    parent_lst[n] = index
+                    queue.append(n)
+    owner = np.array(owner_lst, dtype=np.int64).reshape(rows, cols)
+    dist  = np.array(dist_lst, dtype=np.int64).reshape(rows, cols)
+
+    # Candidate bridges, between 2 adjacent cells (horizontal and vertical)
+    # of different owners, the cost is the number of cells outside the mask.
+    index = np.arange(num_cells).reshape(rows, cols)
+    candidates = []
+    for a, b in (((slice(None), slice(None, -1)), (slice(None), slice(1, None))),
+                 ((slice(None, -1), slice(None)), (slice(1, None), slice(None)))):
+        a_owner, b_owner = owner[a], owner[b]
+        sel = (a_owner >= 0) & (b_owner >= 0) & (a_owner != b_owner)
+        candidates.append(np.stack([(dist[a] + dist[b])[sel], index[a][sel], index[b][sel],
+                                    a_owner[sel], b_owner[sel]], axis=1))
+    candidates = np.concatenate(candidates)
+    candidates = candidates[np.lexsort((candidates[:, 2], candidates[:, 1], candidates[:, 0]))]
+
+    uf = UnionFind(num_components)
+    path_lst = []
+    for cost, a_index, b_index, comp_a, comp_b in candidates.tolist():
+        if uf.union(comp_a, comp_b):
+            path_a = [a_index]
+            while parent_lst[path_a[-1]] >= 0:
+                path_a.append(parent_lst[path_a[-1]])
+            path_b = [b_index]
+            while parent_lst[path_b[-1]] >= 0:
+                path_b.append(parent_lst[path_b[-1]])
+            path_lst.append(path_a[::-1] + path_b)
+            if len(path_lst) == num_components - 1:
+                break
+    return path_lst
+
+
+# Carves all the components of the mask of the generator. With bridges the
+# components are joined by bridges of cells outside the mask (they are
+# added to the mask). workers=1 carves in this process.
+# Return's the MazeEventLog, the components one after the other (a
+# EVENT_JUMP between them) and the bridges at the end.
+def generate_components(gen_maze, workers=1, bridges=False):
+    grid = gen_maze.grid
+    cols, rows = grid.cols, grid.rows
+    labels, num_components = label_mask_components(grid.mask_2d())
+    print("Start generating %d components of the mask ..." % num_components)
+
+    start_label = labels.reshape(-1)[gen_maze.start_index]
+    # A new instance of the algorithm of the generator in each component.
+    algorithm = None
+    if gen_maze.algorithm != None:
+        algorithm = (type(gen_maze.algorithm), gen_maze.algorithm.params())
+    job_lst  = []
+    box_lst  = []
+    for label, (r0, c0, r1, c1, i_first, j_first) in enumerate(component_boxes(labels, num_components)):
+        sub_mask = labels[r0:r1, c0:c1] == label
+        if label == start_label:
+            i_start, j_start = gen_maze.start_index % cols - c0, gen_maze.start_index // cols - r0
+        else:
+            # First cell, column by column.
+            i_start, j_start = i_first - c0, j_first - r0
+        # Seeds taken in order, the same maze with any number of workers.
+        job_lst.append((sub_mask, int(i_start), int(j_start), gen_maze.rng.getrandbits(64), algorithm))
+        box_lst.append((r0, c0, r1 - r0, c1 - c0))
+
+    if workers > 1 and num_components > 1:
+        with multiprocessing.Pool(processes=min(workers, num_components)) as pool:
+            result_lst = pool.map(carve_component, job_lst, chunksize=max(1, num_components // (workers * 4)))
+    else:
+        result_lst = [carve_component(job) for job in job_lst]
+
+    walls = grid.walls_2d()
+    event_log  = None
+    curr_index = None
+    for label, (result, (r0, c0, sub_rows, sub_cols)) in enumerate(zip(result_lst, box_lst)):
+        sub_walls, kind, cell_from, cell_to = result
+        sub_mask = job_lst[label][0]
+        sub_walls = np.frombuffer(sub_walls, dtype=np.uint8).reshape(sub_rows, sub_cols)
+        walls[r0:r0 + sub_rows, c0:c0 + sub_cols][sub_mask] = sub_walls[sub_mask]
+        grid.visited_2d()[r0:r0 + sub_rows, c0:c0 + sub_cols][sub_mask] = 1
+
+        kind      = np.frombuffer(kind, dtype=np.uint8)
+        cell_from = local_to_global(np.frombuffer(cell_from, dtype=INDEX_DTYPE), sub_cols, r0, c0, cols)
+        cell_to   = local_to_global(np.frombuffer(cell_to, dtype=INDEX_DTYPE), sub_cols, r0, c0, cols)
+        if event_log == None:
+            event_log = MazeEventLog(cols, rows, int(cell_from[0]))
+        else:
+            event_log.append(EVENT_JUMP, curr_index, int(cell_from[0]))
+        # Without the EVENT_END of the component, a component of one cell
+        # has only that one.
+        event_log.extend(kind[:-1].tolist(), cell_from[:-1].tolist(), cell_to[:-1].tolist())
+        curr_index = int(cell_to[-2]) if len(kind) > 1 else int(cell_from[0])
+
+    if bridges and num_components > 1:
+        path_lst = find_bridges(labels, num_components)
+        num_bridge_cells = 0
+        for path in path_lst:
+            event_log.append(EVENT_JUMP, curr_index, path[0])
+            for index_from, index_to in zip(path[:-1], path[1:]):
+                if grid.inside_mask[index_to] == 0:
+                    grid.inside_mask[index_to] = 1
+                    num_bridge_cells += 1
+                grid.visited[index_to] = 1
+                grid.remove_walls(index_from, index_to)
+                event_log.append(EVENT_CARVE, index_from, index_to)
+            curr_index = path[-1]
+        grid.neighbor_bits = grid.calc_neighbor_bits()
+        gen_maze.inside_mask_index_lst = grid.inside_mask_index_lst()
+        print("  %d bridges with %d cells" % (len(path_lst), num_bridge_cells))
+
+    event_log.append(EVENT_END, curr_index, curr_index)
+    gen_maze.event_log  = event_log
+    gen_maze.curr_index = curr_index
+    print("...ending generating components, %d events" % len(event_log))
+    return event_log
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    # Three blobs, one of them only touches another one by a corner.
+    mask = np.zeros((20, 30), dtype=bool)
+    mask[2:8, 2:10]   = True
+    mask[8:12, 10:14] = True
+    mask[14:19, 3:28] = True
+    labels, num_components = label_mask_components(mask)
+    if num_components != 3 or np.any((labels >= 0) != mask):
+        ok = False
+
+    # The components with the algorithm of the generator too.
+    from masked_maze_generator_algorithms import Prim
+    from masked_maze_generator_core import EVENT_BACKTRACK
+    for algorithm in [None, Prim()]:
+        logs = []
+        for workers in [1, 3]:
+            mz = MazeGenerator(i_init=2, j_init=2, x_max=30, y_max=20, cell_len=1, mask=mask)
+            mz.set_seed(5)
+            mz.set_algorithm(algorithm)
+            logs.append(list(generate_components(mz, workers=workers, bridges=True)))
+            # A perfect maze: connected and without loops, cells - 1 passages.
+            inside = np.flatnonzero(np.frombuffer(mz.grid.inside_mask, dtype=np.uint8))
+            walls = mz.grid.walls
+            num_passages = 0
+            seen = {int(inside[0])}
+            stack = [int(inside[0])]
+            while stack:
+                index = stack.pop()
+                for bit, offset in mz.grid.directions:
+                    if mz.grid.neighbor_bits[index] & bit and not walls[index] & bit:
+                        num_passages += 1
+                        if index + offset not in seen:
+                            seen.add(index + offset)
+                            stack.append(index + offset)
+            if len(seen) != len(inside) or num_passages // 2 != len(inside) - 1:
+                ok = False
+        if logs[0] != logs[1]:
+            ok = False
+        # Prim doesn't backtrack.
+        has_backtrack = any(kind == EVENT_BACKTRACK for kind, _, _ in logs[0])
+        if has_backtrack != (algorithm == None):
+            ok = False
+
+    # The boxes and first cells of many small blobs, as the scan of each label.
+    rng = np.random.default_rng(1)
+    mask_dots = rng.random((40, 50)) < 0.3
+    labels, num_components = label_mask_components(mask_dots)
+    box_lst = []
+    for label in range(num_components):
+        j_arr, i_arr = np.nonzero(labels == label)
+        first = np.lexsort((j_arr, i_arr))[0]
+        box_lst.append((j_arr.min(), i_arr.min(), j_arr.max() + 1, i_arr.max() + 1, i_arr[first], j_arr[first]))
+    if num_components < 100 or component_boxes(labels, num_components) != box_lst:
+        ok = False
+    if component_boxes(*label_mask_components(np.zeros((3, 4), dtype=bool))) != []:
+        ok = False
+
+    # The first component only one isolated cell.
+    mask_one = mask.copy()
+    mask_one[0, 0] = True
+    mz = MazeGenerator(i_init=2, j_init=2, x_max=30, y_max=20, cell_len=1, mask=mask_one)
+    mz.set_seed(5)
+    event_log = generate_components(mz, bridges=True)
+    kind, cell_from, cell_to = event_log.kind, event_log.cell_from, event_log.cell_to
+    if cell_from[0] != 0 or kind[0] != EVENT_JUMP or cell_to[0] == 0:
+        ok = False
+    if sum(1 for index in np.flatnonzero(mask_one) if not mz.grid.visited[index]) != 0:
+        ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the mask components....\n\n")
+    runTests()
+    print("\n...Finished running tests to the mask components....")
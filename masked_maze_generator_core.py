@@ -55,8 +55,8 @@
 # Note: External libraries that have to be installed:
 #   -svgwrite
 #   -svglib
-#   -imageio
 #   -pillow
+#   -numpy
 #   -moviepy  [Not using this one, for MP4 encoding use FFMPEG program ]
 
 #######################################################################
@@ -71,28 +71,29 @@ from __future__ import print_function
 import sys 
 import os
 
-try:
-    import svgwrite
-except ImportError:
-    sys.path.insert(0, os.path.abspath(os.path.split(os.path.abspath(__file__))[0]+'/..'))
-
-import svgwrite
-if svgwrite.version < (1,0,1):
-    print("This script requires svgwrite 1.0.1 or newer for internal stylesheets.")
-    sys.exit()
-
-
 import random
 import math
-
-
-from svglib.svglib import svg2rlg
-from reportlab.graphics import renderPDF, renderPM
-
-import imageio    # External lib imageio
-
-# Pillow lib
-from PIL import Image
+from array import array
+from itertools import islice
+
+import numpy as np
+
+from masked_maze_generator_trace import get_tracer
+
+# The rendering backends (svgwrite, Pillow, svglib + reportlab and the
+# encoders) are imported by the functions that use them, a run that only
+# processes the mask and generates the maze doesn't load them, see
+# masked_maze_generator_cli.py .
+def import_svgwrite():
+    try:
+        import svgwrite
+    except ImportError:
+        sys.path.insert(0, os.path.abspath(os.path.split(os.path.abspath(__file__))[0]+'/..'))
+        import svgwrite
+    if svgwrite.version < (1,0,1):
+        print("This script requires svgwrite 1.0.1 or newer for internal stylesheets.")
+        sys.exit()
+    return svgwrite
 
 # moviepy lib
 # from moviepy.editor import *
@@ -111,108 +112,193 @@ CSS_STYLES = """
 
 #    .line { stroke: firebrick; stroke-width: .1mm; }
 
+# Kinds of events in the MazeEventLog.
+EVENT_CARVE     = 0    # Wall removed between cell_from and cell_to, cell_to is the new current cell.
+EVENT_BACKTRACK = 1    # Popped cell_to from the stack, it's the new current cell.
+EVENT_END       = 2    # Stack is empty, the maze is complete (cell_from == cell_to).
+EVENT_JUMP      = 3    # cell_to is the new current cell without carving, start of another tree.
+
+
+# Bits of the walls of a cell, in the same order of Cell.walls. The same
+# bits are used for the neighbors of a cell in MazeGrid.neighbor_bits.
+WALL_TOP    = 1
+WALL_RIGHT  = 2
+WALL_BOTTOM = 4
+WALL_LEFT   = 8
+WALL_ALL    = WALL_TOP | WALL_RIGHT | WALL_BOTTOM | WALL_LEFT
+
+
+# Compact grid of the maze, one byte of each flat array for each cell,
+# index = j * cols + i. The arrays are bytearray's, fast to index from
+# Python, and the *_2d() methods return NumPy views (rows, cols) of the
+# same memory without copies.
+class MazeGrid:
+
+    def __init__(self, cols, rows, inside_mask=None):
+        num_cells = cols * rows
+        self.cols = cols
+        self.rows = rows
+        if inside_mask is None:
+            self.inside_mask = bytearray([1]) * num_cells
+        else:
+            self.inside_mask = bytearray(np.asarray(inside_mask, dtype=np.uint8).reshape(-1))
+            if len(self.inside_mask) != num_cells:
+                raise ValueError("ERROR in MazeGrid the inside_mask doesn't have cols * rows cells!")
+        self.walls   = bytearray([WALL_ALL]) * num_cells
+        self.visited = bytearray(num_cells)
+
+        # Precomputed (bit, offset) of the 4 neighbors, top, right, bottom, left.
+        self.directions    = ((WALL_TOP, -cols), (WALL_RIGHT, 1), (WALL_BOTTOM, cols), (WALL_LEFT, -1))
+        # For each cell, the bits of the neighbors inside the border and inside the mask.
+        self.neighbor_bits = self.calc_neighbor_bits()
+
+
+    def mask_2d(self):
+        return np.frombuffer(self.inside_mask, dtype=np.uint8).reshape(self.rows, self.cols)
+
+
+    def walls_2d(self):
+        return np.frombuffer(self.walls, dtype=np.uint8).reshape(self.rows, self.cols)
+
+
+    def visited_2d(self):
+        return np.frombuffer(self.visited, dtype=np.uint8).reshape(self.rows, self.cols)
+
+
+    def calc_neighbor_bits(self):
+        mask = self.mask_2d()
+        bits = np.zeros((self.rows, self.cols), dtype=np.uint8)
+        bits[1:, :]  |= mask[:-1, :] * WALL_TOP
+        bits[:, :-1] |= mask[:, 1:]  * WALL_RIGHT
+        bits[:-1, :] |= mask[1:, :]  * WALL_BOTTOM
+        bits[:, 1:]  |= mask[:, :-1] * WALL_LEFT
+        bits *= mask
+        return bytearray(bits.tobytes())
 
+
+    # Indexes of the cells inside the mask, column by column like the
+    # original list of Cell's, so the SVG's are written in the same order.
+    def inside_mask_index_lst(self):
+        i_arr, j_arr = np.nonzero(self.mask_2d().T)
+        return array('l', (j_arr * self.cols + i_arr).tolist())
+
+
+    def remove_walls(self, index_a, index_b):
+        diff = index_b - index_a
+        if diff == -self.cols:
+            self.walls[index_a] &= ~WALL_TOP
+            self.walls[index_b] &= ~WALL_BOTTOM
+        elif diff == 1:
+            self.walls[index_a] &= ~WALL_RIGHT
+            self.walls[index_b] &= ~WALL_LEFT
+        elif diff == self.cols:
+            self.walls[index_a] &= ~WALL_BOTTOM
+            self.walls[index_b] &= ~WALL_TOP
+        elif diff == -1:
+            self.walls[index_a] &= ~WALL_LEFT
+            self.walls[index_b] &= ~WALL_RIGHT
+
+
+    def nbytes(self):
+        return len(self.inside_mask) + len(self.walls) + len(self.visited) + len(self.neighbor_bits)
+
+
+# A view of one cell of the MazeGrid, the state lives in the arrays of
+# the grid and the Cell objects are only created when they are asked for.
 class Cell:
 
-    def __init__(self, gen_maze, i, j, inside_mask=True):
+    def __init__(self, gen_maze, i, j):
             self.gen_maze = gen_maze
-            self.i           = i     # Cell num of Col
-            self.j           = j     # Cell num of row
-            self.walls       = [True, True, True, True]
-            self.visited     = False
-            self.inside_mask = inside_mask
+            self.i        = i     # Cell num of Col
+            self.j        = j     # Cell num of row
+            self.index    = j * gen_maze.cols + i
 
 
-    def index_test(self, i, j):
-        inside_border = True
-        if (i < 0) or (j < 0) or (i > self.gen_maze.cols - 1) or (j > self.gen_maze.rows - 1):
-            inside_border = False 
-        return (i, j, inside_border)
+    @property
+    def walls(self):
+        bits = self.gen_maze.grid.walls[self.index]
+        return [bool(bits & WALL_TOP), bool(bits & WALL_RIGHT), bool(bits & WALL_BOTTOM), bool(bits & WALL_LEFT)]
 
 
-    def ret_if_is_inside_mask(self):
-        if self.inside_mask == True:
-            return self
-        else:
-            None
+    @property
+    def visited(self):
+        return self.gen_maze.grid.visited[self.index] == 1
 
 
-    def check_neighbors(self):
-        top       = None
-        right     = None
-        bottom    = None
-        left      = None
-
-        i = self.i
-        j = self.j
-
-        grid = self.gen_maze.grid
-        neighbors = []
-
-        i_n, j_n, inside_border = self.index_test(i, j-1) 
-        if inside_border:
-            top    = grid[i_n][j_n].ret_if_is_inside_mask()
-        i_n, j_n, inside_border = self.index_test(i+1, j) 
-        if inside_border:
-            right  = grid[i_n][j_n].ret_if_is_inside_mask()
-        i_n, j_n, inside_border = self.index_test(i, j+1) 
-        if inside_border:
-            bottom = grid[i_n][j_n].ret_if_is_inside_mask()
-        i_n, j_n, inside_border = self.index_test(i-1, j) 
-        if inside_border:
-            left   = grid[i_n][j_n].ret_if_is_inside_mask()
-
-        if (top != None) and (not (top.visited)):
-            neighbors.append(top)
-        if (right != None) and (not (right.visited)):
-            neighbors.append(right)
-        if (bottom != None) and (not (bottom.visited)):
-            neighbors.append(bottom)
-        if (left != None) and (not (left.visited)):
-            neighbors.append(left)
-
-        if len(neighbors) > 0:
-            r = random.randint( 0, len(neighbors) - 1 )
-            return neighbors[r]
-        else:
-            return None
+    @visited.setter
+    def visited(self, value):
+        self.gen_maze.grid.visited[self.index] = 1 if value else 0
 
 
-    def group(self, dwg, classname):
-        return dwg.add(dwg.g(class_=classname))   
+    @property
+    def inside_mask(self):
+        return self.gen_maze.grid.inside_mask[self.index] == 1
 
 
-    def highlight(self, dwg):
-        highlight_squares = self.group(dwg, "highlightsquare")
-        w = self.gen_maze.w
-        x = self.i * w
-        y = self.j * w
+    def check_neighbors(self):
+        index = self.gen_maze.choose_neighbor(self.index)
+        if index >= 0:
+            return self.gen_maze.cell_at(index)
+        return None
 
-        square = dwg.rect(insert=(x, y), size=(w, w))
-        highlight_squares.add(square)
+
+    def highlight(self, dwg):
+        self.gen_maze.highlight_cell(dwg, self.index)
 
 
     def show(self, dwg):
-        if self.inside_mask == False:
-            return    # Only draws the lines inside the mask.
-        lines = self.group(dwg, "line")
-        w = self.gen_maze.w
-        x = self.i * w
-        y = self.j * w
-        # stroke(255)
-        if self.walls[0]:
-            lines.add(dwg.line(start=(x, y), end=(x+w, y)))
-        if self.walls[1]:
-            lines.add(dwg.line(start=(x+w, y), end=(x+w, y+w)))
-        if self.walls[2]:
-            lines.add(dwg.line(start=(x+w, y+w), end=(x, y+w)))
-        if self.walls[3]:
-            lines.add(dwg.line(start=(x, y+w), end=(x, y)))
-    
-        if self.visited:
-            blue_squares = self.group(dwg, "bluesquare")
-            square = dwg.rect(insert=(x, y), size=(w, w))
-            blue_squares.add(square)
+        self.gen_maze.show_cell(dwg, self.index)
+
+
+# Compact record of every step of the generation, one event per step
+# (the same steps that draw_step() would render as frames). The cells are
+# stored as flat indexes, index = j * cols + i, in arrays of machine ints
+# so a maze with millions of cells doesn't need millions of Python objects.
+# Renderers replay it later, frame k shows the maze before event k is
+# applied with cell_from[k] highlighted as the current cell.
+class MazeEventLog:
+
+    def __init__(self, cols, rows, start_index):
+        self.cols        = cols
+        self.rows        = rows
+        self.start_index = start_index
+        self.kind        = array('B')
+        self.cell_from   = array('l')
+        self.cell_to     = array('l')
+
+
+    def append(self, kind, index_from, index_to):
+        self.kind.append(kind)
+        self.cell_from.append(index_from)
+        self.cell_to.append(index_to)
+
+
+    def __len__(self):
+        return len(self.kind)
+
+
+    def __iter__(self):
+        return zip(self.kind, self.cell_from, self.cell_to)
+
+
+    def count(self, kind):
+        return self.kind.count(kind)
+
+
+    # Appends the events of arrays (or lists) of kinds and cell indexes.
+    def extend(self, kind, cell_from, cell_to):
+        self.kind.extend(kind)
+        self.cell_from.extend(cell_from)
+        self.cell_to.extend(cell_to)
+
+
+    # NumPy view of the kinds, without copy.
+    def kind_array(self):
+        return np.frombuffer(self.kind, dtype=np.uint8)
+
+
+    def index_to_ij(self, index):
+        return (index % self.cols, index // self.cols)
 
 
 def calc_num_squares(dim_max, cell_len): 
@@ -231,7 +317,10 @@ def gen_mask_key_reverse(key):
 
 class MazeGenerator:
 
-    def __init__(self, i_init, j_init, x_max, y_max, cell_len, maze_name="maze_building_process", mask_dic = None):
+    # mask is the boolean array (rows, cols) of process_mask(), mask_dic
+    # is the older dict of gen_mask_key() keys, still accepted.
+    def __init__(self, i_init, j_init, x_max, y_max, cell_len, maze_name="maze_building_process", mask_dic = None,
+                 mask = None):
         self.w               = cell_len                     # Length of the square of the cell.
         self.x_max           = x_max     
         self.y_max           = y_max
@@ -242,73 +331,136 @@ class MazeGenerator:
         self.subdir_svg      = "./a_output_svg/"
         self.subdir_png      = "./b_output_png/"
         self.subdir_anim_gif = "./c_output_anim_gif/"
+        self.rng             = random.Random()              # Each generator has it's own random numbers.
+        self.seed            = None                         # The value of set_seed(), None is a random maze.
         self.counter         = 0
         self.file_svg_lst    = []
+        self.compact_svg     = False                        # One merged <path> for the walls of a frame.
 
         self.mask_dic = mask_dic
 
         self.i_init = i_init
         self.j_init = j_init
 
-        self.cells_inside_mask_lst = []
-
-        self.grid            = self.initialization()
-        self.stack           = []                           # Used for backtracking.
-        if self.grid[i_init][j_init].inside_mask == False:
+        inside_mask = None
+        if mask is not None:
+            inside_mask = np.asarray(mask, dtype=bool)
+            if inside_mask.shape != (self.rows, self.cols):
+                raise ValueError("ERROR in MazeGenerator the mask has shape %s and the grid is %d rows x %d cols!"
+                                 % (inside_mask.shape, self.rows, self.cols))
+        elif self.mask_dic != None:
+            inside_mask = bytearray(self.cols * self.rows)
+            for key in self.mask_dic:
+                i, j = gen_mask_key_reverse(key)
+                if i < self.cols and j < self.rows:
+                    inside_mask[j * self.cols + i] = 1
+
+        self.grid            = MazeGrid(self.cols, self.rows, inside_mask)
+        # Used for faster drawing.
+        self.inside_mask_index_lst = self.grid.inside_mask_index_lst()
+        self.stack           = array('l')                   # Used for backtracking, cell indexes.
+        self.candidates      = [0, 0, 0, 0]                 # Unvisited neighbors, reused on each step.
+        self.event_log       = None                         # MazeEventLog, when recording.
+        self.algorithm       = None                         # None is the recursive backtracker of step().
+        self.checkpointer    = None                         # Checkpointer, when saving checkpoints.
+        self.cache           = None                         # MazeCache of the generated mazes.
+        self.on_frame        = None                         # Called with the filepath of each SVG frame.
+        if self.grid.inside_mask[j_init * self.cols + i_init] == 0:
             raise AssertionError("ERROR in MazeGenerator i_int and j_init aren't inside the mask if the is a mask!")
-        self.curr_cell       = self.grid[i_init][j_init]
-
-
-    def initialization(self):
-        grid_new = []
-        inside_mask = True
-        for i in range(self.cols):        
-            row = []
-            for j in range(self.rows):
-                if self.mask_dic != None:
-                    key = gen_mask_key(i, j)
-                    if key in self.mask_dic:
-                        inside_mask = True
-                    else:
-                        inside_mask = False
-                cell_tmp =  Cell(self, i, j, inside_mask)   
-                row.append( cell_tmp )
-                if inside_mask == True:
-                    # Used for faster drawing.
-                    self.cells_inside_mask_lst.append( cell_tmp )
-            grid_new.append(row)
-        return grid_new
+        self.start_index     = j_init * self.cols + i_init
+        self.curr_index      = self.start_index
+
+
+    @property
+    def curr_cell(self):
+        return self.cell_at(self.curr_index)
+
+
+    def cell_at(self, index):
+        return Cell(self, index % self.cols, index // self.cols)
+
+
+    def cell_index(self, cell):
+        return cell.j * self.cols + cell.i
 
 
     def remove_walls(self, cell_a, cell_b):
-        a = cell_a
-        b = cell_b
-
-        x = a.i - b.i
-        if x == 1:
-            a.walls[3] = False
-            b.walls[1] = False
-        elif x == -1:
-            a.walls[1] = False
-            b.walls[3] = False
-        
-        y = a.j - b.j
-        if y == 1:
-            a.walls[0] = False
-            b.walls[2] = False
-        elif y == -1:
-            a.walls[2] = False
-            b.walls[0] = False
+        self.grid.remove_walls(self.cell_index(cell_a), self.cell_index(cell_b))
+
+
+    # Return's a random unvisited neighbor of the cell, or -1.
+    def choose_neighbor(self, index):
+        grid       = self.grid
+        bits       = grid.neighbor_bits[index]
+        visited    = grid.visited
+        candidates = self.candidates
+        num = 0
+        for bit, offset in grid.directions:
+            if bits & bit and not visited[index + offset]:
+                candidates[num] = index + offset
+                num += 1
+        if num > 0:
+            r = self.rng.randint( 0, num - 1 )
+            return candidates[r]
+        return -1
 
 
-    def draw_step(self):
+    def group(self, dwg, classname):
+        return dwg.add(dwg.g(class_=classname))   
+
+
+    def highlight_cell(self, dwg, index):
+        highlight_squares = self.group(dwg, "highlightsquare")
+        w = self.w
+        x = (index % self.cols) * w
+        y = (index // self.cols) * w
+
+        square = dwg.rect(insert=(x, y), size=(w, w))
+        highlight_squares.add(square)
+
+
+    def show_cell(self, dwg, index):
+        if self.grid.inside_mask[index] == 0:
+            return    # Only draws the lines inside the mask.
+        walls = self.grid.walls[index]
+        w = self.w
+        x = (index % self.cols) * w
+        y = (index // self.cols) * w
+        lines = self.group(dwg, "line")
+        # stroke(255)
+        if walls & WALL_TOP:
+            lines.add(dwg.line(start=(x, y), end=(x+w, y)))
+        if walls & WALL_RIGHT:
+            lines.add(dwg.line(start=(x+w, y), end=(x+w, y+w)))
+        if walls & WALL_BOTTOM:
+            lines.add(dwg.line(start=(x+w, y+w), end=(x, y+w)))
+        if walls & WALL_LEFT:
+            lines.add(dwg.line(start=(x, y+w), end=(x, y)))
+
+        if self.grid.visited[index]:
+            blue_squares = self.group(dwg, "bluesquare")
+            square = dwg.rect(insert=(x, y), size=(w, w))
+            blue_squares.add(square)
+
+
+    # Draws the current state of the maze to the next SVG frame.
+    def draw_frame(self):
         filename = self.maze_name + "_%06d.svg" % (self.counter)
         self.file_svg_lst.append(filename)
         filepath = self.subdir_svg + filename
 
-        dwg = svgwrite.Drawing(filepath, size=BOARD_SIZE)
         self.counter += 1
 
+        if self.compact_svg:
+            # Merged walls and visited squares, see masked_maze_generator_svg.py .
+            from masked_maze_generator_svg import write_compact_svg_frame
+            self.grid.visited[self.curr_index] = 1
+            write_compact_svg_frame(filepath, self.grid, self.w, self.x_max, self.y_max, self.curr_index)
+            return
+
+        svgwrite = import_svgwrite()
+        dwg = svgwrite.Drawing(filepath, size=BOARD_SIZE)
+
         # checkerboard has a size of 10cm x 10cm;
         # defining a viewbox with the size of 80x80 means, that a length of 1
         # is 10cm/80 == 0.125cm (which is for now the famous USER UNIT)
@@ -327,56 +479,249 @@ class MazeGenerator:
         
         # for j in range(self.rows):
         #     for i in range(self.cols):
-        #         cell = self.grid[i][j]
-        #         cell.show(dwg)
+        #         self.show_cell(dwg, j * self.cols + i)
 
         # Optimized version.
-        for cell in self.cells_inside_mask_lst:
-            cell.show(dwg)
+        for index in self.inside_mask_index_lst:
+            self.show_cell(dwg, index)
 
-        self.curr_cell.visited = True
-        self.curr_cell.highlight(dwg)
+        self.grid.visited[self.curr_index] = 1
+        self.highlight_cell(dwg, self.curr_index)
 
         dwg.save()
 
-        # STEP 1
-        next_cell = self.curr_cell.check_neighbors()
-        if next_cell != None:
-            # print("i= %d, j= %d" % (next_cell.i, next_cell.j) )
 
-            next_cell.visited = True
+    def draw_step(self):
+        self.draw_frame()
+        return self.step() != EVENT_END
+
+
+    # Back to the start, all walls up, no cell visited and no frames.
+    def reset(self):
+        self.grid            = MazeGrid(self.cols, self.rows, self.grid.inside_mask)
+        self.stack           = array('l')
+        self.curr_index      = self.start_index
+        self.counter         = 0
+        self.file_svg_lst    = []
+        if self.algorithm != None:
+            self.algorithm.reset(self)
+
+
+    # Applies one event of a MazeEventLog to the grid, without the RNG.
+    def apply_event(self, kind, index_from, index_to):
+        self.grid.visited[index_from] = 1
+        if kind == EVENT_CARVE:
+            self.grid.visited[index_to] = 1
+            self.grid.remove_walls(index_from, index_to)
+        elif kind == EVENT_JUMP:
+            self.grid.visited[index_to] = 1
+        self.curr_index = index_to
+
+
+    # One step of the recursive backtracker without any drawing.
+    # Return's the kind of event of the step.
+    def step(self):
+        if self.algorithm != None:
+            kind, index_from, self.curr_index = self.algorithm.step(self)
+            if self.event_log != None:
+                self.event_log.append(kind, index_from, self.curr_index)
+            return kind
+
+        index_from = self.curr_index
+        grid = self.grid
+        grid.visited[index_from] = 1
+
+        # STEP 1
+        next_index = self.choose_neighbor(index_from)
+        if next_index >= 0:
+            grid.visited[next_index] = 1
 
             # STEP 2
-            self.stack.append(self.curr_cell)
+            self.stack.append(index_from)
 
             # STEP 3
-            self.remove_walls(self.curr_cell, next_cell)
+            grid.remove_walls(index_from, next_index)
 
             # STEP 4
-            self.curr_cell = next_cell
+            self.curr_index = next_index
+            kind = EVENT_CARVE
         elif len(self.stack) > 0:
             # If doesn't have neighbors it makes backtraking.
-            # self.curr_cell = self.stack.pop(len(self.stack) - 1)
-            self.curr_cell = self.stack.pop()
-            # print("pop## i= %d, j= %d" % (self.curr_cell.i, self.curr_cell.j) )
+            self.curr_index = self.stack.pop()
+            kind = EVENT_BACKTRACK
         else:
-            return False        
-        return True
+            kind = EVENT_END
+
+        if self.event_log != None:
+            self.event_log.append(kind, index_from, self.curr_index)
+        return kind
+
+
+    # With a schedule (see masked_maze_generator_schedule.py) the maze is
+    # generated headless first and then only the scheduled steps are
+    # drawn, replaying the event log. The SVG's are numbered sequentially.
+    # With a cache the maze is generated headless (or loaded) and all the
+    # steps are drawn from the event log, the same SVG's.
+    def generate(self, schedule=None):
+        if schedule != None:
+            self.generate_scheduled(schedule)
+            return
+        if self.cache != None and self.seed != None:
+            event_log = self.generate_headless()
+            self.reset()
+            self.replay_scheduled(bytearray(b"\x01") * len(event_log))
+            return
+        tracer = get_tracer()
+        with tracer.stage("generate_svg"):
+            print("Start generating SVG's ...")
+            num_steps = self.estimated_num_steps()
+            while(True):
+                time_start = tracer.clock()
+                more = self.draw_step()
+                tracer.frame("svg_frame", time_start, self.subdir_svg + self.file_svg_lst[-1])
+                if self.on_frame != None:
+                    self.on_frame(self.subdir_svg + self.file_svg_lst[-1])
+                tracer.gauge("max_stack_depth", len(self.stack))
+                tracer.progress(self.counter, num_steps)
+                if more == False:
+                    break
+                if self.checkpointer != None:
+                    self.checkpointer.tick(self)
+            if self.checkpointer != None:
+                self.checkpointer.done(self)
+            print("...ending generating SVG's")
+
+
+    def generate_scheduled(self, schedule):
+        event_log = self.generate_headless()
+        selected = schedule.frame_mask(event_log)
+        self.reset()
+        self.replay_scheduled(selected)
+
+
+    # Replays the event log from the event position, drawing the frames
+    # of selected (the frame mask of the schedule). The grid has to be in
+    # the state before the event position, a resume starts in the middle.
+    def replay_scheduled(self, selected, position=0):
+        tracer = get_tracer()
+        event_log = self.event_log
+        with tracer.stage("generate_scheduled"):
+            num_frames = selected.count(1)
+            print("Start generating %d SVG's of %d steps ..." % (num_frames, len(event_log)))
+            for k, (kind, index_from, index_to) in enumerate(islice(event_log, position, None), position):
+                if selected[k]:
+                    time_start = tracer.clock()
+                    self.draw_frame()
+                    tracer.frame("svg_frame", time_start, self.subdir_svg + self.file_svg_lst[-1])
+                    if self.on_frame != None:
+                        self.on_frame(self.subdir_svg + self.file_svg_lst[-1])
+                    tracer.progress(self.counter, num_frames)
+                self.apply_event(kind, index_from, index_to)
+                if selected[k] and self.checkpointer != None:
+                    self.checkpointer.tick(self, k + 1, selected)
+            if self.checkpointer != None:
+                self.checkpointer.done(self)
+            print("...ending generating SVG's")
+
+
+    # Number of steps of the generation, exact for the recursive
+    # backtracker on a mask of one blob (2 steps for each cell but the
+    # first, + the end).
+    def estimated_num_steps(self):
+        num_cells = len(self.inside_mask_index_lst)
+        if self.algorithm == None:
+            return 2 * num_cells - 1
+        return num_cells
+
+
+    # Runs the DFS to the end without rendering any frame, O(N) in the
+    # number of cells, and return's the MazeEventLog of all the steps.
+    def generate_headless(self):
+        tracer = get_tracer()
+        if self.cache != None and self.seed != None:
+            key = self.cache.maze_key(self)
+            with tracer.stage("cache_load"):
+                if self.cache.get_maze(key, self) != None:
+                    print("...maze loaded from the cache, %d events" % len(self.event_log))
+                    return self.event_log
+            self.generate_headless_stage(tracer)
+            self.cache.put_maze(key, self)
+            return self.event_log
+        self.generate_headless_stage(tracer)
+        return self.event_log
+
+
+    def generate_headless_stage(self, tracer):
+        with tracer.stage("generate_headless"):
+            print("Start generating maze headless ...")
+            event_log = self.event_log = MazeEventLog(self.cols, self.rows, self.curr_index)
+            num_steps = self.estimated_num_steps()
+            while(True):
+                if self.step() == EVENT_END:
+                    break
+                if len(event_log) & 0xFFFF == 0:
+                    tracer.progress(len(event_log), num_steps)
+            if tracer.active and self.algorithm == None and len(event_log) > 0:
+                # The depth of the stack after each event.
+                kinds = event_log.kind_array()
+                depth = np.cumsum((kinds == EVENT_CARVE).astype(np.int64) - (kinds == EVENT_BACKTRACK))
+                tracer.gauge("max_stack_depth", int(depth.max()))
+            print("...ending generating maze headless, %d events" % len(event_log))
+
+
+    # Another algorithm instead of the recursive backtracker, see
+    # masked_maze_generator_algorithms.py. None is the backtracker again.
+    def set_algorithm(self, algorithm):
+        self.algorithm = algorithm
+        if algorithm != None:
+            algorithm.reset(self)
+
+
+    # For masks with many blobs or letters, see
+    # masked_maze_generator_components.py. Each connected component is
+    # carved (workers processes) and with bridges they are all joined.
+    def generate_components(self, workers=1, bridges=False):
+        from masked_maze_generator_components import generate_components
+        return generate_components(self, workers, bridges)
+
+
+    # Saves the state of the generation to filepath every every_frames
+    # frames (or every_seconds), see masked_maze_generator_checkpoint.py,
+    # resume(filepath) continues a run that died. None stops it.
+    def set_checkpoint(self, filepath, every_frames=1000, every_seconds=None):
+        from masked_maze_generator_checkpoint import Checkpointer
+        self.checkpointer = Checkpointer(filepath, every_frames, every_seconds) if filepath != None else None
+
+
+    # Seeds only the random numbers of this generator, the same maze as
+    # with random.seed(value) of the global random numbers before.
+    def set_seed(self, value):
+            self.seed = value
+            self.rng.seed(value)
 
 
-    def generate(self):
-        print("Start generating SVG's ...")
-        while(True):
-            if self.draw_step() == False:
-                break
-        print("...ending generating SVG's")
+    # The generated mazes are saved to (and loaded from) the MazeCache of
+    # masked_maze_generator_cache.py, only with a seed. None stops it.
+    def set_cache(self, cache):
+        self.cache = cache
 
 
-    def set_seed(self, value):
-            random.seed(value)
+    # The SVG, PNG and animated GIF subdirs inside output_dir, they are
+    # created if they don't exist.
+    def set_output_dir(self, output_dir):
+        self.subdir_svg      = os.path.join(output_dir, "a_output_svg", "")
+        self.subdir_png      = os.path.join(output_dir, "b_output_png", "")
+        self.subdir_anim_gif = os.path.join(output_dir, "c_output_anim_gif", "")
+        for subdir in [self.subdir_svg, self.subdir_png, self.subdir_anim_gif]:
+            os.makedirs(subdir, exist_ok=True)
 
 
-    def process_svg_to_png_to_anin_gif(self):
+    # workers is the number of processes that convert the SVG's to PNG,
+    # None uses all the cores. With resume the PNG's that exist and are
+    # valid aren't converted again, and the GIF only if a PNG changed.
+    def process_svg_to_png_to_anin_gif(self, workers=None, chunksize=None, resume=False, delta=False):
+        from masked_maze_generator_encode import encode_frames, iter_png_frames, palette_from_png
+        from masked_maze_generator_svg2png import rasterize_svg_lst, is_valid_png
 
         # self.subdir_svg      = "./output_svg/"
         # self.subdir_png      = "./output_png/"
@@ -385,45 +730,61 @@ class MazeGenerator:
         # n SVG -> n PNG
         print("Start converting SVG's to PNG ...")
         file_png_lst = []
+        filepath_pair_lst = []
         for file_svg in self.file_svg_lst:
             filepath_svg = self.subdir_svg + file_svg
             file_png = file_svg[:-4] + ".png"
             file_png_lst.append(file_png)
             filepath_png = self.subdir_png + file_png
-            
-            drawing = svg2rlg(filepath_svg)
-            renderPM.drawToFile(drawing, filepath_png, fmt="PNG")
+            if resume and is_valid_png(filepath_png, filepath_svg):
+                continue
+            filepath_pair_lst.append((filepath_svg, filepath_png))
+
+        tracer = get_tracer()
+        with tracer.stage("svg_to_png", num_frames=len(filepath_pair_lst)):
+            if tracer.active:
+                rasterize_svg_lst(filepath_pair_lst, workers=workers, chunksize=chunksize,
+                                  progress=lambda done, total, time_start: tracer.progress(done, total))
+                tracer.count("png_bytes", sum(os.path.getsize(filepath_png) for _, filepath_png in filepath_pair_lst))
+            else:
+                rasterize_svg_lst(filepath_pair_lst, workers=workers, chunksize=chunksize)
         print("...ending converting SVG's to PNG ")
 
 
         # n PNG -> 1 anim GIF
+        # The frames are streamed to the GIF, only one PNG is in memory.
         print("Start creating anim GIF from n PNG's ...")
-        images = []
-        for file_png in file_png_lst:
-            filepath_png = self.subdir_png      + file_png
-            file_gif = self.maze_name + "_anim.gif"
-            filepath_gif = self.subdir_anim_gif + file_gif
-            images.append(imageio.imread(filepath_png))
-        imageio.mimsave(filepath_gif, images)
+        file_gif = self.maze_name + "_anim.gif"
+        filepath_gif = self.subdir_anim_gif + file_gif
+        filepath_png_lst = [self.subdir_png + file_png for file_png in file_png_lst]
+        if resume and len(filepath_pair_lst) == 0 and os.path.exists(filepath_gif) \
+           and all(os.path.getmtime(filepath_png) <= os.path.getmtime(filepath_gif) for filepath_png in filepath_png_lst):
+            print("...the anim GIF is up to date")
+            return
+        # Written to a temporary file and renamed, a GIF is never half written.
+        filepath_gif_tmp = filepath_gif[:-4] + ".tmp.gif"
+        with tracer.stage("anim_gif"):
+            # delta, only the changes of each frame with a fixed palette.
+            palette_colors = palette_from_png(filepath_png_lst) if delta else None
+            encode_frames(iter_png_frames(filepath_png_lst), filepath_gif_tmp, total=len(filepath_png_lst),
+                          palette_colors=palette_colors, delta=delta)
+        os.replace(filepath_gif_tmp, filepath_gif)
         print("...ending creating anim GIF from n PNG's")
 
 
 
 
 # This function is to process the last part manually is something goes wrong.
-def manual_n_png_to_anim_gif(png_dir_path_from, anim_gif_dir_path_to, maze_name):
+# The output can also be a MP4 or WebM, see encode_frames().
+def manual_n_png_to_anim_gif(png_dir_path_from, anim_gif_dir_path_to, maze_name, ext=".gif", fps=10, delta=False):
+        from masked_maze_generator_encode import encode_frames, iter_png_frames, palette_from_png
         # n PNG -> 1 anim GIF
         print("Start manually creating anim GIF from n PNG's ...")
-        files_png_lst = sorted((fn for fn in os.listdir(png_dir_path_from)))
-        counter = 0
-        with imageio.get_writer(anim_gif_dir_path_to + maze_name + "_anim.gif", mode='I') as writer:
-            for filename_png in files_png_lst:
-                if counter % 100 == 0:
-                    print(filename_png)
-                counter += 1
-                image = imageio.imread(png_dir_path_from + filename_png)
-                writer.append_data(image)
-        writer.close()
+        files_png_lst = sorted((fn for fn in os.listdir(png_dir_path_from) if fn.endswith(".png")))
+        filepath_png_lst = [png_dir_path_from + filename_png for filename_png in files_png_lst]
+        palette_colors = palette_from_png(filepath_png_lst) if delta else None
+        encode_frames(iter_png_frames(filepath_png_lst), anim_gif_dir_path_to + maze_name + "_anim" + ext,
+                      fps=fps, progress_every=100, palette_colors=palette_colors, delta=delta)
         print("...ending manually creating anim GIF from n PNG's")
 
 
@@ -435,62 +796,139 @@ def manual_n_png_to_anim_gif(png_dir_path_from, anim_gif_dir_path_to, maze_name)
 #     print("...end from animated GIF to MP4 video.")
 
 
-# Return's a dic with the position and the mask colours.
-def process_mask(filepath_mask, cell_len, color_mask_lst):
-    im = Image.open(filepath_mask).convert('RGB')
-    px = im.load()
+# Boolean array (j_max, i_max) of the cells that have the color of the
+# center pixel in color_mask_lst. All the centers are taken in one strided
+# slice of the image. tolerance is the maximum difference for each
+# channel, an int or a (r, g, b) tuple, 0 is the exact color.
+def sample_mask(img_array, cell_len, color_mask_lst, tolerance=0):
+    i_max = calc_num_squares(img_array.shape[1], cell_len)
+    j_max = calc_num_squares(img_array.shape[0], cell_len)
+    c = cell_len // 2
+    samples = img_array[c:j_max * cell_len:cell_len, c:i_max * cell_len:cell_len, :3]
+    samples = samples.astype(np.int16)
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.int16), (3,))
+
+    mask = np.zeros((j_max, i_max), dtype=bool)
+    for color_rgb in color_mask_lst:
+        diff = np.abs(samples - np.asarray(color_rgb[:3], dtype=np.int16))
+        mask |= np.all(diff <= tolerance, axis=2)
+    return mask
+
+
+# Summed-area table of the pixels with the colors of color_mask_lst, built
+# in one pass over the image. The pixels of the mask in any rectangle are 4
+# lookups, so the coverage of all the cells is O(1) for each cell, for any
+# cell_len and threshold. Thin strokes and antialiased edges are included
+# by how much of the cell they cover and not by the pixel at the center.
+class MaskCoverage:
+
+    def __init__(self, img_array, color_mask_lst, tolerance=0):
+        tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.int16), (3,))
+        inside = np.zeros(img_array.shape[:2], dtype=bool)
+        for color_rgb in color_mask_lst:
+            # Channel by channel, without an int16 copy of the image.
+            match = np.ones(img_array.shape[:2], dtype=bool)
+            for channel in range(3):
+                low  = max(0,   int(color_rgb[channel]) - int(tolerance[channel]))
+                high = min(255, int(color_rgb[channel]) + int(tolerance[channel]))
+                values = img_array[:, :, channel]
+                match &= (values >= low) & (values <= high)
+            inside |= match
+        self.height, self.width = inside.shape
+        # table[y, x] is the number of mask pixels above and to the left of (x, y).
+        self.table = np.zeros((self.height + 1, self.width + 1), dtype=np.int64)
+        np.cumsum(inside, axis=0, dtype=np.int64, out=self.table[1:, 1:])
+        np.cumsum(self.table[1:, 1:], axis=1, out=self.table[1:, 1:])
+
+
+    # Number of mask pixels of each cell, array (rows, cols).
+    def counts(self, cell_len):
+        i_max = calc_num_squares(self.width, cell_len)
+        j_max = calc_num_squares(self.height, cell_len)
+        corners = self.table[0:j_max * cell_len + 1:cell_len, 0:i_max * cell_len + 1:cell_len]
+        return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+
+    # Fraction of each cell covered by the mask colors, from 0.0 to 1.0.
+    def fractions(self, cell_len):
+        return self.counts(cell_len) / float(cell_len * cell_len)
+
+
+    # Boolean array (rows, cols) of the cells with at least coverage of
+    # their pixels in the mask, coverage 0 is any pixel.
+    def mask(self, cell_len, coverage=0.5):
+        min_pixels = max(1, math.ceil(coverage * cell_len * cell_len))
+        return self.counts(cell_len) >= min_pixels
+
+
+def load_mask_coverage(filepath_mask, color_mask_lst, tolerance=0):
+    from PIL import Image
+    with Image.open(filepath_mask) as im:
+        img_array = np.asarray(im.convert('RGB'))
+    return MaskCoverage(img_array, color_mask_lst, tolerance)
+
+
+# Black image with a white point at the center of each cell inside the mask.
+def save_mask_test(filepath, mask, img_size, cell_len):
+    j_max, i_max = mask.shape
+    c = cell_len // 2
+    target = np.zeros((img_size[1], img_size[0], 3), dtype=np.uint8)
+    centers = target[c:j_max * cell_len:cell_len, c:i_max * cell_len:cell_len]
+    centers[mask] = 255
+    from PIL import Image
+    Image.fromarray(target, "RGB").save(filepath, "PNG")
+
+
+# First cell inside the mask, searching column by column.
+def first_cell_inside_mask(mask):
+    i_arr, j_arr = np.nonzero(mask.T)
+    if len(i_arr) == 0:
+        return (-1, -1)
+    return (int(i_arr[0]), int(j_arr[0]))
+
+
+# Return's a boolean array (rows, cols) with the cells inside the mask colours.
+# coverage None tests the pixel at the center of each cell, a fraction
+# (0.5 is half) tests how much of the cell has the mask colours, see
+# MaskCoverage. With a MazeCache the mask of the same PNG and parameters
+# is loaded.
+def process_mask(filepath_mask, cell_len, color_mask_lst, tolerance=0, write_mask_test=True, cache=None,
+                 coverage=None):
+    with get_tracer().stage("process_mask"):
+        if cache != None:
+            return cache.process_mask(filepath_mask, cell_len, color_mask_lst, tolerance, write_mask_test, coverage)
+        return process_mask_stage(filepath_mask, cell_len, color_mask_lst, tolerance, write_mask_test, coverage)
+
+
+def process_mask_stage(filepath_mask, cell_len, color_mask_lst, tolerance, write_mask_test, coverage=None):
+    from PIL import Image
+    im = Image.open(filepath_mask)
     print("\n\n", filepath_mask, im.format, "%dx%d" % im.size, im.mode, "\n\n" )
-    mask_dic = {}
-    mask_img_x_max, mask_img_y_max = im.size
-
-    i_max = calc_num_squares(mask_img_x_max, cell_len) 
-    j_max = calc_num_squares(mask_img_y_max, cell_len) 
-
-    i_init = -1
-    j_init = -1
-
-    flag_execute_one_time = True
-
-    for i in range(i_max):
-        for j in range(j_max):
-            i_p = i * cell_len + cell_len // 2 
-            j_p = j * cell_len + cell_len // 2
-            color_rgb = px[i_p,j_p]
-            inside_mask = False
-
-            # # Black letters in mask.
-            # if color_rgb == (0, 0, 0):
-            #     inside_mask = True
-            #     key = gen_mask_key(i, j)
-            #     mask_dic[key] = "B"
-
-            if color_rgb in color_mask_lst:
-                inside_mask = True
-                key = gen_mask_key(i, j)
-                mask_dic[key] = "B"
-
-            if flag_execute_one_time == True and inside_mask == True:
-                flag_execute_one_time = False
-                i_init = i
-                j_init = j
-                print("i, j = ", i,", ", j)
-                print("i_p, j_p = ", i_p,", ", j_p)
-
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    img_array = np.asarray(im)
     im.close()
 
-    img_target = Image.new(im.mode, im.size, color=0)
-    px_target = img_target.load()
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max = mask_from_array(img_array, cell_len, color_mask_lst,
+                                                                          tolerance, coverage)
+    if i_init >= 0:
+        print("i, j = ", i_init,", ", j_init)
+        print("i_p, j_p = ", i_init * cell_len + cell_len // 2,", ", j_init * cell_len + cell_len // 2)
 
-    for key, val in mask_dic.items():
-        i_n, j_n = gen_mask_key_reverse(key)
-        i_p = i_n * cell_len + cell_len // 2 
-        j_p = j_n * cell_len + cell_len // 2
-        pixel = (255, 255, 255)
-        px_target[i_p, j_p] = pixel 
-    
-    img_target.save(filepath_mask[:-4] + "mask_test.png", "PNG")
+    if write_mask_test:
+        save_mask_test(filepath_mask[:-4] + "mask_test.png", mask, (mask_img_x_max, mask_img_y_max), cell_len)
 
-    return (i_init, j_init, mask_dic, mask_img_x_max, mask_img_y_max) 
+    return (i_init, j_init, mask, mask_img_x_max, mask_img_y_max) 
+
+
+# process_mask() of an RGB image already in memory, without any print.
+def mask_from_array(img_array, cell_len, color_mask_lst, tolerance=0, coverage=None):
+    if coverage == None:
+        mask = sample_mask(img_array, cell_len, color_mask_lst, tolerance)
+    else:
+        mask = MaskCoverage(img_array, color_mask_lst, tolerance).mask(cell_len, coverage)
+    i_init, j_init = first_cell_inside_mask(mask)
+    return (i_init, j_init, mask, img_array.shape[1], img_array.shape[0])
 
 
 ###############
@@ -534,11 +972,11 @@ def test_01(res_lst):
     color_mask_lst = [ (0, 0, 0) ]
 
 
-    i_init, j_init, mask_dic, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst )
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst )
 
 
     mz_01 = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
-                           cell_len=cell_len, maze_name=maze_name, mask_dic=mask_dic)
+                           cell_len=cell_len, maze_name=maze_name, mask=mask)
     mz_01.set_seed(1)
     print("Begin generating.....\n\n\n")
     mz_01.generate()
@@ -549,12 +987,95 @@ def test_01(res_lst):
         print("...Test 01 PASSED.")
   
 
+def test_02(res_lst):
+    # Test 02
+    print("\nRunning test 02....\n")
+    ok = True
+
+    # Headless generation, same seed gives the same event log.
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst )
+
+    logs = []
+    for _ in range(2):
+        mz = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
+                            cell_len=cell_len, mask=mask)
+        mz.set_seed(1)
+        logs.append(mz.generate_headless())
+
+    log = logs[0]
+    num_carves = log.count(EVENT_CARVE)
+    num_visited = sum(mz.grid.visited)
+    if list(logs[0]) != list(logs[1]):
+        ok = False
+    if num_carves != num_visited - 1 or log.count(EVENT_BACKTRACK) != num_carves:
+        ok = False
+    if len(log) != 2 * num_carves + 1 or log.kind[-1] != EVENT_END:
+        ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 02 PASSED.")
+    else:
+        print("...Test 02 FAILED.")
+
+
+def test_03(res_lst):
+    # Test 03
+    print("\nRunning test 03....\n")
+    ok = True
+
+    import tempfile
+    from PIL import Image
+
+    # Random image of black, grey (antialiased edges) and white pixels.
+    rng = np.random.RandomState(3)
+    img_array = rng.choice(np.array([0, 100, 255], dtype=np.uint8), size=(67, 53, 1)).repeat(3, axis=2)
+    color_mask_lst = [ (0, 0, 0) ]
+
+    # The coverage of each cell, the same as counting the pixels.
+    coverage = MaskCoverage(img_array, color_mask_lst, tolerance=100)
+    inside = np.all(img_array <= 100, axis=2)
+    for cell_len in [1, 4, 7, 10]:
+        rows, cols = calc_num_squares(67, cell_len), calc_num_squares(53, cell_len)
+        counts = inside[:rows * cell_len, :cols * cell_len].reshape(rows, cell_len, cols, cell_len).sum(axis=(1, 3))
+        if not np.array_equal(coverage.counts(cell_len), counts):
+            ok = False
+        for threshold in [0, 0.25, 0.5, 1]:
+            expected = counts >= max(1, math.ceil(threshold * cell_len * cell_len))
+            if not np.array_equal(coverage.mask(cell_len, threshold), expected):
+                ok = False
+
+    # A thin stroke away from the centers of the cells.
+    img_array = np.full((40, 40, 3), 255, dtype=np.uint8)
+    img_array[:, 1] = 0
+    if sample_mask(img_array, 10, color_mask_lst).any():
+        ok = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath_mask = os.path.join(tmp_dir, "stroke.png")
+        Image.fromarray(img_array, "RGB").save(filepath_mask)
+        mask = process_mask(filepath_mask, 10, color_mask_lst, write_mask_test=False, coverage=0.1)[2]
+        if mask[:, 0].tolist() != [True] * 4 or mask[:, 1:].any():
+            ok = False
+        if process_mask(filepath_mask, 10, color_mask_lst, write_mask_test=False, coverage=0.2)[2].any():
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 03 PASSED.")
+    else:
+        print("...Test 03 FAILED.")
+
+
 def runTests():
     res = []
     
+    test_02(res)
+    test_03(res)
     test_01(res)
-    # test_02(res)
-    # test_03(res)
     
     if all(res):
         print("\n** PASSED ALL TESTS! **")
@@ -0,0 +1,556 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_encode.py                            #
+# Description: Streaming output stage for the masked Maze Generator.  #
+#              The frames are pushed one by one, as they are          #
+#              produced, to an incremental animated GIF writer or     #
+#              through a pipe into FFMPEG for MP4 / WebM. Only the    #
+#              current frame is in memory, so the memory doesn't      #
+#              depend on the number of frames and no intermediate     #
+#              PNG files are needed.                                  #
+#                                                                     #
+#              DeltaGifStreamWriter writes only the rectangle that    #
+#              changed since the previous frame, one step of the maze #
+#              is one or two cells, with a fixed palette and the      #
+#              pixels that didn't change transparent.                 #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+#   -pillow
+#   -FFMPEG program, only for MP4 / WebM output.
+
+import io
+import os
+import struct
+import subprocess
+
+import numpy as np
+
+# Pillow lib
+from PIL import Image
+
+from masked_maze_generator_trace import get_tracer
+
+
+# Returns the color table and the image data (LZW min code size plus the
+# data sub-blocks) of a one frame GIF file made by Pillow.
+def split_gif_frame(data):
+    pos = 6
+    _, _, packed, _, _ = struct.unpack("<HHBBB", data[pos:pos + 7])
+    pos += 7
+    color_table = b""
+    if packed & 0x80:
+        size = 3 * (2 << (packed & 0x07))
+        color_table = data[pos:pos + size]
+        pos += size
+    # Skips the extensions until the image descriptor.
+    while data[pos] == 0x21:
+        pos += 2
+        while data[pos] != 0:
+            pos += data[pos] + 1
+        pos += 1
+    if data[pos] != 0x2C:
+        raise ValueError("ERROR in split_gif_frame, image descriptor not found!")
+    packed = data[pos + 9]
+    pos += 10
+    if packed & 0x80:
+        size = 3 * (2 << (packed & 0x07))
+        color_table = data[pos:pos + size]
+        pos += size
+    start = pos
+    pos += 1    # LZW min code size.
+    while data[pos] != 0:
+        pos += data[pos] + 1
+    pos += 1
+    return (color_table, data[start:pos])
+
+
+def color_table_size_bits(color_table):
+    num_colors = len(color_table) // 3
+    bits = 0
+    while (2 << bits) < num_colors:
+        bits += 1
+    return bits
+
+
+def to_pil_image(frame):
+    if isinstance(frame, Image.Image):
+        return frame.convert("RGB")
+    return Image.fromarray(np.asarray(frame, dtype=np.uint8), "RGB")
+
+
+# The fixed palette of palette_colors (a list of RGB tuples), None for the
+# adaptive palette of each frame. Return's (palette_image, flat colors).
+def make_palette_image(palette_colors):
+    if palette_colors == None:
+        return (None, None)
+    if len(palette_colors) > 256:
+        raise ValueError("ERROR in GifStreamWriter, a GIF palette has at most 256 colors!")
+    palette_flat  = [component for color in palette_colors for component in color]
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette_flat + [0] * (768 - len(palette_flat)))
+    return (palette_image, palette_flat)
+
+
+def quantize_image(im, palette_image=None, palette_flat=None):
+    if palette_image == None:
+        return im.quantize(colors=256, dither=Image.Dither.NONE)
+    im_p = im.quantize(palette=palette_image, dither=Image.Dither.NONE)
+    # Only the colors of the palette, so the color table is small.
+    im_p.putpalette(palette_flat)
+    return im_p
+
+
+def encode_image(im_p):
+    buf = io.BytesIO()
+    # Not interlaced, the image descriptor is written again without the flag.
+    im_p.save(buf, "GIF", optimize=False, interlace=False)
+    return split_gif_frame(buf.getvalue())
+
+
+# Quantizes and encodes one frame, the slow part of a GIF, so it can run
+# in other processes (see masked_maze_generator_pipeline.py).
+# Return's (size, color_table, image_data) for GifStreamWriter.append_encoded().
+def encode_gif_frame(frame, palette_colors=None):
+    im = to_pil_image(frame)
+    return (im.size,) + encode_image(quantize_image(im, *make_palette_image(palette_colors)))
+
+
+# Animated GIF written frame by frame, nothing is kept in memory after a
+# frame is appended. With palette_colors (a list of RGB tuples) all the
+# frames are mapped to that fixed shared palette, without it each frame
+# gets an adaptive palette in a local color table.
+class GifStreamWriter:
+
+    def __init__(self, filepath, duration_ms=100, loop=0, palette_colors=None):
+        self.filepath    = filepath
+        self.duration_ms = duration_ms
+        self.loop        = loop
+        self.fp          = open(filepath, "wb")
+        self.size        = None
+        self.num_frames  = 0
+        self.global_color_table = None
+
+        self.palette_image, self.palette_colors = make_palette_image(palette_colors)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def quantize(self, im):
+        return quantize_image(im, self.palette_image, self.palette_colors)
+
+
+    def encode(self, im_p):
+        return encode_image(im_p)
+
+
+    def write_header(self, color_table):
+        width, height = self.size
+        self.global_color_table = color_table
+        bits = color_table_size_bits(color_table)
+        self.fp.write(b"GIF89a")
+        self.fp.write(struct.pack("<HHBBB", width, height, 0xF0 | bits, 0, 0))
+        self.fp.write(color_table.ljust(3 * (2 << bits), b"\x00"))
+        # NETSCAPE2.0 extension, number of loops (0 is forever).
+        self.fp.write(b"\x21\xFF\x0BNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+
+
+    # Writes one frame, or a sub-rectangle of the canvas at offset (x, y).
+    def write_frame(self, color_table, image_data, box, disposal=1, transparent_index=None, duration_ms=None):
+        x, y, width, height = box
+        delay = int(round((duration_ms if duration_ms != None else self.duration_ms) / 10.0))
+        flags = disposal << 2
+        if transparent_index != None:
+            flags |= 1
+        self.fp.write(b"\x21\xF9\x04" + struct.pack("<BHB", flags, delay,
+                      transparent_index if transparent_index != None else 0) + b"\x00")
+        if color_table == self.global_color_table:
+            self.fp.write(b"\x2C" + struct.pack("<HHHHB", x, y, width, height, 0))
+        else:
+            bits = color_table_size_bits(color_table)
+            self.fp.write(b"\x2C" + struct.pack("<HHHHB", x, y, width, height, 0x80 | bits))
+            self.fp.write(color_table.ljust(3 * (2 << bits), b"\x00"))
+        self.fp.write(image_data)
+
+
+    def append_frame(self, frame):
+        im = to_pil_image(frame)
+        self.append_encoded(im.size, *self.encode(self.quantize(im)))
+
+
+    # A frame of encode_gif_frame(), quantized and encoded somewhere else.
+    def append_encoded(self, size, color_table, image_data):
+        if self.size == None:
+            self.size = size
+            self.write_header(color_table)
+        elif size != self.size:
+            raise ValueError("ERROR in GifStreamWriter, all the frames must have the same size!")
+        self.write_frame(color_table, image_data, (0, 0) + size)
+        self.num_frames += 1
+
+
+    def close(self):
+        if self.fp == None:
+            return
+        if self.size != None:
+            self.fp.write(b"\x3B")    # Trailer.
+        self.fp.close()
+        self.fp = None
+
+
+# Maps RGB pixels to the index of the nearest color of a fixed palette.
+# The frames of a maze have few colors, each one is searched only once.
+class PaletteMapper:
+
+    def __init__(self, palette_colors):
+        self.palette = np.asarray(palette_colors, dtype=np.int32).reshape(-1, 3)
+        self.cache   = {}       # 0xRRGGBB -> index.
+
+
+    # rgb is an array (..., 3), return's an uint8 array (...).
+    def map(self, rgb):
+        rgb = rgb.astype(np.uint32)
+        keys = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        lut = np.empty(len(unique_keys), dtype=np.uint8)
+        for k, key in enumerate(unique_keys.tolist()):
+            index = self.cache.get(key)
+            if index == None:
+                color = np.array([key >> 16, (key >> 8) & 0xFF, key & 0xFF], dtype=np.int32)
+                index = int(np.argmin(((self.palette - color) ** 2).sum(axis=1)))
+                self.cache[key] = index
+            lut[k] = index
+        return lut[inverse.reshape(keys.shape)]
+
+
+# A fixed palette for PNG frames that weren't drawn with one (the
+# antialiased SVG's), from a few of the frames, the first and the last
+# have all the colors. Return's at most num_colors RGB tuples.
+def palette_from_frames(frames, num_colors=255):
+    im_lst = [to_pil_image(frame) for frame in frames]
+    width  = max(im.size[0] for im in im_lst)
+    height = sum(im.size[1] for im in im_lst)
+    strip  = Image.new("RGB", (width, height), im_lst[0].getpixel((0, 0)))
+    y = 0
+    for im in im_lst:
+        strip.paste(im, (0, y))
+        y += im.size[1]
+    colors = strip.getcolors(num_colors)
+    if colors != None:
+        return [color for _, color in sorted(colors, reverse=True)]
+    im_p = strip.quantize(colors=num_colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    palette = im_p.getpalette()
+    return [tuple(palette[3 * k:3 * k + 3]) for k in range(min(num_colors, len(palette) // 3))]
+
+
+# palette_from_frames() of the first, the middle and the last PNG.
+def palette_from_png(filepath_png_lst, num_colors=255):
+    if len(filepath_png_lst) == 0:
+        return None
+    num = len(filepath_png_lst)
+    filepath_sample_lst = [filepath_png_lst[k] for k in sorted(set([0, num // 2, num - 1]))]
+    return palette_from_frames(list(iter_png_frames(filepath_sample_lst)), num_colors)
+
+
+# Animated GIF of the changes between the frames. The first frame is the
+# whole canvas, the next ones only the bounding box of the pixels that
+# changed, drawn over the previous frame (disposal 1, do not dispose) and
+# with the pixels that are the same transparent, so LZW gets long runs.
+# Only the pixels that changed are mapped to the palette.
+# Frames without changes aren't written, the delay of the previous frame
+# grows instead. The palette is fixed, one global color table, and it has
+# at most 255 colors, the last index is the transparent one.
+class DeltaGifStreamWriter(GifStreamWriter):
+
+    def __init__(self, filepath, duration_ms=100, loop=0, palette_colors=None):
+        if palette_colors == None or len(palette_colors) > 255:
+            raise ValueError("ERROR in DeltaGifStreamWriter, it needs a fixed palette of at most 255 colors!")
+        GifStreamWriter.__init__(self, filepath, duration_ms, loop)
+        self.mapper            = PaletteMapper(palette_colors)
+        self.transparent_index = len(palette_colors)
+        self.palette_flat      = [component for color in palette_colors for component in color] + [0, 0, 0]
+        self.prev_rgb          = None        # The last frame.
+        self.pending           = None        # (box, image_data, transparent, duration_ms) not written yet.
+        self.num_written       = 0           # Frames in the GIF, without the ones without changes.
+
+
+    def encode_indexes(self, indexes):
+        im_p = Image.fromarray(indexes, "P")
+        im_p.putpalette(self.palette_flat)
+        return encode_image(im_p)
+
+
+    def append_frame(self, frame):
+        if isinstance(frame, np.ndarray):
+            # A copy, the renderers draw the next frame in the same array.
+            rgb = np.array(frame[:, :, :3], dtype=np.uint8)
+        else:
+            rgb = np.asarray(to_pil_image(frame))
+        height, width = rgb.shape[:2]
+        if self.size == None:
+            self.size = (width, height)
+            color_table, image_data = self.encode_indexes(self.mapper.map(rgb))
+            self.write_header(color_table)
+            self.pending = ((0, 0, width, height), color_table, image_data, False, self.duration_ms)
+        else:
+            if (width, height) != self.size:
+                raise ValueError("ERROR in DeltaGifStreamWriter, all the frames must have the same size!")
+            # The rows first, comparing them as rows of bytes is fast.
+            diff = rgb.reshape(height, -1) != self.prev_rgb.reshape(height, -1)
+            rows = np.flatnonzero(diff.any(axis=1))
+            if len(rows) == 0:
+                box, color_table, image_data, transparent, duration_ms = self.pending
+                self.pending = (box, color_table, image_data, transparent, duration_ms + self.duration_ms)
+            else:
+                y0, y1 = rows[0], rows[-1] + 1
+                diff_rows = diff[y0:y1].reshape(y1 - y0, width, 3)
+                changed = diff_rows[:, :, 0] | diff_rows[:, :, 1] | diff_rows[:, :, 2]
+                cols = np.flatnonzero(changed.any(axis=0))
+                x0, x1 = cols[0], cols[-1] + 1
+                changed_box = changed[:, x0:x1]
+                indexes = self.mapper.map(rgb[y0:y1, x0:x1][changed_box])
+                delta = np.full(changed_box.shape, self.transparent_index, dtype=np.uint8)
+                delta[changed_box] = indexes
+                self.write_pending()
+                color_table, image_data = self.encode_indexes(delta)
+                self.pending = ((int(x0), int(y0), int(x1 - x0), int(y1 - y0)), color_table, image_data,
+                                True, self.duration_ms)
+        self.prev_rgb = rgb
+        self.num_frames += 1
+
+
+    def write_pending(self):
+        if self.pending == None:
+            return
+        box, color_table, image_data, transparent, duration_ms = self.pending
+        self.write_frame(color_table, image_data, box, disposal=1,
+                         transparent_index=self.transparent_index if transparent else None,
+                         duration_ms=duration_ms)
+        self.pending = None
+        self.num_written += 1
+
+
+    def close(self):
+        if self.fp != None:
+            self.write_pending()
+        GifStreamWriter.close(self)
+
+
+# MP4 or WebM written by FFMPEG, the raw RGB frames are piped to it's
+# stdin. The process is started with the size of the first frame.
+class FfmpegStreamWriter:
+
+    def __init__(self, filepath, fps=25, ffmpeg_bin="ffmpeg", extra_args=None):
+        self.filepath   = filepath
+        self.fps        = fps
+        self.ffmpeg_bin = ffmpeg_bin
+        self.extra_args = extra_args
+        self.process    = None
+        self.size       = None
+        self.num_frames = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def codec_args(self):
+        if self.extra_args != None:
+            return list(self.extra_args)
+        # Even dimensions needed by yuv420p, like the FFMPEG command at
+        # the beginning of masked_maze_generator_core.py .
+        scale = ["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2", "-pix_fmt", "yuv420p"]
+        if self.filepath.lower().endswith(".webm"):
+            return ["-c:v", "libvpx-vp9", "-b:v", "0", "-crf", "32"] + scale
+        return ["-c:v", "libx264", "-movflags", "faststart"] + scale
+
+
+    def start(self, size):
+        self.size = size
+        cmd = [self.ffmpeg_bin, "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "%dx%d" % size,
+               "-r", str(self.fps), "-i", "-"] + self.codec_args() + [self.filepath]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+
+    def append_frame(self, frame):
+        if isinstance(frame, Image.Image):
+            frame = np.asarray(frame.convert("RGB"))
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        size = (frame.shape[1], frame.shape[0])
+        if self.process == None:
+            self.start(size)
+        elif size != self.size:
+            raise ValueError("ERROR in FfmpegStreamWriter, all the frames must have the same size!")
+        self.process.stdin.write(frame.tobytes())
+        self.num_frames += 1
+
+
+    def close(self):
+        if self.process == None:
+            return
+        self.process.stdin.close()
+        return_code = self.process.wait()
+        self.process = None
+        if return_code != 0:
+            raise RuntimeError("ERROR in FfmpegStreamWriter, ffmpeg returned %d for %s" % (return_code, self.filepath))
+
+
+# Chooses the writer from the extension of the output file. delta is the
+# GIF of the changes between the frames, it needs palette_colors.
+def open_stream_writer(filepath, fps=10, palette_colors=None, delta=False):
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == ".gif" and delta:
+        return DeltaGifStreamWriter(filepath, duration_ms=1000.0 / fps, palette_colors=palette_colors)
+    if ext == ".gif":
+        return GifStreamWriter(filepath, duration_ms=1000.0 / fps, palette_colors=palette_colors)
+    if ext in (".mp4", ".webm", ".mkv", ".mov"):
+        return FfmpegStreamWriter(filepath, fps=fps)
+    raise ValueError("ERROR in open_stream_writer, unknown output format %s" % ext)
+
+
+# Pushes the frames, as they are produced, to the output file.
+# Return's the number of frames written. total is the number of frames
+# for the ETA of the progress line of the tracer.
+def encode_frames(frames, filepath, fps=10, palette_colors=None, progress_every=0, total=None, delta=False):
+    tracer = get_tracer()
+    with open_stream_writer(filepath, fps=fps, palette_colors=palette_colors, delta=delta) as writer:
+        time_start = tracer.clock()
+        for frame in frames:
+            writer.append_frame(frame)
+            tracer.frame("anim_frame", time_start)
+            tracer.progress(writer.num_frames, total)
+            if progress_every > 0 and writer.num_frames % progress_every == 0:
+                print("frame %d" % writer.num_frames)
+            time_start = tracer.clock()
+    if tracer.active:
+        tracer.count("encode_bytes", os.path.getsize(filepath))
+    return writer.num_frames
+
+
+# Yield's the PNG's one at a time.
+def iter_png_frames(filepath_png_lst):
+    for filepath_png in filepath_png_lst:
+        with Image.open(filepath_png) as im:
+            yield im.convert("RGB")
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    # Writes a streamed GIF and reads it back with Pillow.
+    colors = [ (255, 255, 255), (255, 0, 0), (0, 0, 255), (0, 128, 0) ]
+    frames = []
+    for k in range(5):
+        frame = np.zeros((30, 40, 3), dtype=np.uint8)
+        frame[:, :] = colors[0]
+        frame[5:10, 3 + 5 * k:8 + 5 * k] = colors[1 + k % 3]
+        frames.append(frame)
+
+    for palette_colors in [None, colors]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath_gif = os.path.join(tmp_dir, "test.gif")
+            num_frames = encode_frames(iter(frames), filepath_gif, fps=10, palette_colors=palette_colors)
+            with Image.open(filepath_gif) as im:
+                if num_frames != 5 or im.n_frames != 5:
+                    ok = False
+                for k in range(min(5, im.n_frames)):
+                    im.seek(k)
+                    if not np.array_equal(np.asarray(im.convert("RGB")), frames[k]):
+                        ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def test_02(res_lst):
+    # Test 02
+    print("\nRunning test 02....\n")
+    ok = True
+
+    import tempfile
+
+    # The steps of a maze, one or two cells change, some frames are the same.
+    colors = [ (255, 255, 255), (255, 0, 0), (0, 0, 255), (0, 128, 0) ]
+    frame = np.zeros((60, 80, 3), dtype=np.uint8)
+    frame[:, :] = colors[0]
+    frames = [frame.copy()]
+    for k in range(12):
+        if k % 4 != 3:
+            frame[10 + 3 * k:13 + 3 * k, 5 + 5 * k:9 + 5 * k] = colors[1 + k % 3]
+            frame[50, 70 - k] = colors[1]
+        frames.append(frame.copy())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath_gif   = os.path.join(tmp_dir, "full.gif")
+        filepath_delta = os.path.join(tmp_dir, "delta.gif")
+        encode_frames(iter(frames), filepath_gif, fps=10, palette_colors=colors)
+        num_frames = encode_frames(iter(frames), filepath_delta, fps=10, palette_colors=colors, delta=True)
+        if num_frames != len(frames) or os.path.getsize(filepath_delta) >= os.path.getsize(filepath_gif):
+            ok = False
+        # The frames without changes are in the delay of the previous one.
+        with Image.open(filepath_delta) as im:
+            if im.n_frames != 10:
+                ok = False
+            k = 0
+            for num in range(im.n_frames):
+                im.seek(num)
+                if not np.array_equal(np.asarray(im.convert("RGB")), frames[k]):
+                    ok = False
+                k += im.info["duration"] // 100
+
+        # A palette from the frames, the colors that are in them.
+        if sorted(palette_from_frames([frames[0], frames[-1]])) != sorted(colors):
+            ok = False
+        try:
+            encode_frames(iter(frames), filepath_delta, delta=True)
+            ok = False
+        except ValueError:
+            pass
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 02 PASSED.")
+    else:
+        print("...Test 02 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+    test_02(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the streaming encoder....\n\n")
+    runTests()
+    print("\n...Finished running tests to the streaming encoder....")
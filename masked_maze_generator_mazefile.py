@@ -0,0 +1,370 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_mazefile.py                          #
+# Description: Binary file of a generated maze, ".maze", to keep a    #
+#              maze for later (printing, solving, other styles)       #
+#              without the SVG frames. Versioned, a small header and  #
+#              the packed arrays:                                     #
+#                                                                     #
+#                8 bytes  magic "MASKMAZE"                            #
+#                4 bytes  version (little endian)                     #
+#                4 bytes  length of the JSON header                   #
+#                JSON     cols, rows, cell_len, x_max, y_max, the     #
+#                         start cell, seed, algorithm and name        #
+#                walls    4 bits for each cell, 2 cells in a byte     #
+#                mask     1 bit for each cell (np.packbits)           #
+#                visited  1 bit for each cell                         #
+#                                                                     #
+#              The arrays start at multiples of 64 bytes. load_maze() #
+#              maps the file (np.memmap), the arrays are views of it  #
+#              without copy and the rows are unpacked when they are   #
+#              read, so the exporters draw only the final maze, strip #
+#              by strip, to SVG, PDF or PNG of any resolution.        #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+#   -reportlab  [Only for the PDF.]
+
+import os
+import json
+import struct
+
+import numpy as np
+
+
+MAZE_MAGIC    = b"MASKMAZE"
+MAZE_VERSION  = 1
+MAZE_PREAMBLE = struct.Struct("<8sII")
+SECTION_ALIGN = 64
+
+
+def align(offset):
+    return (offset + SECTION_ALIGN - 1) // SECTION_ALIGN * SECTION_ALIGN
+
+
+# The 4 wall bits of 2 cells in each byte, the first cell in the low bits.
+def pack_walls(walls):
+    walls = np.frombuffer(walls, dtype=np.uint8) if not isinstance(walls, np.ndarray) else walls.reshape(-1)
+    if len(walls) % 2 == 1:
+        walls = np.append(walls, np.uint8(0))
+    return walls[0::2] | (walls[1::2] << 4)
+
+
+def unpack_walls(packed, num_cells, first=0):
+    walls = np.empty(len(packed) * 2, dtype=np.uint8)
+    walls[0::2] = packed & 0x0F
+    walls[1::2] = packed >> 4
+    return walls[first:first + num_cells]
+
+
+# Offsets of the arrays after a header of header_len bytes.
+def section_offsets(header_len, num_cells):
+    offset_walls   = align(MAZE_PREAMBLE.size + header_len)
+    offset_mask    = align(offset_walls + (num_cells + 1) // 2)
+    offset_visited = align(offset_mask + (num_cells + 7) // 8)
+    offset_end     = offset_visited + (num_cells + 7) // 8
+    return (offset_walls, offset_mask, offset_visited, offset_end)
+
+
+# Read only 2D view (rows, cols) of a packed array, 4 bits (walls) or 1 bit
+# (mask, visited) for each cell. A slice of rows is unpacked to a new
+# uint8 array, np.asarray() unpacks all of it.
+class PackedRows:
+
+    def __init__(self, packed, rows, cols, bits):
+        self.packed = packed
+        self.rows   = rows
+        self.cols   = cols
+        self.bits   = bits
+        self.shape  = (rows, cols)
+
+
+    def __len__(self):
+        return self.rows
+
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise ValueError("ERROR in PackedRows, only slices of rows and not %s!" % (key,))
+        r0, r1, _ = key.indices(self.rows)
+        r1 = max(r0, r1)
+        first, num_cells = r0 * self.cols, (r1 - r0) * self.cols
+        if self.bits == 4:
+            flat = unpack_walls(self.packed[first // 2:(first + num_cells + 1) // 2], num_cells, first % 2)
+        else:
+            flat = np.unpackbits(self.packed[first // 8:(first + num_cells + 7) // 8])[first % 8:first % 8 + num_cells]
+        return flat.reshape(r1 - r0, self.cols)
+
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self[:]
+        return rows.astype(dtype) if dtype != None else rows
+
+
+# A loaded maze, the same attributes of a TiledMazeStore (cols, rows,
+# cell_len, meta, walls, mask) so it's exporters work with it too.
+class MazeFile:
+
+    def __init__(self, meta, data):
+        self.meta     = meta
+        self.cols     = meta["cols"]
+        self.rows     = meta["rows"]
+        self.cell_len = meta["cell_len"]
+        num_cells     = self.cols * self.rows
+        offset_walls, offset_mask, offset_visited, offset_end = section_offsets(meta["header_len"], num_cells)
+        if len(data) < offset_end:
+            raise ValueError("ERROR in MazeFile, the file has %d bytes and not %d, it's truncated!" % (len(data), offset_end))
+        self.walls_packed   = data[offset_walls:offset_walls + (num_cells + 1) // 2]
+        self.mask_packed    = data[offset_mask:offset_mask + (num_cells + 7) // 8]
+        self.visited_packed = data[offset_visited:offset_end]
+        self.walls   = PackedRows(self.walls_packed, self.rows, self.cols, 4)
+        self.mask    = PackedRows(self.mask_packed, self.rows, self.cols, 1)
+        self.visited = PackedRows(self.visited_packed, self.rows, self.cols, 1)
+
+
+    # A MazeGenerator with the final maze in it's grid, for the solver,
+    # the raster renderer or to draw it again.
+    def to_generator(self):
+        from masked_maze_generator_core import MazeGenerator
+        meta = self.meta
+        gen_maze = MazeGenerator(i_init=meta["i_init"], j_init=meta["j_init"], x_max=meta["x_max"],
+                                 y_max=meta["y_max"], cell_len=self.cell_len, maze_name=meta["maze_name"],
+                                 mask=np.asarray(self.mask).astype(bool))
+        gen_maze.grid.walls[:]   = np.asarray(self.walls).tobytes()
+        gen_maze.grid.visited[:] = np.asarray(self.visited).tobytes()
+        gen_maze.seed            = meta["seed"]
+        return gen_maze
+
+
+# Writes the final maze of gen_maze. Written to a temporary file and
+# renamed, it's never half written.
+def save_maze(filepath, gen_maze):
+    algorithm = gen_maze.algorithm
+    meta = {
+        "cols"             : gen_maze.cols,
+        "rows"             : gen_maze.rows,
+        "cell_len"         : gen_maze.w,
+        "x_max"            : gen_maze.x_max,
+        "y_max"            : gen_maze.y_max,
+        "i_init"           : gen_maze.i_init,
+        "j_init"           : gen_maze.j_init,
+        "start_index"      : gen_maze.start_index,
+        "seed"             : gen_maze.seed,
+        "algorithm"        : type(algorithm).__name__ if algorithm != None else "RecursiveBacktracker",
+        "algorithm_params" : list(algorithm.params()) if algorithm != None else [],
+        "maze_name"        : gen_maze.maze_name,
+    }
+    grid = gen_maze.grid
+    write_maze_arrays(filepath, meta, pack_walls(grid.walls),
+                      np.packbits(np.frombuffer(grid.inside_mask, dtype=np.uint8)),
+                      np.packbits(np.frombuffer(grid.visited, dtype=np.uint8)))
+
+
+def write_maze_arrays(filepath, meta, walls_packed, mask_packed, visited_packed):
+    header = json.dumps(meta, default=str, sort_keys=True).encode("utf-8")
+    num_cells = meta["cols"] * meta["rows"]
+    offset_walls, offset_mask, offset_visited, offset_end = section_offsets(len(header), num_cells)
+    filepath_tmp = filepath + ".tmp"
+    with open(filepath_tmp, "wb") as f:
+        f.write(MAZE_PREAMBLE.pack(MAZE_MAGIC, MAZE_VERSION, len(header)))
+        f.write(header)
+        for offset, packed in [(offset_walls, walls_packed), (offset_mask, mask_packed), (offset_visited, visited_packed)]:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(np.ascontiguousarray(packed, dtype=np.uint8).tobytes())
+    os.replace(filepath_tmp, filepath)
+
+
+# Opens a ".maze" file, with mmap the arrays are views of the mapped file.
+def load_maze(filepath, mmap=True):
+    with open(filepath, "rb") as f:
+        preamble = f.read(MAZE_PREAMBLE.size)
+        if len(preamble) < MAZE_PREAMBLE.size:
+            raise ValueError("ERROR in load_maze, %s isn't a maze file!" % filepath)
+        magic, version, header_len = MAZE_PREAMBLE.unpack(preamble)
+        if magic != MAZE_MAGIC:
+            raise ValueError("ERROR in load_maze, %s isn't a maze file!" % filepath)
+        if version != MAZE_VERSION:
+            raise ValueError("ERROR in load_maze, %s has version %d and not %d!" % (filepath, version, MAZE_VERSION))
+        meta = json.loads(f.read(header_len).decode("utf-8"))
+    meta["header_len"] = header_len
+    data = np.memmap(filepath, dtype=np.uint8, mode="r") if mmap else np.fromfile(filepath, dtype=np.uint8)
+    return MazeFile(meta, data)
+
+
+#############
+# Exporters #
+#############
+
+# Only the final maze, strip by strip, see masked_maze_generator_tiled.py .
+def export_svg(maze, filepath, strip_rows=256):
+    from masked_maze_generator_tiled import write_tiled_svg
+    write_tiled_svg(maze, filepath, strip_rows)
+
+
+# cell_px pixels for each cell, any resolution, the memory of a strip.
+def export_png(maze, filepath, cell_px=4, line_width=None, strip_rows=64, colors=None):
+    from masked_maze_generator_tiled import write_tiled_png
+    write_tiled_png(maze, filepath, cell_px, line_width, strip_rows, colors)
+
+
+# One page of page_size points (the 30cm x 30cm of the SVG by default),
+# vector, the same colors and line width of CSS_STYLES.
+def export_pdf(maze, filepath, page_size=None, strip_rows=256):
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+    from reportlab.lib.units import cm, mm
+    from masked_maze_generator_svg import find_runs
+    from masked_maze_generator_tiled import strip_wall_edges
+
+    if page_size == None:
+        page_size = (30 * cm, 30 * cm)
+    x_max, y_max = maze.meta["x_max"], maze.meta["y_max"]
+    w = maze.cell_len
+    # The viewBox of the SVG, fitted and centered on the page.
+    scale = min(page_size[0] / x_max, page_size[1] / y_max)
+    c = canvas.Canvas(filepath, pagesize=page_size)
+    c.translate((page_size[0] - x_max * scale) / 2, (page_size[1] + y_max * scale) / 2)
+    c.scale(scale, -scale)
+    c.setFillColor(colors.white)
+    c.rect(0, 0, x_max, y_max, stroke=0, fill=1)
+
+    c.setFillColor(colors.blue)
+    for r0 in range(0, maze.rows, strip_rows):
+        r1 = min(maze.rows, r0 + strip_rows)
+        j, start, length = find_runs(np.asarray(maze.mask[r0:r1]).astype(bool))
+        for y, x, l in zip(((j + r0) * w).tolist(), (start * w).tolist(), (length * w).tolist()):
+            c.rect(x, y, l, w, stroke=0, fill=1)
+
+    # 0.8mm of the CSS in user units of the SVG, 96 units for each inch.
+    c.setStrokeColor(colors.red)
+    c.setLineWidth(0.8 * 96 / 25.4)
+    c.setLineCap(1)
+    for r0 in range(0, maze.rows, strip_rows):
+        r1 = min(maze.rows, r0 + strip_rows)
+        horizontal, vertical = strip_wall_edges(maze, r0, r1)
+        line_lst = []
+        r, start, length = find_runs(horizontal)
+        for y, x, l in zip(((r + r0) * w).tolist(), (start * w).tolist(), (length * w).tolist()):
+            line_lst.append((x, y, x + l, y))
+        col, start, length = find_runs(vertical.T)
+        for x, y, l in zip((col * w).tolist(), ((start + r0) * w).tolist(), (length * w).tolist()):
+            line_lst.append((x, y, x, y + l))
+        c.lines(line_lst)
+    c.showPage()
+    c.save()
+
+
+# By the extension of filepath, .svg, .pdf or .png.
+def export_maze(maze, filepath, cell_px=4):
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == ".svg":
+        export_svg(maze, filepath)
+    elif ext == ".pdf":
+        export_pdf(maze, filepath)
+    elif ext == ".png":
+        export_png(maze, filepath, cell_px)
+    else:
+        raise ValueError("ERROR in export_maze, unknown output format %s" % ext)
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    from PIL import Image
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+    from masked_maze_generator_algorithms import GrowingTree
+    from masked_maze_generator_raster import RasterFrameRenderer
+
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 7          # cols odd, the rows start in the middle of the bytes.
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, x_max, y_max = process_mask(filepath_mask, cell_len, color_mask_lst, write_mask_test=False)
+    mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max, cell_len=cell_len,
+                       maze_name="maze", mask=mask)
+    mz.set_seed(11)
+    mz.set_algorithm(GrowingTree("mixed", 0.25))
+    mz.generate_headless()
+    grid = mz.grid
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, "peace.maze")
+        save_maze(filepath, mz)
+        if os.path.getsize(filepath) > grid.cols * grid.rows * 3 // 4 + 1024:
+            ok = False
+
+        for mmap in [True, False]:
+            maze = load_maze(filepath, mmap)
+            if maze.meta["seed"] != 11 or maze.meta["algorithm"] != "GrowingTree" or maze.meta["algorithm_params"] != ["mixed", 0.25]:
+                ok = False
+            if not np.array_equal(np.asarray(maze.walls), grid.walls_2d()) or not np.array_equal(np.asarray(maze.mask), grid.mask_2d()):
+                ok = False
+            # Any slice of rows.
+            if not np.array_equal(maze.walls[3:10], grid.walls_2d()[3:10]) or not np.array_equal(maze.visited[5:6], grid.visited_2d()[5:6]):
+                ok = False
+        if not isinstance(load_maze(filepath).walls_packed, np.memmap):
+            ok = False
+        mz_loaded = maze.to_generator()
+        if bytes(mz_loaded.grid.walls) != bytes(grid.walls) or bytes(mz_loaded.grid.visited) != bytes(grid.visited):
+            ok = False
+
+        # The PNG of the final maze is the last frame of the raster renderer,
+        # with a square on each cell of the mask (like the tiled PNG). The
+        # frame has the size of the mask image, the PNG of the grid.
+        filepath_png = os.path.join(tmp_dir, "peace.png")
+        export_png(maze, filepath_png, cell_px=cell_len * 2)
+        renderer = RasterFrameRenderer(mz, scale=2)
+        renderer.walls[:]   = grid.walls
+        renderer.visited[:] = grid.inside_mask
+        renderer.redraw_all()
+        with Image.open(filepath_png) as im:
+            rgb = np.asarray(im.convert("RGB"))
+            if not np.array_equal(rgb, renderer.framebuffer[:rgb.shape[0], :rgb.shape[1]]):
+                ok = False
+
+        for ext in [".svg", ".pdf"]:
+            filepath_out = os.path.join(tmp_dir, "peace" + ext)
+            export_maze(maze, filepath_out)
+            if os.path.getsize(filepath_out) < 1000:
+                ok = False
+
+        # Not a maze file.
+        try:
+            load_maze(filepath_png)
+            ok = False
+        except ValueError:
+            pass
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the maze file....\n\n")
+    runTests()
+    print("\n...Finished running tests to the maze file....")
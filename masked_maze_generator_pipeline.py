@@ -0,0 +1,269 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_pipeline.py                          #
+# Description: The 3 stages, generate -> SVG to PNG -> animated GIF,  #
+#              running at the same time instead of one after the      #
+#              other:                                                 #
+#                                                                     #
+#              - This process generates the maze and writes each SVG  #
+#                frame (on_frame of the MazeGenerator).               #
+#              - A pool of processes converts the SVG's to PNG, each  #
+#                frame is sent to the pool as soon as it's written.   #
+#                For a GIF the workers also quantize and LZW encode   #
+#                the frame, the slowest part (~65 ms for 850x850).    #
+#              - One thread writes the frames, in the order of the    #
+#                frames, to the GIF (or feeds the PNG's to ffmpeg).   #
+#                                                                     #
+#              Between them a queue of at most max_pending frames. If #
+#              the rasterization or the encoding is slower, the       #
+#              generation waits (backpressure), the number of frames  #
+#              in flight and the memory don't grow with the number of #
+#              frames. The total time is near the time of the slowest #
+#              stage and not the sum of the 3.                        #
+#######################################################################
+
+import os
+import queue
+import threading
+import multiprocessing
+
+from masked_maze_generator_encode import encode_gif_frame, iter_png_frames, open_stream_writer
+from masked_maze_generator_svg2png import rasterize_svg_file
+from masked_maze_generator_trace import get_tracer
+
+
+# Runs in the pool. Return's the PNG and, for a GIF, the encoded frame.
+def rasterize_encode_file(args):
+    filepath_svg, filepath_png, encode_gif = args
+    rasterize_svg_file((filepath_svg, filepath_png))
+    if not encode_gif:
+        return (filepath_png, None)
+    for frame in iter_png_frames([filepath_png]):
+        return (filepath_png, encode_gif_frame(frame))
+
+
+class FramePipeline:
+
+    # workers=None uses all the cores but one (the generator), keep_frames
+    # False removes each SVG and PNG after it's in the animation.
+    def __init__(self, gen_maze, workers=None, max_pending=None, fps=10, filepath_anim=None, keep_frames=True):
+        if workers == None:
+            workers = max(1, (os.cpu_count() or 2) - 1)
+        if max_pending == None:
+            max_pending = 4 * workers
+        if filepath_anim == None:
+            filepath_anim = gen_maze.subdir_anim_gif + gen_maze.maze_name + "_anim.gif"
+        self.gen_maze      = gen_maze
+        self.workers       = workers
+        self.max_pending   = max_pending
+        self.fps           = fps
+        self.filepath_anim = filepath_anim
+        self.keep_frames   = keep_frames
+        self.encode_gif    = filepath_anim.lower().endswith(".gif")
+        self.pending       = queue.Queue()           # (SVG, AsyncResult), in the order of the frames.
+        self.slots         = threading.BoundedSemaphore(max_pending)
+        self.pool          = None
+        self.error         = None                    # Exception of the encoder thread.
+        self.aborted       = False                   # The generation failed.
+        self.num_submitted = 0
+        self.num_done      = 0
+        self.num_frames    = 0
+        self.max_in_flight = 0
+
+
+    # Called by the generator after each SVG frame. It waits while there
+    # are max_pending frames in flight (rasterizing or encoding).
+    def submit(self, filepath_svg):
+        while not self.slots.acquire(timeout=0.1):
+            if self.error != None:
+                raise self.error
+        filepath_png = self.gen_maze.subdir_png + os.path.basename(filepath_svg)[:-4] + ".png"
+        result = self.pool.apply_async(rasterize_encode_file, ((filepath_svg, filepath_png, self.encode_gif),))
+        self.pending.put((filepath_svg, result))
+        self.num_submitted += 1
+        self.max_in_flight = max(self.max_in_flight, self.num_submitted - self.num_done)
+
+
+    # The (PNG, encoded frame) in the order of the frames, as soon as each
+    # one is ready.
+    def iter_done(self):
+        while True:
+            item = self.pending.get()
+            if item == None:
+                return
+            filepath_svg, result = item
+            while True:
+                try:
+                    filepath_png, encoded = result.get(timeout=0.1)
+                    break
+                except multiprocessing.TimeoutError:
+                    if self.aborted:
+                        return
+            yield (filepath_png, encoded)
+            if not self.keep_frames:
+                os.remove(filepath_svg)
+                os.remove(filepath_png)
+            self.num_done += 1
+            self.slots.release()
+
+
+    # Runs in the encoder thread.
+    def encode(self, total):
+        tracer = get_tracer()
+        # Written to a temporary file and renamed, an animation is never half written.
+        ext = os.path.splitext(self.filepath_anim)[1]
+        filepath_tmp = self.filepath_anim[:len(self.filepath_anim) - len(ext)] + ".tmp" + ext
+        try:
+            with open_stream_writer(filepath_tmp, fps=self.fps) as writer:
+                time_start = tracer.clock()
+                for filepath_png, encoded in self.iter_done():
+                    if encoded != None:
+                        writer.append_encoded(*encoded)
+                    else:
+                        for frame in iter_png_frames([filepath_png]):
+                            writer.append_frame(frame)
+                    tracer.frame("anim_frame", time_start)
+                    tracer.progress(writer.num_frames, total)
+                    time_start = tracer.clock()
+            self.num_frames = writer.num_frames
+            if self.aborted:
+                os.remove(filepath_tmp)
+            else:
+                os.replace(filepath_tmp, self.filepath_anim)
+        except BaseException as e:
+            self.error = e
+            # Until the end of the generation, submit() raises the error.
+            while self.pending.get() != None:
+                pass
+
+
+    # generate(schedule) with the 3 stages at the same time. Return's the
+    # number of frames of the animation.
+    def run(self, schedule=None):
+        gen_maze = self.gen_maze
+        tracer = get_tracer()
+        total = gen_maze.estimated_num_steps() if schedule == None else None
+        with tracer.stage("pipeline"):
+            print("Start pipeline, generate -> %d SVG to PNG workers -> %s ..." % (self.workers, self.filepath_anim))
+            self.pool = multiprocessing.Pool(self.workers)
+            encoder = threading.Thread(target=self.encode, args=(total,), daemon=True)
+            encoder.start()
+            gen_maze.on_frame = self.submit
+            try:
+                gen_maze.generate(schedule)
+            except BaseException:
+                self.aborted = True
+                raise
+            finally:
+                gen_maze.on_frame = None
+                self.pending.put(None)
+                encoder.join()
+                if self.aborted:
+                    self.pool.terminate()
+                else:
+                    self.pool.close()
+                self.pool.join()
+            if self.error != None:
+                raise self.error
+            tracer.gauge("max_in_flight", self.max_in_flight)
+            print("...ending pipeline, %d frames, at most %d frames in flight" % (self.num_frames, self.max_in_flight))
+        return self.num_frames
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    import numpy as np
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+    from masked_maze_generator_encode import encode_frames
+    from masked_maze_generator_schedule import FrameBudget
+
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 10
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, x_max, y_max = process_mask(filepath_mask, cell_len, color_mask_lst, write_mask_test=False)
+
+    def new_generator(output_dir):
+        mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max, cell_len=cell_len,
+                           maze_name="maze", mask=mask)
+        mz.compact_svg = True
+        mz.set_output_dir(output_dir)
+        mz.set_seed(2)
+        return mz
+
+    def read_file(filepath):
+        with open(filepath, "rb") as f:
+            return f.read()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mz_ref = new_generator(os.path.join(tmp_dir, "ref"))
+        mz_ref.generate(FrameBudget(60))
+
+        # With 1 frame in flight too.
+        for max_pending in [1, 6]:
+            mz = new_generator(os.path.join(tmp_dir, "run_%d" % max_pending))
+            pipeline = FramePipeline(mz, workers=2, max_pending=max_pending)
+            if pipeline.run(FrameBudget(60)) != len(mz_ref.file_svg_lst):
+                ok = False
+            if pipeline.max_in_flight > max_pending:
+                ok = False
+            # The same SVG's, and the GIF of all the PNG's in the order of the frames.
+            if mz.file_svg_lst != mz_ref.file_svg_lst:
+                ok = False
+            if any(read_file(mz.subdir_svg + f) != read_file(mz_ref.subdir_svg + f) for f in mz.file_svg_lst):
+                ok = False
+            filepath_png_lst = [mz.subdir_png + f[:-4] + ".png" for f in mz.file_svg_lst]
+            filepath_gif = os.path.join(tmp_dir, "sequential.gif")
+            encode_frames(iter_png_frames(filepath_png_lst), filepath_gif, fps=10)
+            if read_file(pipeline.filepath_anim) != read_file(filepath_gif):
+                ok = False
+            if os.path.exists(mz.subdir_anim_gif + "maze_anim.tmp.gif"):
+                ok = False
+
+        # Without the frames on disk.
+        mz = new_generator(os.path.join(tmp_dir, "no_frames"))
+        FramePipeline(mz, workers=2, keep_frames=False).run(FrameBudget(20))
+        if len(os.listdir(mz.subdir_svg)) != 0 or len(os.listdir(mz.subdir_png)) != 0:
+            ok = False
+
+        # An error of the encoder stops the generation.
+        mz = new_generator(os.path.join(tmp_dir, "error"))
+        try:
+            FramePipeline(mz, workers=2, filepath_anim=os.path.join(tmp_dir, "maze.bmp")).run(FrameBudget(20))
+            ok = False
+        except ValueError:
+            pass
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the pipeline....\n\n")
+    runTests()
+    print("\n...Finished running tests to the pipeline....")
@@ -0,0 +1,272 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_raster.py                            #
+# Description: Direct raster backend for the masked Maze Generator.   #
+#              It keeps one persistent RGB framebuffer and on each    #
+#              step it repaints only the cells that changed (the      #
+#              carved pair or the backtracked cell and the highlight),#
+#              replaying the MazeEventLog of generate_headless().     #
+#              This removes the SVG write, parse and rasterize round  #
+#              trip of each frame, the cost of a frame is O(1) cells. #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+#   -pillow
+
+import os
+
+import numpy as np
+
+# Pillow lib
+from PIL import Image
+
+from masked_maze_generator_core import EVENT_CARVE, EVENT_BACKTRACK, EVENT_JUMP, MazeGrid
+from masked_maze_generator_core import WALL_TOP, WALL_RIGHT, WALL_BOTTOM, WALL_LEFT
+from masked_maze_generator_encode import encode_frames
+from masked_maze_generator_trace import get_tracer
+
+# Same colors of the CSS_STYLES used in the SVG frames.
+RASTER_COLORS = {
+    "background"      : (255, 255, 255),    # white
+    "line"            : (255,   0,   0),    # red
+    "bluesquare"      : (  0,   0, 255),    # blue
+    "highlightsquare" : (  0, 128,   0),    # green
+}
+
+
+class RasterFrameRenderer:
+
+    # scale is the number of pixels for each unit of the mask image
+    # (the viewbox of the SVG frames), line_width is in pixels.
+    def __init__(self, gen_maze, scale=4, line_width=None, colors=None):
+        self.cols       = gen_maze.cols
+        self.rows       = gen_maze.rows
+        self.scale      = scale
+        self.cell_px    = gen_maze.w * scale
+        self.line_width = line_width if line_width != None else max(1, scale)
+        self.width      = gen_maze.x_max * scale
+        self.height     = gen_maze.y_max * scale
+
+        self.colors = dict(RASTER_COLORS)
+        if colors != None:
+            self.colors.update(colors)
+        self.colors = {key: np.array(val, dtype=np.uint8) for key, val in self.colors.items()}
+
+        self.inside_mask = bytearray(gen_maze.grid.inside_mask)
+
+        self.framebuffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.reset()
+
+
+    # Back to the initial state, all walls up and no cell visited.
+    # The renderer replays the events on it's own copy of the grid.
+    def reset(self):
+        self.grid      = MazeGrid(self.cols, self.rows, self.inside_mask)
+        self.walls     = self.grid.walls
+        self.visited   = self.grid.visited
+        self.highlight = -1
+        self.redraw_all()
+
+
+    # Full repaint, O(cells), only used at the start.
+    def redraw_all(self):
+        self.framebuffer[:, :] = self.colors["background"]
+        for index in range(self.cols * self.rows):
+            if self.inside_mask[index]:
+                self.fill_cell(index)
+        for index in range(self.cols * self.rows):
+            if self.inside_mask[index]:
+                self.draw_walls(index)
+        if self.highlight >= 0:
+            self.fill_rect(self.highlight, self.colors["highlightsquare"])
+
+
+    def cell_rect(self, index):
+        x = (index % self.cols) * self.cell_px
+        y = (index // self.cols) * self.cell_px
+        return (x, y)
+
+
+    def fill_rect(self, index, color):
+        x, y = self.cell_rect(index)
+        self.framebuffer[y:y + self.cell_px, x:x + self.cell_px] = color
+
+
+    def fill_cell(self, index):
+        if self.visited[index]:
+            self.fill_rect(index, self.colors["bluesquare"])
+        else:
+            self.fill_rect(index, self.colors["background"])
+
+
+    # The walls are centered on the edges of the cell with butt caps like
+    # the SVG lines, so only the walls of the cell itself cross it's square.
+    def draw_walls(self, index):
+        walls = self.walls[index]
+        if walls == 0:
+            return
+        x, y  = self.cell_rect(index)
+        w     = self.cell_px
+        half  = self.line_width // 2
+        lw    = self.line_width
+        fb    = self.framebuffer
+        color = self.colors["line"]
+        if walls & WALL_TOP:
+            fb[max(0, y - half):y - half + lw, x:x + w] = color
+        if walls & WALL_RIGHT:
+            fb[y:y + w, max(0, x + w - half):x + w - half + lw] = color
+        if walls & WALL_BOTTOM:
+            fb[max(0, y + w - half):y + w - half + lw, x:x + w] = color
+        if walls & WALL_LEFT:
+            fb[y:y + w, max(0, x - half):x - half + lw] = color
+
+
+    def paint_cell(self, index):
+        self.fill_cell(index)
+        self.draw_walls(index)
+        if index == self.highlight:
+            self.fill_rect(index, self.colors["highlightsquare"])
+
+
+    def set_highlight(self, index):
+        old_highlight = self.highlight
+        self.highlight = index
+        if old_highlight >= 0 and old_highlight != index:
+            self.paint_cell(old_highlight)
+        self.fill_rect(index, self.colors["highlightsquare"])
+
+
+    # Applies one event of the log repainting only the changed cells.
+    def apply_event(self, kind, index_from, index_to):
+        if kind == EVENT_CARVE:
+            self.visited[index_to] = 1
+            self.grid.remove_walls(index_from, index_to)
+            self.set_highlight(index_to)
+        elif kind == EVENT_BACKTRACK:
+            self.set_highlight(index_to)
+        elif kind == EVENT_JUMP:
+            self.visited[index_to] = 1
+            self.set_highlight(index_to)
+
+
+    # Yield's one frame for each event of the log, the same frames that
+    # draw_step() would render, or only the steps chosen by the schedule
+    # (see masked_maze_generator_schedule.py). The framebuffer itself is
+    # yielded, copy it with snapshot() if it has to be kept after the next
+    # iteration.
+    def iter_frames(self, event_log, schedule=None):
+        self.reset()
+        selected = None
+        if schedule != None:
+            selected = schedule.frame_mask(event_log)
+        start = event_log.start_index
+        self.visited[start] = 1
+        self.paint_cell(start)
+        self.set_highlight(start)
+        for k, (kind, index_from, index_to) in enumerate(event_log):
+            if selected == None or selected[k]:
+                yield self.framebuffer
+            self.apply_event(kind, index_from, index_to)
+
+
+    def snapshot(self):
+        return self.framebuffer.copy()
+
+
+    def to_image(self):
+        return Image.fromarray(self.framebuffer, "RGB")
+
+
+# Renders the event log directly to n PNG's, with the same file names of
+# the PNG's made from the SVG's. Return's the list of PNG file names.
+def process_event_log_to_png(gen_maze, event_log, scale=4, subdir_png=None, schedule=None):
+    if subdir_png == None:
+        subdir_png = gen_maze.subdir_png
+    tracer = get_tracer()
+    with tracer.stage("raster_png"):
+        print("Start rendering PNG's from the event log ...")
+        renderer = RasterFrameRenderer(gen_maze, scale=scale)
+        file_png_lst = []
+        time_start = tracer.clock()
+        for counter, _ in enumerate(renderer.iter_frames(event_log, schedule)):
+            file_png = gen_maze.maze_name + "_%06d.png" % (counter)
+            file_png_lst.append(file_png)
+            renderer.to_image().save(os.path.join(subdir_png, file_png), "PNG")
+            tracer.frame("png_frame", time_start, os.path.join(subdir_png, file_png))
+            tracer.progress(counter + 1)
+            time_start = tracer.clock()
+        print("...ending rendering PNG's from the event log")
+    return file_png_lst
+
+
+# Streams the frames of the event log straight to an animated GIF, MP4 or
+# WebM (from the extension of filepath), without any intermediate file.
+# delta writes only the cells that changed in each GIF frame.
+def process_event_log_to_anim(gen_maze, event_log, filepath=None, scale=4, fps=10, schedule=None, delta=False):
+    if filepath == None:
+        filepath = gen_maze.subdir_anim_gif + gen_maze.maze_name + "_anim.gif"
+    with get_tracer().stage("raster_anim"):
+        print("Start streaming the frames of the event log to %s ..." % filepath)
+        renderer = RasterFrameRenderer(gen_maze, scale=scale)
+        palette_colors = [tuple(color) for color in RASTER_COLORS.values()]
+        total = len(schedule.frame_indices(event_log)) if schedule != None else len(event_log)
+        num_frames = encode_frames(renderer.iter_frames(event_log, schedule), filepath, fps=fps,
+                                   palette_colors=palette_colors, total=total, delta=delta)
+        print("...ending streaming %d frames" % num_frames)
+    return num_frames
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+
+    # The incremental frames must be equal to a full repaint of the same state.
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst )
+    mz = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
+                        cell_len=cell_len, mask=mask)
+    mz.set_seed(1)
+    event_log = mz.generate_headless()
+
+    renderer = RasterFrameRenderer(mz, scale=3)
+    for counter, frame in enumerate(renderer.iter_frames(event_log)):
+        if counter % 97 == 0 or counter == len(event_log) - 1:
+            incremental = frame.copy()
+            renderer.redraw_all()
+            if not np.array_equal(incremental, renderer.framebuffer):
+                ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to RasterFrameRenderer....\n\n")
+    runTests()
+    print("\n...Finished running tests to RasterFrameRenderer....")
@@ -0,0 +1,208 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_schedule.py                          #
+# Description: Frame scheduling for the animations of the masked Maze #
+#              Generator. A mask with N cells has about 2N steps and  #
+#              most of them are backtracking that almost doesn't      #
+#              change the image. A schedule chooses, from the         #
+#              MazeEventLog, the steps that are rendered as frames:   #
+#              every k-th step, a total frame budget, compressed      #
+#              backtrack runs or pacing on the timeline of the        #
+#              animation. Schedules can be chained.                   #
+#                                                                     #
+#              Frame k is the maze before event k is applied, so it   #
+#              is a pure backtrack frame when event k-1 is a          #
+#              backtrack. The first and the last frame are always     #
+#              kept.                                                  #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+
+import numpy as np
+
+from masked_maze_generator_core import EVENT_BACKTRACK
+
+
+class FrameSchedule:
+
+    # Return's the subset of the candidate frame indexes (sorted NumPy
+    # array) that are rendered, kinds is the array of the event kinds.
+    def select(self, kinds, indices):
+        raise NotImplementedError("ERROR in FrameSchedule, select() has to be implemented!")
+
+
+    def frame_indices(self, event_log):
+        kinds = event_log.kind_array()
+        return self.select(kinds, np.arange(len(kinds)))
+
+
+    # One byte for each step, 1 if the step is rendered.
+    def frame_mask(self, event_log):
+        mask = np.zeros(len(event_log), dtype=np.uint8)
+        mask[self.frame_indices(event_log)] = 1
+        return bytearray(mask.tobytes())
+
+
+def keep_ends(selected, indices):
+    if len(indices) == 0:
+        return selected
+    return np.union1d(selected, [indices[0], indices[-1]])
+
+
+# Every k-th step.
+class EveryKthStep(FrameSchedule):
+
+    def __init__(self, k):
+        if k < 1:
+            raise ValueError("ERROR in EveryKthStep, k has to be >= 1!")
+        self.k = k
+
+
+    def select(self, kinds, indices):
+        return keep_ends(indices[::self.k], indices)
+
+
+# At most max_frames frames, evenly spread over the steps.
+class FrameBudget(FrameSchedule):
+
+    def __init__(self, max_frames):
+        if max_frames < 2:
+            raise ValueError("ERROR in FrameBudget, max_frames has to be >= 2!")
+        self.max_frames = max_frames
+
+
+    def select(self, kinds, indices):
+        if len(indices) <= self.max_frames:
+            return indices
+        positions = np.unique(np.round(np.linspace(0, len(indices) - 1, self.max_frames)).astype(np.int64))
+        return indices[positions]
+
+
+# Each run of consecutive backtrack frames is reduced to keep frames, the
+# last one of the run (where the carving starts again) is always kept.
+# keep=0 skips the runs completely.
+class CompressBacktrack(FrameSchedule):
+
+    def __init__(self, keep=1):
+        self.keep = keep
+
+
+    def select(self, kinds, indices):
+        is_backtrack_frame = np.zeros(len(kinds), dtype=bool)
+        is_backtrack_frame[1:] = kinds[:-1] == EVENT_BACKTRACK
+        flag = is_backtrack_frame[indices]
+        if not flag.any():
+            return indices
+
+        # Run id and position inside the run of each backtrack frame.
+        starts  = flag & ~np.concatenate(([False], flag[:-1]))
+        run_id  = np.cumsum(starts) - 1
+        run_pos = np.arange(len(flag)) - np.flatnonzero(starts)[run_id]
+        run_len = np.bincount(run_id[flag])[run_id]
+        from_end = run_len - 1 - run_pos
+
+        keep_flag = ~flag
+        if self.keep > 0:
+            stride = np.maximum(1, run_len // self.keep)
+            keep_flag |= flag & (from_end % stride == 0) & (from_end // stride < self.keep)
+        return keep_ends(indices[keep_flag], indices)
+
+
+# Pacing on the timeline of the animation, duration_s seconds at fps. A
+# carve step takes 1 unit of time and a backtrack step backtrack_weight
+# units (0 makes the backtracking instantaneous), one frame is rendered
+# at each tick of the timeline.
+class TimePaced(FrameSchedule):
+
+    def __init__(self, fps, duration_s, backtrack_weight=0.25):
+        self.fps              = fps
+        self.duration_s       = duration_s
+        self.backtrack_weight = backtrack_weight
+
+
+    def select(self, kinds, indices):
+        weights = np.where(kinds == EVENT_BACKTRACK, self.backtrack_weight, 1.0)
+        times = np.concatenate(([0.0], np.cumsum(weights)[:-1]))[indices]
+        num_ticks = max(2, int(round(self.fps * self.duration_s)) + 1)
+        ticks = np.linspace(0.0, times[-1], num_ticks)
+        positions = np.unique(np.minimum(np.searchsorted(times, ticks, side="left"), len(indices) - 1))
+        return keep_ends(indices[positions], indices)
+
+
+# Applies the schedules one after the other, ex: compress the backtrack
+# runs and then fit the result in a budget of frames.
+class ChainSchedule(FrameSchedule):
+
+    def __init__(self, *schedules):
+        self.schedules = schedules
+
+
+    def select(self, kinds, indices):
+        for schedule in self.schedules:
+            indices = schedule.select(kinds, indices)
+        return indices
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst )
+    mz = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
+                        cell_len=cell_len, mask=mask)
+    mz.set_seed(1)
+    event_log = mz.generate_headless()
+    num_events = len(event_log)
+    kinds = event_log.kind_array()
+
+    schedules = [ EveryKthStep(10), FrameBudget(50), CompressBacktrack(1), TimePaced(10, 5.0),
+                  ChainSchedule(CompressBacktrack(2), FrameBudget(40)) ]
+    for schedule in schedules:
+        indices = schedule.frame_indices(event_log)
+        if indices[0] != 0 or indices[-1] != num_events - 1 or np.any(np.diff(indices) <= 0):
+            ok = False
+
+    if len(FrameBudget(50).frame_indices(event_log)) != 50:
+        ok = False
+
+    # No frame in the middle of a backtrack run.
+    indices = CompressBacktrack(1).frame_indices(event_log)
+    inner = indices[(indices > 0) & (indices < num_events - 1)]
+    if np.any((kinds[inner - 1] == EVENT_BACKTRACK) & (kinds[inner] == EVENT_BACKTRACK)):
+        ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the frame schedules....\n\n")
+    runTests()
+    print("\n...Finished running tests to the frame schedules....")
@@ -0,0 +1,625 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_service.py                           #
+# Description: Local maze rendering service, HTTP over localhost or   #
+#              over a Unix socket, for a web front end that would     #
+#              start one Python process for each maze:                #
+#                                                                     #
+#              - The processed masks stay in memory, a request with   #
+#                the same PNG and parameters doesn't decode the PNG   #
+#                nor run process_mask() again.                        #
+#              - The mazes are drawn in a pool of processes that      #
+#                import svgwrite, svglib, reportlab and the encoders  #
+#                only once, when they start.                          #
+#              - Identical requests that arrive while the first one   #
+#                is running (the same mask, cell_len, colors, seed    #
+#                and output) wait for it's result, it's computed only #
+#                once. Without a seed each maze is a new one.         #
+#                                                                     #
+#              POST /maze?cell_len=10&color=0,0,0&seed=1&format=svg   #
+#              with the PNG of the mask in the body, the answer is    #
+#              the SVG, PNG, GIF (animation), .maze or JSON (stats).  #
+#              GET /stats and GET /health. MazeServiceClient is the   #
+#              client, for the tests and the front end.               #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+#   -pillow
+
+import io
+import os
+import argparse
+import json
+import socket
+import stat
+import tempfile
+import threading
+import collections
+import http.client
+import concurrent.futures
+import multiprocessing
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+import numpy as np
+
+from masked_maze_generator_cache import hash_key
+from masked_maze_generator_cli import ALGORITHM_NAMES, parse_color
+from masked_maze_generator_algorithms import POLICY_NEWEST, POLICY_OLDEST, POLICY_RANDOM, POLICY_MIXED
+
+
+DEFAULT_PORT = 8765
+
+# Output formats and their content types.
+FORMATS = {
+    "svg"  : "image/svg+xml",             # Final maze, compact SVG.
+    "png"  : "image/png",                 # Final maze, scale pixels for each cell.
+    "gif"  : "image/gif",                 # Animation of the generation, delta frames.
+    "maze" : "application/octet-stream",  # Binary .maze file.
+    "json" : "application/json",          # maze_stats() and the longest path.
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+# The parameters of a request from it's query string, with the defaults
+# of the command line. Raises ValueError, a 400 answer.
+def parse_request(query):
+    values = parse_qs(query)
+
+    def get(name, default, parse=int):
+        if name not in values:
+            return default
+        try:
+            return parse(values[name][-1])
+        except ValueError:
+            raise ValueError("ERROR in the request, %s=%s isn't valid" % (name, values[name][-1]))
+
+    try:
+        colors = [parse_color(text) for text in values.get("color", ["0,0,0"])]
+    except argparse.ArgumentTypeError as e:
+        raise ValueError("ERROR in the request, %s" % e)
+
+    params = {
+        "cell_len"  : get("cell_len", 6),
+        "colors"    : colors,
+        "tolerance" : get("tolerance", 0),
+        "coverage"  : get("coverage", None, float),
+        "seed"      : get("seed", None),
+        "algorithm" : get("algorithm", "backtracker", str),
+        "policy"    : get("policy", "newest", str),
+        "format"    : get("format", "svg", str),
+        "scale"     : get("scale", 4),
+        "frames"    : get("frames", 200),
+        "fps"       : get("fps", 10),
+    }
+    if params["cell_len"] < 1 or not 1 <= params["scale"] <= 64 or params["frames"] < 1 or params["fps"] < 1:
+        raise ValueError("ERROR in the request, cell_len, scale, frames and fps must be positive (scale <= 64)")
+    if params["algorithm"] not in ALGORITHM_NAMES:
+        raise ValueError("ERROR in the request, the algorithm %s isn't one of %s" % (params["algorithm"], ALGORITHM_NAMES))
+    policy_names = [POLICY_NEWEST, POLICY_OLDEST, POLICY_RANDOM, POLICY_MIXED]
+    if params["policy"] not in policy_names:
+        raise ValueError("ERROR in the request, the policy %s isn't one of %s" % (params["policy"], policy_names))
+    if params["format"] not in FORMATS:
+        raise ValueError("ERROR in the request, the format %s isn't one of %s" % (params["format"], list(FORMATS)))
+    return params
+
+
+# Imports the rendering backends when a worker starts, and not in the
+# first request that it runs.
+def warm_worker():
+    import masked_maze_generator_core as core
+    core.import_svgwrite()
+    import masked_maze_generator_svg
+    import masked_maze_generator_raster
+    import masked_maze_generator_encode
+    import masked_maze_generator_mazefile
+    import masked_maze_generator_tiled
+    import masked_maze_generator_solver
+
+
+# Runs in the pool. job is (mask result of mask_from_array(), params),
+# return's the bytes of the output.
+def render_job(job):
+    from masked_maze_generator_core import MazeGenerator
+
+    (i_init, j_init, mask, x_max, y_max), params = job
+    mz = MazeGenerator(i_init=i_init, j_init=j_init, x_max=x_max, y_max=y_max, cell_len=params["cell_len"],
+                       maze_name="maze", mask=mask)
+    if params["seed"] != None:
+        mz.set_seed(params["seed"])
+    if params["algorithm"] != "backtracker":
+        from masked_maze_generator_algorithms import ALGORITHMS
+        algorithm_class = ALGORITHMS[params["algorithm"]]
+        mz.set_algorithm(algorithm_class(params["policy"]) if params["algorithm"] == "growing_tree" else algorithm_class())
+    event_log = mz.generate_headless()
+
+    fmt = params["format"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, "maze." + fmt)
+        if fmt == "svg":
+            from masked_maze_generator_svg import write_compact_svg_frame
+            write_compact_svg_frame(filepath, mz.grid, mz.w, mz.x_max, mz.y_max)
+        elif fmt == "maze" or fmt == "png":
+            from masked_maze_generator_mazefile import save_maze, load_maze, export_png
+            filepath_maze = os.path.join(tmp_dir, "maze.maze")
+            save_maze(filepath_maze, mz)
+            if fmt == "png":
+                export_png(load_maze(filepath_maze), filepath, cell_px=params["scale"])
+            else:
+                filepath = filepath_maze
+        elif fmt == "gif":
+            from masked_maze_generator_raster import process_event_log_to_anim
+            from masked_maze_generator_schedule import FrameBudget
+            process_event_log_to_anim(mz, event_log, filepath, scale=params["scale"], fps=params["fps"],
+                                      schedule=FrameBudget(params["frames"]), delta=True)
+        elif fmt == "json":
+            from masked_maze_generator_solver import maze_stats, longest_path, passage_bits
+            passages = passage_bits(mz.grid)
+            stats = maze_stats(mz.grid, passages)
+            stats["solution_length"] = max(0, len(longest_path(mz.grid, mz.start_index, passages)) - 1)
+            stats["seed"] = mz.seed
+            with open(filepath, "w") as f:
+                json.dump(stats, f)
+        with open(filepath, "rb") as f:
+            return f.read()
+
+
+# mask_from_array() of the PNG of a request.
+def process_mask_png(mask_png, params):
+    from PIL import Image
+    from masked_maze_generator_core import mask_from_array
+    try:
+        with Image.open(io.BytesIO(mask_png)) as im:
+            img_array = np.asarray(im.convert("RGB"))
+    except Exception:
+        raise ValueError("ERROR in the request, the body isn't the PNG of a mask")
+    result = mask_from_array(img_array, params["cell_len"], params["colors"], params["tolerance"], params["coverage"])
+    if result[0] < 0:
+        raise ValueError("ERROR in the request, the mask doesn't have any cell with the colors %s" % params["colors"])
+    return result
+
+
+class MazeService:
+
+    # workers=None uses all the cores, max_masks processed masks are kept
+    # in memory (the least recently used ones go first).
+    def __init__(self, workers=None, max_masks=64):
+        self.workers   = workers or os.cpu_count() or 1
+        self.max_masks = max_masks
+        self.pool      = None
+        self.lock      = threading.Lock()
+        self.masks     = collections.OrderedDict()    # key -> (i_init, j_init, mask, x_max, y_max).
+        self.masks_pending = {}                       # key -> Future of the mask being processed.
+        self.inflight  = {}                           # key -> AsyncResult of the running job.
+        self.stats     = {"requests": 0, "computed": 0, "coalesced": 0, "errors": 0,
+                          "mask_hits": 0, "mask_misses": 0}
+
+
+    def start(self):
+        self.pool = multiprocessing.Pool(self.workers, initializer=warm_worker)
+        return self
+
+
+    def close(self):
+        if self.pool != None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, masks=len(self.masks), inflight=len(self.inflight), workers=self.workers)
+
+
+    # The processed mask of the PNG, from memory if it was already used,
+    # the same mask is processed only once at a time too.
+    # Return's (key, result of mask_from_array()).
+    def get_mask(self, mask_png, params):
+        key = hash_key("mask", mask_png, params["cell_len"], params["colors"], params["tolerance"], params["coverage"])
+        owner = False
+        with self.lock:
+            result = self.masks.get(key)
+            if result != None:
+                self.masks.move_to_end(key)
+                self.stats["mask_hits"] += 1
+                return (key, result)
+            future = self.masks_pending.get(key)
+            if future != None:
+                self.stats["mask_hits"] += 1
+            else:
+                future = concurrent.futures.Future()
+                self.masks_pending[key] = future
+                self.stats["mask_misses"] += 1
+                owner = True
+        if not owner:
+            return (key, future.result())
+
+        try:
+            result = process_mask_png(mask_png, params)
+            with self.lock:
+                self.masks[key] = result
+                while len(self.masks) > self.max_masks:
+                    self.masks.popitem(last=False)
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.masks_pending.pop(key, None)
+        return (key, result)
+
+
+    # The bytes of the output of a request, mask is the result of
+    # get_mask(). An identical request that is running is joined instead
+    # of computed again.
+    def render(self, mask, params):
+        mask_key, mask_result = mask
+        key = None
+        if params["seed"] != None:
+            key = hash_key("render", mask_key, params["seed"], params["algorithm"], params["policy"],
+                           params["format"], params["scale"], params["frames"], params["fps"])
+        owner = False
+        with self.lock:
+            result = self.inflight.get(key) if key != None else None
+            if result == None:
+                result = self.pool.apply_async(render_job, ((mask_result, params),))
+                self.stats["computed"] += 1
+                owner = True
+                if key != None:
+                    self.inflight[key] = result
+            else:
+                self.stats["coalesced"] += 1
+        try:
+            return result.get()
+        finally:
+            if owner and key != None:
+                with self.lock:
+                    self.inflight.pop(key, None)
+
+
+class MazeRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+
+    # The clients of a Unix socket don't have an address.
+    def address_string(self):
+        return str(self.client_address[0]) if isinstance(self.client_address, tuple) else "unix"
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+    def send_data(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        # In chunks, a big animation isn't copied to the socket buffer at once.
+        view = memoryview(data)
+        for start in range(0, len(data), CHUNK_SIZE):
+            self.wfile.write(view[start:start + CHUNK_SIZE])
+
+
+    def send_json(self, status, obj):
+        self.send_data(status, FORMATS["json"], json.dumps(obj).encode("utf-8"))
+
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self.send_json(200, {"ok": True})
+        elif path == "/stats":
+            self.send_json(200, self.server.service.get_stats())
+        else:
+            self.send_json(404, {"error": "ERROR %s not found" % path})
+
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        mask_png = self.rfile.read(length)
+        if url.path != "/maze":
+            self.send_json(404, {"error": "ERROR %s not found" % url.path})
+            return
+        service = self.server.service
+        # Only the errors of the request and of it's mask are a 400, the
+        # ones of the rendering are a 500.
+        try:
+            params = parse_request(url.query)
+            service.count("requests")
+            mask = service.get_mask(mask_png, params)
+        except ValueError as e:
+            service.count("errors")
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_error_500(e)
+            return
+        try:
+            data = service.render(mask, params)
+        except Exception as e:
+            self.send_error_500(e)
+            return
+        self.send_data(200, FORMATS[params["format"]], data)
+
+
+    def send_error_500(self, e):
+        self.server.service.count("errors")
+        self.send_json(500, {"error": "ERROR in the maze service, %s: %s" % (type(e).__name__, e)})
+
+
+class MazeHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        ThreadingHTTPServer.__init__(self, address, MazeRequestHandler)
+
+
+class MazeUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, service, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        # A socket file left by a service that didn't close, any other
+        # file isn't removed.
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise ValueError("ERROR in MazeUnixHTTPServer, %s exists and isn't a socket!" % socket_path)
+            os.remove(socket_path)
+        socketserver.ThreadingUnixStreamServer.__init__(self, socket_path, MazeRequestHandler)
+
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+# The server of the service, on host:port (port 0 is any free port) or on
+# the Unix socket unix_socket. Call serve_forever().
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT, unix_socket=None, verbose=False):
+    if unix_socket != None:
+        return MazeUnixHTTPServer(unix_socket, service, verbose)
+    return MazeHTTPServer((host, port), service, verbose)
+
+
+# Runs the service until Ctrl-C.
+def serve(host="127.0.0.1", port=DEFAULT_PORT, unix_socket=None, workers=None, max_masks=64, verbose=True):
+    service = MazeService(workers, max_masks).start()
+    server = make_server(service, host, port, unix_socket, verbose)
+    print("Start maze service on %s with %d workers ..." % (unix_socket or "http://%s:%d" % server.server_address,
+                                                            service.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        print("...ending maze service")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class MazeServiceClient:
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, unix_socket=None, timeout=600):
+        self.host        = host
+        self.port        = port
+        self.unix_socket = unix_socket
+        self.timeout     = timeout
+
+
+    def connection(self):
+        if self.unix_socket != None:
+            return UnixHTTPConnection(self.unix_socket, self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+
+    # Return's (status, content type, bytes), or writes the bytes to
+    # filepath as they arrive and return's None for them.
+    def request(self, method, path, body=None, filepath=None):
+        conn = self.connection()
+        try:
+            conn.request(method, path, body=body)
+            response = conn.getresponse()
+            if filepath == None or response.status != 200:
+                return (response.status, response.getheader("Content-Type"), response.read())
+            with open(filepath, "wb") as f:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            return (response.status, response.getheader("Content-Type"), None)
+        finally:
+            conn.close()
+
+
+    # The maze of the PNG mask_png (bytes), params are the ones of
+    # parse_request(), colors a list of (r, g, b). Raises ValueError with
+    # the error of the service.
+    def render(self, mask_png, filepath=None, **params):
+        query = []
+        for name, value in params.items():
+            if name == "colors":
+                query += [("color", "%d,%d,%d" % tuple(color)) for color in value]
+            elif value != None:
+                query.append((name, value))
+        status, _, data = self.request("POST", "/maze?" + urlencode(query), mask_png, filepath)
+        if status != 200:
+            raise ValueError("ERROR in MazeServiceClient, %d %s" % (status, json.loads(data)["error"]))
+        return data
+
+
+    def stats(self):
+        return json.loads(self.request("GET", "/stats")[2])
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import time
+
+    with open("./png_masks/png_mask_peace_symbol_small.png", "rb") as f:
+        mask_png = f.read()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        service = MazeService(workers=1).start()
+        server = make_server(service, port=0)
+        unix_server = make_server(service, unix_socket=os.path.join(tmp_dir, "maze.sock"))
+        for srv in [server, unix_server]:
+            threading.Thread(target=srv.serve_forever, daemon=True).start()
+        client = MazeServiceClient(port=server.server_address[1])
+        unix_client = MazeServiceClient(unix_socket=unix_server.server_address)
+        try:
+            # 4 identical requests while the worker is busy, only one maze.
+            service.pool.apply_async(time.sleep, (1.0,))
+            result_lst = [None] * 4
+            def render_gif(k):
+                result_lst[k] = client.render(mask_png, cell_len=10, seed=3, format="gif", frames=20)
+            thread_lst = [threading.Thread(target=render_gif, args=(k,)) for k in range(4)]
+            for thread in thread_lst:
+                thread.start()
+            for thread in thread_lst:
+                thread.join()
+            stats = client.stats()
+            if stats["computed"] != 1 or stats["coalesced"] != 3 or stats["inflight"] != 0:
+                ok = False
+            if not result_lst[0].startswith(b"GIF89a") or any(data != result_lst[0] for data in result_lst):
+                ok = False
+
+            # The same maze over the Unix socket, the mask is already processed.
+            svg = client.render(mask_png, cell_len=10, seed=3, format="svg")
+            svg_unix = unix_client.render(mask_png, cell_len=10, seed=3, format="svg")
+            if b"<svg" not in svg or svg != svg_unix:
+                ok = False
+            stats = unix_client.stats()
+            if stats["masks"] != 1 or stats["mask_misses"] != 1 or stats["mask_hits"] != 5:
+                ok = False
+
+            # The other formats, streamed to a file.
+            filepath_png = os.path.join(tmp_dir, "maze.png")
+            client.render(mask_png, filepath=filepath_png, cell_len=10, seed=3, format="png", scale=2)
+            with open(filepath_png, "rb") as f:
+                if f.read(8) != b"\x89PNG\r\n\x1a\n":
+                    ok = False
+            if not client.render(mask_png, cell_len=10, seed=3, format="maze").startswith(b"MASKMAZE"):
+                ok = False
+            stats_maze = json.loads(client.render(mask_png, cell_len=10, seed=3, format="json", algorithm="prim"))
+            if stats_maze["num_passages"] != stats_maze["num_cells"] - 1:
+                ok = False
+
+            # Without a seed each request is a new maze.
+            computed = client.stats()["computed"]
+            client.render(mask_png, cell_len=10, format="svg")
+            client.render(mask_png, cell_len=10, format="svg")
+            if client.stats()["computed"] != computed + 2:
+                ok = False
+
+            # Errors.
+            for params, body in [({"colors": [(255, 0, 0)]}, mask_png), ({"format": "bmp"}, mask_png),
+                                 ({"cell_len": 10}, b"not a png")]:
+                try:
+                    client.render(body, **params)
+                    ok = False
+                except ValueError:
+                    pass
+            if client.request("POST", "/maze?color=300,0,0", mask_png)[0] != 400:
+                ok = False
+            if client.request("GET", "/missing")[0] != 404 or client.request("GET", "/health")[0] != 200:
+                ok = False
+            if client.request("POST", "/maze?algorithm=growing_tree&policy=fifo", mask_png)[0] != 400:
+                ok = False
+
+            # An error of the rendering, even a ValueError, is a 500. The
+            # jobs in a pool of threads, to fail in this process.
+            from multiprocessing.pool import ThreadPool
+            def render_job_fail(job):
+                raise ValueError("ERROR in render_job")
+            render_job_ok, pool = render_job, service.pool
+            globals()["render_job"], service.pool = render_job_fail, ThreadPool(1)
+            try:
+                if client.request("POST", "/maze?cell_len=10&seed=4", mask_png)[0] != 500:
+                    ok = False
+            finally:
+                service.pool.terminate()
+                globals()["render_job"], service.pool = render_job_ok, pool
+
+            # A file that isn't a socket isn't removed.
+            filepath_other = os.path.join(tmp_dir, "other.sock")
+            with open(filepath_other, "w") as f:
+                f.write("not a socket")
+            try:
+                make_server(service, unix_socket=filepath_other)
+                ok = False
+            except ValueError:
+                pass
+            if not os.path.exists(filepath_other):
+                ok = False
+        finally:
+            for srv in [server, unix_server]:
+                srv.shutdown()
+                srv.server_close()
+            service.close()
+        if os.path.exists(os.path.join(tmp_dir, "maze.sock")):
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the maze service....\n\n")
+    runTests()
+    print("\n...Finished running tests to the maze service....")
@@ -0,0 +1,299 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_solver.py                            #
+# Description: Solver and analytics of a generated maze. It works on  #
+#              the arrays of the MazeGrid, one byte for each cell     #
+#              with the bits of the open passages, so the BFS doesn't #
+#              touch any Cell object:                                 #
+#                - solve(), the path between 2 cells.                 #
+#                - longest_path(), the diameter of the maze with 2    #
+#                  BFS's, good for the entrance and the exit.         #
+#                - maze_stats(), dead ends, junctions, straights,     #
+#                  turns and the distribution of corridor lengths.    #
+#              And the solution over the final maze, in SVG and in    #
+#              the framebuffer of the RasterFrameRenderer.            #
+#                                                                     #
+#              A maze is a tree, a BFS visits each cell once, a few   #
+#              seconds for a maze with millions of cells.             #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+#   -svgwrite
+
+from array import array
+
+import numpy as np
+
+import svgwrite
+
+from masked_maze_generator_core import BOARD_SIZE, CSS_STYLES
+from masked_maze_generator_core import WALL_TOP, WALL_RIGHT, WALL_BOTTOM, WALL_LEFT
+
+
+SOLUTION_COLOR = (255, 165, 0)    # orange
+
+
+# Bits of the open passages of each cell, one byte for each cell.
+def passage_bits(grid):
+    return passage_bits_arrays(grid.walls_2d(), grid.neighbor_bits)
+
+
+def passage_bits_arrays(walls, neighbor_bits):
+    walls         = np.asarray(walls, dtype=np.uint8).reshape(-1)
+    neighbor_bits = np.asarray(neighbor_bits, dtype=np.uint8).reshape(-1)
+    return bytearray((neighbor_bits & ~walls).tobytes())
+
+
+# For each of the 16 values of the bits, the offsets of the open neighbors.
+def offsets_table(cols):
+    table = []
+    for bits in range(16):
+        table.append(tuple(offset for bit, offset in ((WALL_TOP, -cols), (WALL_RIGHT, 1), (WALL_BOTTOM, cols), (WALL_LEFT, -1))
+                           if bits & bit))
+    return table
+
+
+# Breadth first search from source over the open passages. It stops when
+# it reaches target (if target >= 0). Return's (dist, parent, order),
+# dist and parent are -1 for the cells not reached, order is the list of
+# the cells in the order they were reached.
+def bfs(passages, cols, source, target=-1):
+    num_cells = len(passages)
+    table  = offsets_table(cols)
+    dist   = array('l', [-1]) * num_cells
+    parent = array('l', [-1]) * num_cells
+    order  = array('l', [source])
+    dist[source] = 0
+    for index in order:
+        if index == target:
+            break
+        d = dist[index] + 1
+        for offset in table[passages[index]]:
+            n = index + offset
+            if dist[n] < 0:
+                dist[n]   = d
+                parent[n] = index
+                order.append(n)
+    return (dist, parent, order)
+
+
+# Cells from the source of the BFS to target.
+def path_to(parent, target):
+    path = array('l', [target])
+    while parent[path[-1]] >= 0:
+        path.append(parent[path[-1]])
+    path.reverse()
+    return path
+
+
+# Return's the path (array of cell indexes) from index_from to index_to,
+# empty if they aren't connected.
+def solve(grid, index_from, index_to, passages=None):
+    if passages == None:
+        passages = passage_bits(grid)
+    dist, parent, order = bfs(passages, grid.cols, index_from, index_to)
+    if dist[index_to] < 0:
+        return array('l')
+    return path_to(parent, index_to)
+
+
+# The longest path of the tree of start_index (the first cell inside the
+# mask by default), the 2 ends are the cells farthest apart. Double BFS,
+# the farthest cell from any cell is one end of the diameter.
+def longest_path(grid, start_index=None, passages=None):
+    if passages == None:
+        passages = passage_bits(grid)
+    if start_index == None:
+        start_index = grid.inside_mask_index_lst()[0]
+    _, _, order = bfs(passages, grid.cols, start_index)
+    end_a = order[-1]
+    _, parent, order = bfs(passages, grid.cols, end_a)
+    return path_to(parent, order[-1])
+
+
+# Lengths (number of passages) of the corridors, the paths between 2
+# cells that aren't a simple corridor cell (dead ends and junctions).
+def corridor_lengths(passages, cols, degree):
+    table = offsets_table(cols)
+    length_lst = array('l')
+    for index in np.flatnonzero((degree != 2) & (degree > 0)).tolist():
+        for offset in table[passages[index]]:
+            prev, curr, length = index, index + offset, 1
+            while degree[curr] == 2:
+                n0, n1 = table[passages[curr]]
+                prev, curr = curr, (curr + n0 if curr + n0 != prev else curr + n1)
+                length += 1
+            # Each corridor is walked from it's 2 ends, counted once.
+            if index < curr:
+                length_lst.append(length)
+    return length_lst
+
+
+# Statistics of the maze, a dict.
+def maze_stats(grid, passages=None):
+    if passages == None:
+        passages = passage_bits(grid)
+    bits = np.frombuffer(passages, dtype=np.uint8)
+    inside = np.frombuffer(grid.inside_mask, dtype=np.uint8).astype(bool)
+    degree = np.array([bin(k).count("1") for k in range(16)], dtype=np.uint8)[bits]
+    straight = (bits == WALL_TOP | WALL_BOTTOM) | (bits == WALL_LEFT | WALL_RIGHT)
+    lengths = np.frombuffer(corridor_lengths(passages, grid.cols, degree), dtype=np.dtype("i%d" % array('l').itemsize))
+    diameter = longest_path(grid, passages=passages) if inside.any() else array('l')
+    return {
+        "num_cells"         : int(inside.sum()),
+        "num_passages"      : int(degree.sum()) // 2,
+        "dead_ends"         : int((degree == 1).sum()),
+        "straights"         : int(straight.sum()),
+        "turns"             : int(((degree == 2) & ~straight).sum()),
+        "junctions"         : int((degree == 3).sum()),
+        "crossroads"        : int((degree == 4).sum()),
+        "num_corridors"     : int(len(lengths)),
+        "corridor_mean"     : float(lengths.mean()) if len(lengths) > 0 else 0.0,
+        "corridor_max"      : int(lengths.max()) if len(lengths) > 0 else 0,
+        "corridor_histogram": np.bincount(lengths).tolist() if len(lengths) > 0 else [],
+        "longest_path"      : max(0, len(diameter) - 1),
+        "longest_path_ends" : (int(diameter[0]), int(diameter[-1])) if len(diameter) > 0 else None,
+    }
+
+
+# The path by the centers of the cells, the collinear steps merged.
+def solution_path_d(path, cols, w):
+    if len(path) == 0:
+        return ""
+    c = w / 2
+    points = [path[0]]
+    for k in range(1, len(path) - 1):
+        if path[k] - path[k - 1] != path[k + 1] - path[k]:
+            points.append(path[k])
+    if len(path) > 1:
+        points.append(path[-1])
+    parts = []
+    for k, index in enumerate(points):
+        parts.append("%s%g %g" % ("M" if k == 0 else "L", (index % cols) * w + c, (index // cols) * w + c))
+    return "".join(parts)
+
+
+# Writes the final maze (compact SVG) with the solution over it.
+def write_solution_svg(filepath, gen_maze, path, color=SOLUTION_COLOR, stroke_width="1.6mm"):
+    from masked_maze_generator_svg import visited_path, walls_path
+    dwg = svgwrite.Drawing(filepath, size=BOARD_SIZE, debug=False)
+    dwg.viewbox(0, 0, gen_maze.x_max, gen_maze.y_max)
+    dwg.defs.add(dwg.style(CSS_STYLES))
+    dwg.add(dwg.rect(size=('100%','100%'), class_='background'))
+    d_visited = visited_path(gen_maze.grid, gen_maze.w)
+    if d_visited:
+        dwg.add(dwg.path(d=d_visited, class_="bluesquare"))
+    dwg.add(dwg.path(d=walls_path(gen_maze.grid, gen_maze.w), class_="line", fill="none"))
+    d_solution = solution_path_d(path, gen_maze.cols, gen_maze.w)
+    if d_solution:
+        dwg.add(dwg.path(d=d_solution, fill="none", stroke=svgwrite.rgb(*color), stroke_width=stroke_width,
+                         stroke_linecap="round", stroke_linejoin="round"))
+    dwg.save()
+
+
+# Paints the solution in the framebuffer of a RasterFrameRenderer, a line
+# of width pixels by the centers of the cells.
+def draw_solution(renderer, path, color=SOLUTION_COLOR, width=None):
+    if width == None:
+        width = max(1, renderer.cell_px // 3)
+    fb    = renderer.framebuffer
+    cols  = renderer.cols
+    cp    = renderer.cell_px
+    color = np.array(color, dtype=np.uint8)
+    lo    = cp // 2 - width // 2
+    for k in range(len(path)):
+        index_a = path[k]
+        index_b = path[k + 1] if k + 1 < len(path) else index_a
+        i0, i1 = sorted((index_a % cols, index_b % cols))
+        j0, j1 = sorted((index_a // cols, index_b // cols))
+        fb[j0 * cp + lo:j1 * cp + lo + width, i0 * cp + lo:i1 * cp + lo + width] = color
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import os
+    import tempfile
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+    from masked_maze_generator_raster import RasterFrameRenderer
+
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst,
+                                                                         write_mask_test=False)
+    mz = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
+                        cell_len=cell_len, mask=mask)
+    mz.set_seed(1)
+    mz.generate_headless()
+    grid = mz.grid
+
+    # The longest path is longer than (or as long as) the path from the
+    # start to any other cell, and it's a valid path, without walls.
+    path = longest_path(grid)
+    passages = passage_bits(grid)
+    dist, _, _ = bfs(passages, grid.cols, mz.start_index)
+    if len(path) - 1 < max(dist):
+        ok = False
+    for index_a, index_b in zip(path[:-1], path[1:]):
+        if index_b - index_a not in offsets_table(grid.cols)[passages[index_a]]:
+            ok = False
+    if list(solve(grid, path[-1], path[0])) != list(reversed(path)):
+        ok = False
+
+    # A tree, passages = cells - 1, and each corridor passage counted once.
+    stats = maze_stats(grid)
+    if stats["num_passages"] != stats["num_cells"] - 1 or stats["longest_path"] != len(path) - 1:
+        ok = False
+    num_nodes = stats["num_cells"] - stats["straights"] - stats["turns"]
+    if stats["num_corridors"] != num_nodes - 1:
+        ok = False
+    if stats["dead_ends"] != stats["junctions"] + 2 * stats["crossroads"] + 2:
+        ok = False
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, "solution.svg")
+        write_solution_svg(filepath, mz, path)
+        if os.path.getsize(filepath) > 30000:
+            ok = False
+    renderer = RasterFrameRenderer(mz, scale=2)
+    renderer.walls[:]   = grid.walls
+    renderer.visited[:] = grid.visited
+    renderer.redraw_all()
+    draw_solution(renderer, path)
+    num_px = np.all(renderer.framebuffer == SOLUTION_COLOR, axis=2).sum()
+    if num_px < len(path) * (renderer.cell_px // 3) ** 2:
+        ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the maze solver....\n\n")
+    runTests()
+    print("\n...Finished running tests to the maze solver....")
@@ -0,0 +1,182 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_svg.py                               #
+# Description: Compact SVG writer for the frames of the masked Maze   #
+#              Generator. Instead of one group with 4 lines for each  #
+#              cell (each interior wall written twice), each wall is  #
+#              written once and the collinear walls are merged in     #
+#              long runs, all inside one <path>. The visited cells    #
+#              are merged in horizontal runs inside one <path> too.   #
+#              The runs are found with NumPy over the arrays of the   #
+#              MazeGrid.                                              #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -svgwrite
+#   -numpy
+
+import numpy as np
+
+import svgwrite
+
+from masked_maze_generator_core import BOARD_SIZE, CSS_STYLES
+from masked_maze_generator_core import WALL_TOP, WALL_RIGHT, WALL_BOTTOM, WALL_LEFT
+
+
+# Runs of True along the rows of a 2D boolean array.
+# Return's (row, start, length) arrays.
+def find_runs(flags):
+    rows = flags.shape[0]
+    padded = np.zeros((rows, flags.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = flags
+    diff = np.diff(padded, axis=1)
+    row_starts, starts = np.nonzero(diff == 1)
+    _, ends = np.nonzero(diff == -1)
+    return (row_starts, starts, ends - starts)
+
+
+# The edges with a wall, each one once. horizontal[r, i] is the edge on
+# the line y = r of the column i, vertical[j, c] the edge on the line
+# x = c of the row j. Only the walls of the cells inside the mask count.
+def wall_edges(grid):
+    return wall_edges_arrays(grid.walls_2d(), grid.mask_2d())
+
+
+# The same for 2D arrays of walls and mask, ex: a strip of rows.
+def wall_edges_arrays(walls, inside):
+    rows, cols = walls.shape
+    inside = inside.astype(bool)
+    horizontal = np.zeros((rows + 1, cols), dtype=bool)
+    horizontal[:-1, :] |= inside & (walls & WALL_TOP    != 0)
+    horizontal[1:,  :] |= inside & (walls & WALL_BOTTOM != 0)
+    vertical = np.zeros((rows, cols + 1), dtype=bool)
+    vertical[:, :-1] |= inside & (walls & WALL_LEFT  != 0)
+    vertical[:, 1:]  |= inside & (walls & WALL_RIGHT != 0)
+    return (horizontal, vertical)
+
+
+def walls_path(grid, w):
+    horizontal, vertical = wall_edges(grid)
+    return edges_path(horizontal, vertical, w)
+
+
+# Path of the edges, row_offset is the first row when they are of a strip.
+def edges_path(horizontal, vertical, w, row_offset=0):
+    parts = []
+    r, start, length = find_runs(horizontal)
+    parts.extend("M%d %dh%d" % (x, y, l) for x, y, l in zip((start * w).tolist(), ((r + row_offset) * w).tolist(), (length * w).tolist()))
+    c, start, length = find_runs(vertical.T)
+    parts.extend("M%d %dv%d" % (x, y, l) for x, y, l in zip((c * w).tolist(), ((start + row_offset) * w).tolist(), (length * w).tolist()))
+    return "".join(parts)
+
+
+def visited_path(grid, w):
+    visited = grid.visited_2d().astype(bool) & grid.mask_2d().astype(bool)
+    return squares_path(visited, w)
+
+
+def squares_path(flags, w, row_offset=0):
+    j, start, length = find_runs(flags)
+    return "".join("M%d %dh%dv%dh-%dz" % (x, y, l, w, l)
+                   for x, y, l in zip((start * w).tolist(), ((j + row_offset) * w).tolist(), (length * w).tolist()))
+
+
+# Writes one frame of the maze: background, visited squares, walls and the
+# highlighted current cell. The walls are all over the visited squares,
+# in draw_step() the square of a cell can cover half of an earlier wall.
+def write_compact_svg_frame(filepath, grid, w, x_max, y_max, highlight_index=-1):
+    dwg = svgwrite.Drawing(filepath, size=BOARD_SIZE, debug=False)
+    dwg.viewbox(0, 0, x_max, y_max)
+    dwg.defs.add(dwg.style(CSS_STYLES))
+    dwg.add(dwg.rect(size=('100%','100%'), class_='background'))
+
+    d_visited = visited_path(grid, w)
+    if d_visited:
+        dwg.add(dwg.path(d=d_visited, class_="bluesquare"))
+    d_walls = walls_path(grid, w)
+    if d_walls:
+        dwg.add(dwg.path(d=d_walls, class_="line", fill="none"))
+    if highlight_index >= 0:
+        x = (highlight_index % grid.cols) * w
+        y = (highlight_index // grid.cols) * w
+        dwg.add(dwg.rect(insert=(x, y), size=(w, w), class_="highlightsquare"))
+    dwg.save()
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import re
+    import tempfile
+    import os
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+
+    # The unit edges of the merged path are exactly the walls of the cells.
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    i_init, j_init, mask, mask_img_x_max, mask_img_y_max  = process_mask(filepath_mask, cell_len, color_mask_lst )
+    mz = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
+                        cell_len=cell_len, mask=mask)
+    mz.set_seed(1)
+    for _ in range(300):
+        mz.step()
+
+    edges_expected = set()
+    for index in mz.inside_mask_index_lst:
+        cell = mz.cell_at(index)
+        i, j = cell.i, cell.j
+        walls = cell.walls
+        if walls[0]: edges_expected.add(("h", i, j))
+        if walls[1]: edges_expected.add(("v", i + 1, j))
+        if walls[2]: edges_expected.add(("h", i, j + 1))
+        if walls[3]: edges_expected.add(("v", i, j))
+
+    edges_path = set()
+    for x, y, direction, length in re.findall(r"M(\d+) (\d+)([hv])(\d+)", walls_path(mz.grid, cell_len)):
+        x, y, length = int(x) // cell_len, int(y) // cell_len, int(length) // cell_len
+        for k in range(length):
+            if direction == "h":
+                edges_path.add(("h", x + k, y))
+            else:
+                edges_path.add(("v", x, y + k))
+    if edges_path != edges_expected:
+        ok = False
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, "compact.svg")
+        write_compact_svg_frame(filepath, mz.grid, cell_len, mask_img_x_max, mask_img_y_max, mz.curr_index)
+        if os.path.getsize(filepath) > 20000:
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the compact SVG writer....\n\n")
+    runTests()
+    print("\n...Finished running tests to the compact SVG writer....")
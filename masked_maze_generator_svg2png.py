@@ -0,0 +1,174 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_svg2png.py                           #
+# Description: Parallel SVG -> PNG rasterization for the masked Maze  #
+#              Generator. The files are split in chunks over a pool   #
+#              of processes (svglib + reportlab renderPM are single   #
+#              threaded), the results come back in the same order of  #
+#              the input so the output is deterministic. It works     #
+#              after generate() or on an existing SVG directory, for  #
+#              recovery runs.                                         #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -svglib
+#   -reportlab
+#   -Pillow
+
+import os
+import sys
+import time
+import multiprocessing
+
+from svglib.svglib import svg2rlg
+from reportlab.graphics import renderPM
+
+from PIL import Image
+
+
+# Runs in the worker processes.
+def rasterize_svg_file(filepath_pair):
+    filepath_svg, filepath_png = filepath_pair
+    drawing = svg2rlg(filepath_svg)
+    renderPM.drawToFile(drawing, filepath_png, fmt="PNG")
+    return filepath_png
+
+
+# A PNG that exists, isn't truncated (the CRC's of all the chunks) and
+# isn't older than it's SVG, if filepath_svg isn't None.
+def is_valid_png(filepath_png, filepath_svg=None):
+    try:
+        if filepath_svg != None and os.path.getmtime(filepath_png) < os.path.getmtime(filepath_svg):
+            return False
+        with Image.open(filepath_png) as img:
+            if img.format != "PNG":
+                return False
+            img.verify()
+    except (OSError, SyntaxError, ValueError):
+        return False
+    return True
+
+
+def default_chunksize(num_files, workers):
+    # About 4 chunks for each worker, to balance the load at the end.
+    return max(1, num_files // (workers * 4))
+
+
+# Progress line, rewritten in place.
+def print_progress(done, total, time_start):
+    elapsed = time.time() - time_start
+    eta = elapsed / done * (total - done) if done > 0 else 0.0
+    sys.stdout.write("\r  %d / %d PNG's, %.1fs elapsed, ETA %.1fs " % (done, total, elapsed, eta))
+    if done == total:
+        sys.stdout.write("\n")
+    sys.stdout.flush()
+
+
+# Converts each (filepath_svg, filepath_png) pair. workers=None uses all
+# the cores, workers=1 runs in this process. progress is called as
+# progress(done, total, time_start) after each file.
+# Return's the list of PNG file paths in the same order of the input.
+def rasterize_svg_lst(filepath_pair_lst, workers=None, chunksize=None, progress=print_progress):
+    total = len(filepath_pair_lst)
+    if workers == None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, total))
+    if chunksize == None:
+        chunksize = default_chunksize(total, workers)
+
+    time_start = time.time()
+    filepath_png_lst = []
+    if workers == 1:
+        results = map(rasterize_svg_file, filepath_pair_lst)
+        for filepath_png in results:
+            filepath_png_lst.append(filepath_png)
+            if progress != None:
+                progress(len(filepath_png_lst), total, time_start)
+        return filepath_png_lst
+
+    with multiprocessing.Pool(processes=workers) as pool:
+        # imap keeps the order of the input.
+        for filepath_png in pool.imap(rasterize_svg_file, filepath_pair_lst, chunksize=chunksize):
+            filepath_png_lst.append(filepath_png)
+            if progress != None:
+                progress(len(filepath_png_lst), total, time_start)
+    return filepath_png_lst
+
+
+# Converts all the SVG's of a directory, sorted by name, for recovery runs
+# on an existing "./a_output_svg/". With skip_existing the PNG's that
+# already exist and are valid aren't generated again.
+def rasterize_svg_dir(svg_dir_path_from, png_dir_path_to, workers=None, chunksize=None,
+                      progress=print_progress, skip_existing=False):
+    files_svg_lst = sorted(fn for fn in os.listdir(svg_dir_path_from) if fn.endswith(".svg"))
+    filepath_pair_lst = []
+    for file_svg in files_svg_lst:
+        filepath_png = os.path.join(png_dir_path_to, file_svg[:-4] + ".png")
+        filepath_svg = os.path.join(svg_dir_path_from, file_svg)
+        if skip_existing and is_valid_png(filepath_png, filepath_svg):
+            continue
+        filepath_pair_lst.append((filepath_svg, filepath_png))
+    print("Start converting %d SVG's to PNG with %s workers ..." % (len(filepath_pair_lst), workers or os.cpu_count()))
+    filepath_png_lst = rasterize_svg_lst(filepath_pair_lst, workers, chunksize, progress)
+    print("...ending converting SVG's to PNG")
+    return filepath_png_lst
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+    import numpy as np
+    from PIL import Image
+
+    # Serial and parallel rasterization give the same PNG's in the same order.
+    svg_dir = "./a_output_svg/"
+    files_svg_lst = sorted(fn for fn in os.listdir(svg_dir) if fn.endswith(".svg"))[:6]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        outputs = []
+        for workers in [1, 3]:
+            png_dir = os.path.join(tmp_dir, "png_%d" % workers)
+            os.mkdir(png_dir)
+            pair_lst = [(svg_dir + fn, os.path.join(png_dir, fn[:-4] + ".png")) for fn in files_svg_lst]
+            filepath_png_lst = rasterize_svg_lst(pair_lst, workers=workers, chunksize=1, progress=None)
+            if filepath_png_lst != [png for _, png in pair_lst]:
+                ok = False
+            data_lst = []
+            for filepath_png in filepath_png_lst:
+                with Image.open(filepath_png) as im:
+                    data_lst.append(np.asarray(im.convert("RGB"), dtype=np.int16))
+            outputs.append(data_lst)
+        # renderPM antialiasing isn't bit exact between runs, 1 level of difference.
+        for data_1, data_n in zip(*outputs):
+            if data_1.shape != data_n.shape or np.abs(data_1 - data_n).max() > 1:
+                ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the parallel SVG to PNG....\n\n")
+    runTests()
+    print("\n...Finished running tests to the parallel SVG to PNG....")
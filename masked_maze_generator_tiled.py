@@ -0,0 +1,469 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_tiled.py                             #
+# Description: Out of core generation for gigapixel masks (wall sized #
+#              prints with hundreds of millions of cells). The mask   #
+#              and the walls live in np.memmap files (1 byte / cell   #
+#              each) inside a store dir, only one tile of cells is    #
+#              in memory at a time.                                   #
+#                                                                     #
+#              Each tile is carved alone, one tree for each blob of   #
+#              the mask inside the tile, with it's own seed (so the   #
+#              tiles can be carved in parallel). Then the trees are   #
+#              stitched across the tile borders, a random passage on  #
+#              the border is opened only if it joins 2 trees that     #
+#              aren't connected yet (union-find of the trees), so the #
+#              result is a perfect maze on each blob of the mask.     #
+#                                                                     #
+#              The final SVG and PNG are written strip by strip, the  #
+#              PNG with a streaming zlib encoder. The memory is about #
+#              one tile + one strip + a few ints for each tree.       #
+#######################################################################
+
+# Note: External libraries that have to be installed:
+#   -numpy
+#   -pillow
+
+import os
+import json
+import zlib
+import struct
+import random
+import multiprocessing
+from array import array
+
+import numpy as np
+
+# Pillow lib
+from PIL import Image
+
+from masked_maze_generator_core import MazeGenerator, sample_mask, calc_num_squares
+from masked_maze_generator_core import BOARD_WIDTH, BOARD_HEIGHT, CSS_STYLES, EVENT_END
+from masked_maze_generator_core import WALL_TOP, WALL_RIGHT, WALL_BOTTOM, WALL_LEFT, WALL_ALL
+from masked_maze_generator_components import label_mask_components, component_boxes
+from masked_maze_generator_svg import wall_edges_arrays, edges_path, squares_path
+from masked_maze_generator_raster import RASTER_COLORS
+
+
+# The mask and the walls of a maze in memory mapped files inside dirpath.
+# With cols and rows it creates a new store, without them it opens the
+# existing one.
+class TiledMazeStore:
+
+    def __init__(self, dirpath, cols=None, rows=None, cell_len=1, x_max=None, y_max=None):
+        self.dirpath = dirpath
+        self.filepath_meta = os.path.join(dirpath, "meta.json")
+        if cols == None:
+            with open(self.filepath_meta) as f:
+                self.meta = json.load(f)
+            mode = "r+"
+        else:
+            os.makedirs(dirpath, exist_ok=True)
+            self.meta = {
+                "cols"     : cols,
+                "rows"     : rows,
+                "cell_len" : cell_len,
+                "x_max"    : x_max if x_max != None else cols * cell_len,
+                "y_max"    : y_max if y_max != None else rows * cell_len,
+            }
+            self.save_meta()
+            mode = "w+"
+        self.cols     = self.meta["cols"]
+        self.rows     = self.meta["rows"]
+        self.cell_len = self.meta["cell_len"]
+        shape = (self.rows, self.cols)
+        self.mask  = np.memmap(os.path.join(dirpath, "mask.u8"),  dtype=np.uint8, mode=mode, shape=shape)
+        self.walls = np.memmap(os.path.join(dirpath, "walls.u8"), dtype=np.uint8, mode=mode, shape=shape)
+
+
+    def save_meta(self):
+        with open(self.filepath_meta, "w") as f:
+            json.dump(self.meta, f, indent=1)
+
+
+    def flush(self):
+        self.mask.flush()
+        self.walls.flush()
+        self.save_meta()
+
+
+# The image of the mask as an array (rows, cols, channels). A .npy file is
+# memory mapped, for gigapixel masks convert the image once to .npy
+# (uint8, 3 channels). Other formats are decoded by Pillow in memory.
+def open_mask_image(filepath_mask):
+    if filepath_mask.endswith(".npy"):
+        return np.load(filepath_mask, mmap_mode="r")
+    Image.MAX_IMAGE_PIXELS = None
+    im = Image.open(filepath_mask)
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    img_array = np.asarray(im)
+    im.close()
+    return img_array
+
+
+# Samples the mask image strip by strip (strip_rows rows of cells) into a
+# new store. Return's the store.
+def process_mask_tiled(filepath_mask, cell_len, color_mask_lst, dirpath, tolerance=0, strip_rows=256):
+    img_array = open_mask_image(filepath_mask)
+    y_max, x_max = img_array.shape[:2]
+    cols = calc_num_squares(x_max, cell_len)
+    rows = calc_num_squares(y_max, cell_len)
+    print("Start sampling mask %s, %d x %d cells ..." % (filepath_mask, cols, rows))
+    store = TiledMazeStore(dirpath, cols, rows, cell_len, x_max, y_max)
+    for r0 in range(0, rows, strip_rows):
+        r1 = min(rows, r0 + strip_rows)
+        strip = img_array[r0 * cell_len:r1 * cell_len]
+        store.mask[r0:r1] = sample_mask(strip, cell_len, color_mask_lst, tolerance)
+    store.flush()
+    print("...ending sampling mask")
+    return store
+
+
+# Carves one tile, in a worker process, and writes it's walls in the
+# store. Each blob of the mask inside the tile is a tree. Return's the
+# number of trees and the tree number of the cells on the 4 borders of
+# the tile (-1 outside the mask).
+def carve_tile(args):
+    dirpath, r0, c0, tile_rows, tile_cols, seed, algorithm_name = args
+    store = TiledMazeStore(dirpath)
+    tile_mask = np.array(store.mask[r0:r0 + tile_rows, c0:c0 + tile_cols], dtype=bool)
+    labels, num_trees = label_mask_components(tile_mask)
+    tile_walls = np.full(tile_mask.shape, WALL_ALL, dtype=np.uint8)
+
+    rng = random.Random(seed)
+    for label, (b_r0, b_c0, b_r1, b_c1, i_first, j_first) in enumerate(component_boxes(labels, num_trees)):
+        sub_mask = labels[b_r0:b_r1, b_c0:b_c1] == label
+        i_start, j_start = i_first - b_c0, j_first - b_r0
+        mz = MazeGenerator(i_init=i_start, j_init=j_start, x_max=b_c1 - b_c0, y_max=b_r1 - b_r0, cell_len=1,
+                           mask=sub_mask)
+        mz.set_seed(rng.getrandbits(64))
+        if algorithm_name != None:
+            from masked_maze_generator_algorithms import ALGORITHMS
+            mz.set_algorithm(ALGORITHMS[algorithm_name]())
+        while mz.step() != EVENT_END:
+            pass
+        tile_walls[b_r0:b_r1, b_c0:b_c1][sub_mask] = mz.grid.walls_2d()[sub_mask]
+
+    store.walls[r0:r0 + tile_rows, c0:c0 + tile_cols] = tile_walls
+    store.walls.flush()
+    borders = (labels[:, 0].copy(), labels[0, :].copy(), labels[:, -1].copy(), labels[-1, :].copy())
+    return (num_trees, borders)
+
+
+# The possible passages across a border, (index_a, tree_a, tree_b) where
+# both cells are inside the mask, a is on the left or on the top.
+def border_candidates(tree_a, tree_b, index_a):
+    sel = np.flatnonzero((tree_a >= 0) & (tree_b >= 0))
+    return list(zip(index_a[sel].tolist(), tree_a[sel].tolist(), tree_b[sel].tolist()))
+
+
+# Generates the maze of the store, tile_size x tile_size cells for each
+# tile, over workers processes. algorithm is a name of ALGORITHMS of
+# masked_maze_generator_algorithms.py, None is the recursive backtracker.
+# The same seed gives the same maze with any number of workers.
+def generate_tiled(store, seed, tile_size=1024, workers=1, algorithm=None):
+    cols, rows = store.cols, store.rows
+    tile_lst = [(r0, c0) for r0 in range(0, rows, tile_size) for c0 in range(0, cols, tile_size)]
+    job_lst = [(store.dirpath, r0, c0, min(tile_size, rows - r0), min(tile_size, cols - c0),
+                "%s-%d-%d" % (seed, r0, c0), algorithm) for r0, c0 in tile_lst]
+    print("Start generating tiled maze, %d x %d cells in %d tiles ..." % (cols, rows, len(job_lst)))
+    store.walls.flush()
+
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+        results = pool.imap(carve_tile, job_lst)
+    else:
+        pool = None
+        results = map(carve_tile, job_lst)
+
+    stitch_rng   = random.Random("%s-stitch" % seed)
+    parent       = array('l')                              # Union-find of all the trees.
+    bottom_trees = np.full(cols, -1, dtype=np.int64)       # Trees of the last row of the tiles above.
+    right_trees  = None                                    # Trees of the right column of the tile on the left.
+    num_passages = 0
+    try:
+        for (r0, c0), (num_trees, borders) in zip(tile_lst, results):
+            offset = len(parent)
+            parent.extend(range(offset, offset + num_trees))
+            left, top, right, bottom = [np.where(border >= 0, border + offset, -1) for border in borders]
+            tile_rows, tile_cols = len(left), len(top)
+
+            # Left border, passages to the right. Top border, passages to the bottom.
+            candidate_lst = []
+            if c0 > 0:
+                index_a = (np.arange(r0, r0 + tile_rows) * cols + c0 - 1)
+                candidate_lst.extend((a, WALL_RIGHT, ta, tb) for a, ta, tb in border_candidates(right_trees, left, index_a))
+            if r0 > 0:
+                index_a = (r0 - 1) * cols + np.arange(c0, c0 + tile_cols)
+                candidate_lst.extend((a, WALL_BOTTOM, ta, tb) for a, ta, tb in
+                                     border_candidates(bottom_trees[c0:c0 + tile_cols], top, index_a))
+            stitch_rng.shuffle(candidate_lst)
+            for index_a, wall, tree_a, tree_b in candidate_lst:
+                root_a = find_root(parent, tree_a)
+                root_b = find_root(parent, tree_b)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+                    open_passage(store.walls, cols, index_a, wall)
+                    num_passages += 1
+
+            right_trees = right
+            bottom_trees[c0:c0 + tile_cols] = bottom
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+
+    num_trees = sum(1 for k in range(len(parent)) if find_root(parent, k) == k)
+    store.meta["seed"]      = seed
+    store.meta["tile_size"] = tile_size
+    store.meta["algorithm"] = algorithm
+    store.meta["num_trees"] = num_trees
+    store.flush()
+    print("...ending generating tiled maze, %d stitches, %d trees" % (num_passages, num_trees))
+    return num_trees
+
+
+def find_root(parent, a):
+    while parent[a] != a:
+        parent[a] = parent[parent[a]]
+        a = parent[a]
+    return a
+
+
+def open_passage(walls, cols, index_a, wall):
+    j, i = divmod(index_a, cols)
+    if wall == WALL_RIGHT:
+        walls[j, i]     &= ~WALL_RIGHT & 0xFF
+        walls[j, i + 1] &= ~WALL_LEFT & 0xFF
+    else:
+        walls[j, i]     &= ~WALL_BOTTOM & 0xFF
+        walls[j + 1, i] &= ~WALL_TOP & 0xFF
+
+
+# The edges with a wall of the rows r0 to r1, each one once. The line on
+# top of the strip is in the strip, the line at the bottom only in the
+# last one.
+def strip_wall_edges(store, r0, r1):
+    a0 = max(0, r0 - 1)
+    horizontal, vertical = wall_edges_arrays(np.asarray(store.walls[a0:r1]), np.asarray(store.mask[a0:r1]))
+    horizontal = horizontal[r0 - a0:]
+    if r1 < store.rows:
+        horizontal = horizontal[:-1]
+    return (horizontal, vertical[r0 - a0:])
+
+
+# Writes the final maze as SVG, strip by strip, one path for the squares
+# and one for the walls of each strip, the same look of the compact SVG.
+def write_tiled_svg(store, filepath, strip_rows=256):
+    w = store.cell_len
+    with open(filepath, "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+        f.write('<svg baseProfile="full" height="%s" version="1.1" viewBox="0,0,%d,%d" width="%s" '
+                'xmlns="http://www.w3.org/2000/svg" xmlns:ev="http://www.w3.org/2001/xml-events" '
+                'xmlns:xlink="http://www.w3.org/1999/xlink">' % (BOARD_HEIGHT, store.meta["x_max"], store.meta["y_max"], BOARD_WIDTH))
+        f.write('<defs><style type="text/css"><![CDATA[%s]]></style></defs>' % CSS_STYLES)
+        f.write('<rect class="background" height="100%" width="100%" x="0" y="0" />')
+        for r0 in range(0, store.rows, strip_rows):
+            r1 = min(store.rows, r0 + strip_rows)
+            d_squares = squares_path(np.asarray(store.mask[r0:r1]).astype(bool), w, r0)
+            if d_squares:
+                f.write('<path class="bluesquare" d="%s" />' % d_squares)
+        for r0 in range(0, store.rows, strip_rows):
+            r1 = min(store.rows, r0 + strip_rows)
+            horizontal, vertical = strip_wall_edges(store, r0, r1)
+            d_walls = edges_path(horizontal, vertical, w, r0)
+            if d_walls:
+                f.write('<path class="line" d="%s" fill="none" />' % d_walls)
+        f.write('</svg>\n')
+
+
+# PNG written row by row, 8 bit palette, the rows go through one zlib
+# stream so the image is never all in memory.
+class PngStripWriter:
+
+    def __init__(self, filepath, width, height, palette):
+        self.width  = width
+        self.height = height
+        self.fp     = open(filepath, "wb")
+        self.zlib   = zlib.compressobj(6)
+        self.fp.write(b"\x89PNG\r\n\x1a\n")
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+        self.write_chunk(b"PLTE", bytes(c for color in palette for c in color))
+
+
+    def write_chunk(self, chunk_type, data):
+        self.fp.write(struct.pack(">I", len(data)))
+        self.fp.write(chunk_type)
+        self.fp.write(data)
+        self.fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF))
+
+
+    # rows is a uint8 array (n, width) of palette indexes.
+    def write_rows(self, rows):
+        filtered = np.zeros((rows.shape[0], self.width + 1), dtype=np.uint8)   # Filter type 0 on each row.
+        filtered[:, 1:] = rows
+        data = self.zlib.compress(filtered.tobytes())
+        if data:
+            self.write_chunk(b"IDAT", data)
+
+
+    def close(self):
+        self.write_chunk(b"IDAT", self.zlib.flush())
+        self.write_chunk(b"IEND", b"")
+        self.fp.close()
+
+
+# Palette indexes of the PNG.
+PNG_BACKGROUND = 0
+PNG_LINE       = 1
+PNG_SQUARE     = 2
+
+
+# Paints the final maze of the cell rows r0 to r1 like the
+# RasterFrameRenderer, cell_px pixels for each cell and the walls
+# centered on the edges (the lines on top and at the bottom of the strip
+# are half in it). Return's the rows of palette indexes.
+def render_strip(store, r0, r1, cell_px, line_width):
+    a0 = max(0, r0 - 1)
+    a1 = min(store.rows, r1 + 1)
+    horizontal, vertical = wall_edges_arrays(np.asarray(store.walls[a0:a1]), np.asarray(store.mask[a0:a1]))
+    horizontal = horizontal[r0 - a0:r1 - a0 + 1]     # Lines y = r0 to y = r1.
+    vertical   = vertical[r0 - a0:r1 - a0]
+    half = line_width // 2
+
+    strip = np.repeat(np.repeat(np.asarray(store.mask[r0:r1]) * np.uint8(PNG_SQUARE), cell_px, axis=0), cell_px, axis=1)
+    height, width = strip.shape
+
+    h_px = np.repeat(horizontal, cell_px, axis=1)
+    for t in range(line_width):
+        y = np.arange(len(horizontal)) * cell_px - half + t
+        sel = (y >= 0) & (y < height)
+        strip[y[sel]] = np.where(h_px[sel], np.uint8(PNG_LINE), strip[y[sel]])
+
+    v_px = np.repeat(vertical, cell_px, axis=0)
+    for t in range(line_width):
+        x = np.arange(store.cols + 1) * cell_px - half + t
+        sel = (x >= 0) & (x < width)
+        strip[:, x[sel]] = np.where(v_px[:, sel], np.uint8(PNG_LINE), strip[:, x[sel]])
+    return strip
+
+
+# Writes the final maze as a PNG, strip by strip.
+def write_tiled_png(store, filepath, cell_px=4, line_width=None, strip_rows=64, colors=None):
+    if line_width == None:
+        line_width = max(1, cell_px // store.cell_len)
+    palette_colors = dict(RASTER_COLORS)
+    if colors != None:
+        palette_colors.update(colors)
+    palette = [palette_colors["background"], palette_colors["line"], palette_colors["bluesquare"]]
+    width, height = store.cols * cell_px, store.rows * cell_px
+    print("Start writing tiled PNG %s, %d x %d pixels ..." % (filepath, width, height))
+    writer = PngStripWriter(filepath, width, height, palette)
+    try:
+        for r0 in range(0, store.rows, strip_rows):
+            writer.write_rows(render_strip(store, r0, min(store.rows, r0 + strip_rows), cell_px, line_width))
+    finally:
+        writer.close()
+    print("...ending writing tiled PNG")
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import tempfile
+
+    from masked_maze_generator_core import MazeGrid
+    from masked_maze_generator_raster import RasterFrameRenderer
+
+    # A mask with blobs that cross the tiles, 2 of them only touch
+    # diagonally, and a hole.
+    mask = np.zeros((70, 90), dtype=bool)
+    mask[3:60, 5:40]  = True
+    mask[20:30, 15:25] = False
+    mask[60:68, 40:85] = True
+    mask[5:15, 50:88]  = True
+    labels, num_blobs = label_mask_components(mask)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        walls_lst = []
+        for workers in [1, 3]:
+            store = TiledMazeStore(os.path.join(tmp_dir, "store_%d" % workers), 90, 70)
+            store.mask[:] = mask
+            num_trees = generate_tiled(store, seed=7, tile_size=16, workers=workers)
+            walls_lst.append(np.array(store.walls))
+            if num_trees != num_blobs:
+                ok = False
+        if not np.array_equal(walls_lst[0], walls_lst[1]):
+            ok = False
+
+        # A perfect maze on each blob, cells - blobs passages and connected.
+        grid = MazeGrid(90, 70, mask)
+        grid.walls[:] = walls_lst[0].tobytes()
+        num_passages = 0
+        seen = bytearray(90 * 70)
+        num_groups = 0
+        for start in np.flatnonzero(mask).tolist():
+            if seen[start]:
+                continue
+            num_groups += 1
+            seen[start] = 1
+            stack = [start]
+            while stack:
+                index = stack.pop()
+                for bit, offset in grid.directions:
+                    if grid.neighbor_bits[index] & bit and not grid.walls[index] & bit:
+                        num_passages += 1
+                        if not seen[index + offset]:
+                            seen[index + offset] = 1
+                            stack.append(index + offset)
+        if num_groups != num_blobs or num_passages // 2 != mask.sum() - num_blobs:
+            ok = False
+
+        # The PNG of the strips is the same of the RasterFrameRenderer.
+        filepath_png = os.path.join(tmp_dir, "tiled.png")
+        write_tiled_png(store, filepath_png, cell_px=5, line_width=3, strip_rows=7)
+        mz = MazeGenerator(i_init=5, j_init=3, x_max=90, y_max=70, cell_len=1, mask=mask)
+        renderer = RasterFrameRenderer(mz, scale=5, line_width=3)
+        renderer.walls[:]   = grid.walls
+        renderer.visited[:] = grid.inside_mask
+        renderer.redraw_all()
+        with Image.open(filepath_png) as im:
+            if not np.array_equal(np.asarray(im.convert("RGB")), renderer.framebuffer):
+                ok = False
+
+        filepath_svg = os.path.join(tmp_dir, "tiled.svg")
+        write_tiled_svg(store, filepath_svg, strip_rows=16)
+        from svglib.svglib import svg2rlg
+        if svg2rlg(filepath_svg) == None:
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the tiled generation....\n\n")
+    runTests()
+    print("\n...Finished running tests to the tiled generation....")
@@ -0,0 +1,403 @@
+#######################################################################
+# Author:  Joao Nuno Carvalho                                         #
+# Date:    25.02.2019                                                 #
+# License: MIT Open source                                            #
+# Mail:    joaonunocarv@gmail.com                                     #
+# File:    masked_maze_generator_trace.py                             #
+# Description: Instrumentation of the stages of the pipeline. A       #
+#              Tracer records for each stage (process_mask, the DFS,  #
+#              the SVG's, SVG -> PNG, the GIF) the wall and CPU time, #
+#              the peak RSS, the latency histogram of the frames, the #
+#              bytes written and gauges like the maximum depth of the #
+#              stack of the DFS. For long runs it shows a live        #
+#              progress line with the ETA.                            #
+#                                                                     #
+#              Optional cProfile and tracemalloc hooks. The result is #
+#              a JSON summary or a Chrome trace (chrome://tracing or  #
+#              https://ui.perfetto.dev).                              #
+#                                                                     #
+#              tracer = Tracer()                                      #
+#              with tracing(tracer):                                  #
+#                  ... process_mask(), mz.generate(), ...             #
+#              tracer.write_json("trace.json")                        #
+#              tracer.write_chrome_trace("trace_chrome.json")         #
+#                                                                     #
+#              Without a Tracer the code uses the NullTracer, it      #
+#              doesn't record anything.                               #
+#######################################################################
+
+import os
+import sys
+import json
+import math
+import time
+import cProfile
+import tracemalloc
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None     # Windows
+
+
+# Peak resident memory of this process, bytes, or None if unknown.
+def peak_rss_bytes():
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives KB and macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Records nothing, used when there is no Tracer active.
+class NullTracer:
+
+    active = False
+
+    def stage(self, name, **args):
+        return contextlib.nullcontext()
+
+
+    def clock(self):
+        return 0.0
+
+
+    # One frame of the stage name that started at time_start (clock()),
+    # the size of filepath is added to the bytes written.
+    def frame(self, name, time_start, filepath=None, nbytes=0):
+        pass
+
+
+    def progress(self, done, total=None):
+        pass
+
+
+    def count(self, name, value=1):
+        pass
+
+
+    def gauge(self, name, value):
+        pass
+
+
+# Histogram of latencies, buckets of powers of 2 microseconds.
+class LatencyHistogram:
+
+    def __init__(self):
+        self.count   = 0
+        self.total   = 0.0
+        self.min     = None
+        self.max     = 0.0
+        self.buckets = {}
+
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min == None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        bucket = 1 << max(0, int(math.ceil(math.log2(max(seconds * 1e6, 1.0)))))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+
+    # Upper bound (seconds) of the bucket of the percentile p (0 to 100).
+    def percentile(self, p):
+        target = self.count * p / 100.0
+        done = 0
+        for bucket in sorted(self.buckets):
+            done += self.buckets[bucket]
+            if done >= target:
+                return bucket / 1e6
+        return self.max
+
+
+    def to_dict(self):
+        return {
+            "count"       : self.count,
+            "total_s"     : self.total,
+            "mean_s"      : self.total / self.count if self.count > 0 else 0.0,
+            "min_s"       : self.min,
+            "max_s"       : self.max,
+            "p50_s"       : self.percentile(50),
+            "p90_s"       : self.percentile(90),
+            "p99_s"       : self.percentile(99),
+            "buckets_us"  : {str(bucket): num for bucket, num in sorted(self.buckets.items())},
+        }
+
+
+class Tracer(NullTracer):
+
+    active = True
+
+    # show_progress writes the live line to stream, at most each
+    # progress_interval seconds. profile runs cProfile while the tracer is
+    # active, trace_memory tracemalloc (the peak of Python memory of each
+    # stage). frame_events puts each frame in the Chrome trace (big files).
+    def __init__(self, show_progress=True, progress_interval=0.5, profile=False, trace_memory=False,
+                 frame_events=False, stream=None):
+        self.show_progress     = show_progress
+        self.progress_interval = progress_interval
+        self.profile           = cProfile.Profile() if profile else None
+        self.trace_memory      = trace_memory
+        self.frame_events      = frame_events
+        self.stream            = stream if stream != None else sys.stderr
+
+        self.time_origin   = time.perf_counter()
+        self.stage_lst     = []           # Finished stages, dicts.
+        self.stage_stack   = []           # Open stages, names.
+        self.histograms    = {}           # Frame name -> LatencyHistogram.
+        self.counters      = {}
+        self.gauges        = {}
+        self.event_lst     = []           # Frame events for the Chrome trace.
+        self.progress_time = 0.0
+        self.progress_line = False
+        self.progress_start = None
+
+
+    def start(self):
+        if self.profile != None:
+            self.profile.enable()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    def close(self):
+        if self.profile != None:
+            self.profile.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.end_progress_line()
+
+
+    def clock(self):
+        return time.perf_counter()
+
+
+    def micros(self, t):
+        return (t - self.time_origin) * 1e6
+
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        self.end_progress_line()
+        self.stage_stack.append(name)
+        self.progress_start = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start  = time.process_time()
+        try:
+            yield self
+        finally:
+            wall_end = time.perf_counter()
+            record = {
+                "name"     : name,
+                "parent"   : self.stage_stack[-2] if len(self.stage_stack) > 1 else None,
+                "start_us" : self.micros(wall_start),
+                "wall_s"   : wall_end - wall_start,
+                "cpu_s"    : time.process_time() - cpu_start,
+                "peak_rss" : peak_rss_bytes(),
+                "args"     : args,
+            }
+            if self.trace_memory and tracemalloc.is_tracing():
+                record["peak_traced"] = tracemalloc.get_traced_memory()[1]
+            self.stage_stack.pop()
+            self.end_progress_line()
+            self.stage_lst.append(record)
+
+
+    def frame(self, name, time_start, filepath=None, nbytes=0):
+        time_end = time.perf_counter()
+        histogram = self.histograms.get(name)
+        if histogram == None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.add(time_end - time_start)
+        if filepath != None:
+            nbytes += os.path.getsize(filepath)
+        if nbytes:
+            self.count(name + "_bytes", nbytes)
+        if self.frame_events:
+            self.event_lst.append((name, self.micros(time_start), (time_end - time_start) * 1e6))
+
+
+    # Live line "[stage] done / total  rate/s  ETA", total can be None.
+    def progress(self, done, total=None):
+        if not self.show_progress:
+            return
+        now = time.perf_counter()
+        if self.progress_start == None:
+            self.progress_start = (now, done)
+        if now - self.progress_time < self.progress_interval and (total == None or done < total):
+            return
+        self.progress_time = now
+        time_start, done_start = self.progress_start
+        rate = (done - done_start) / (now - time_start) if now > time_start else 0.0
+        stage = self.stage_stack[-1] if self.stage_stack else ""
+        if total != None and total > 0:
+            eta = (total - done) / rate if rate > 0 else 0.0
+            line = "[%s] %d / %d  %5.1f%%  %.1f/s  ETA %02d:%02d " % (stage, done, total, 100.0 * done / total,
+                                                                     rate, eta // 60, eta % 60)
+        else:
+            line = "[%s] %d  %.1f/s " % (stage, done, rate)
+        self.stream.write("\r" + line)
+        self.stream.flush()
+        self.progress_line = True
+
+
+    def end_progress_line(self):
+        if self.progress_line:
+            self.stream.write("\n")
+            self.stream.flush()
+            self.progress_line = False
+
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+    # Keeps the maximum of the values.
+    def gauge(self, name, value):
+        self.gauges[name] = max(value, self.gauges.get(name, value))
+
+
+    def to_dict(self):
+        return {
+            "stages"     : self.stage_lst,
+            "frames"     : {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            "counters"   : self.counters,
+            "gauges"     : self.gauges,
+            "peak_rss"   : peak_rss_bytes(),
+            "total_s"    : time.perf_counter() - self.time_origin,
+        }
+
+
+    def write_json(self, filepath):
+        with open(filepath, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+    # Chrome trace event format, one complete event for each stage (and
+    # frame), and the counters at the end.
+    def write_chrome_trace(self, filepath):
+        pid = os.getpid()
+        events = []
+        for record in self.stage_lst:
+            args = dict(record["args"], cpu_s=record["cpu_s"], peak_rss=record["peak_rss"])
+            events.append({"name": record["name"], "cat": "stage", "ph": "X", "pid": pid, "tid": 0,
+                           "ts": record["start_us"], "dur": record["wall_s"] * 1e6, "args": args})
+        for name, ts, dur in self.event_lst:
+            events.append({"name": name, "cat": "frame", "ph": "X", "pid": pid, "tid": 1, "ts": ts, "dur": dur})
+        ts_end = self.micros(time.perf_counter())
+        for name, value in list(self.counters.items()) + list(self.gauges.items()):
+            events.append({"name": name, "ph": "C", "pid": pid, "ts": ts_end, "args": {name: value}})
+        with open(filepath, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+    # Stats of cProfile, sorted by cumulative time.
+    def write_profile(self, filepath):
+        if self.profile != None:
+            self.profile.dump_stats(filepath)
+
+
+NULL_TRACER = NullTracer()
+current_tracer = NULL_TRACER
+
+
+def get_tracer():
+    return current_tracer
+
+
+def set_tracer(tracer):
+    global current_tracer
+    current_tracer = tracer if tracer != None else NULL_TRACER
+
+
+# The tracer is active inside the with, then closed.
+@contextlib.contextmanager
+def tracing(tracer):
+    previous = current_tracer
+    set_tracer(tracer)
+    tracer.start()
+    try:
+        yield tracer
+    finally:
+        tracer.close()
+        set_tracer(previous)
+
+
+###############
+# Unit test's #
+###############
+
+def test_01(res_lst):
+    # Test 01
+    print("\nRunning test 01....\n")
+    ok = True
+
+    import io
+    import tempfile
+
+    from masked_maze_generator_core import MazeGenerator, process_mask
+    # The same module that the core uses, not __main__.
+    import masked_maze_generator_trace as trace
+
+    filepath_mask  = "./png_masks/png_mask_peace_symbol_small.png"
+    cell_len       = 6
+    color_mask_lst = [ (0, 0, 0) ]
+
+    stream = io.StringIO()
+    tracer = Tracer(stream=stream, progress_interval=0.0, trace_memory=True, frame_events=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with trace.tracing(tracer):
+            i_init, j_init, mask, mask_img_x_max, mask_img_y_max = process_mask(filepath_mask, cell_len, color_mask_lst,
+                                                                                write_mask_test=False)
+            mz = MazeGenerator( i_init=i_init, j_init=j_init, x_max=mask_img_x_max, y_max=mask_img_y_max,
+                                cell_len=cell_len, mask=mask)
+            mz.set_seed(1)
+            mz.set_output_dir(tmp_dir)
+            mz.compact_svg = True
+            mz.generate()
+        if trace.get_tracer() != trace.NULL_TRACER:
+            ok = False
+
+        summary = tracer.to_dict()
+        stage_names = [record["name"] for record in summary["stages"]]
+        if stage_names != ["process_mask", "generate_svg"]:
+            ok = False
+        svg_bytes = sum(os.path.getsize(os.path.join(mz.subdir_svg, name)) for name in mz.file_svg_lst)
+        if summary["counters"].get("svg_frame_bytes") != svg_bytes:
+            ok = False
+        if summary["frames"]["svg_frame"]["count"] != len(mz.file_svg_lst):
+            ok = False
+        if summary["gauges"].get("max_stack_depth", 0) <= 0 or "ETA" not in stream.getvalue():
+            ok = False
+
+        filepath = os.path.join(tmp_dir, "trace_chrome.json")
+        tracer.write_chrome_trace(filepath)
+        with open(filepath) as f:
+            events = json.load(f)["traceEvents"]
+        if len([event for event in events if event.get("cat") == "frame"]) != len(mz.file_svg_lst):
+            ok = False
+
+    res_lst.append(ok)
+    if ok == True:
+        print("...Test 01 PASSED.")
+    else:
+        print("...Test 01 FAILED.")
+
+
+def runTests():
+    res = []
+
+    test_01(res)
+
+    if all(res):
+        print("\n** PASSED ALL TESTS! **")
+
+
+if __name__ == "__main__":
+    print("Start running tests to the tracer....\n\n")
+    runTests()
+    print("\n...Finished running tests to the tracer....")